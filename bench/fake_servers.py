@@ -0,0 +1,604 @@
+'''
+Local stand-ins for the servers bzjira talks to, for the benchmarks: Bugzilla
+REST, Bugzilla CGI (show_bug.cgi XML, buglist.cgi feed), Mantis SOAP with its
+WSDL, and the Jira REST calls the sync makes. Each serves synthetic data of a
+configurable volume, answers after a configurable latency and counts the
+requests it gets by endpoint. With gzip, responses are compressed for
+clients asking for it, like a web server with PHP zlib.output_compression.
+
+Not a benchmark by itself, see bench/sync.py.
+'''
+import base64
+import collections
+import fnmatch
+import gzip
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bzjira of this checkout, not an installed one
+sys.path.insert(0, ROOT)
+
+from bzjira.metrics import endpoint
+
+LAST_CHANGE = '2019-02-01T00:00:00Z'
+WORDS = ('volume', 'mount', 'fails', 'after', 'firmware', 'update', 'the',
+         'disk', 'raid', 'rebuild', 'log', 'kernel', 'error', 'expected',
+         'result', 'steps', 'to', 'reproduce', 'reboot', 'share', 'network',
+         'timeout', 'again', 'with', 'of', 'and', 'a', 'on', 'is', 'not')
+
+
+class Data(object):
+    '''
+    Synthetic source issues 1..issues, each with comments comments and
+    attachments attachments of attachment_bytes. Odd ids are resolved.
+    Attachments are random bytes, which do not compress (like images or
+    archives), comments random words, which compress about as well as
+    prose, so compression is not overstated.
+    '''
+    def __init__(self, issues=100, comments=5, attachments=2,
+                 attachment_bytes=64 * 1024, comment_bytes=1000):
+        self.ids = list(range(1, issues + 1))
+        self.comments = comments
+        self.attachments = attachments
+        rand = random.Random(0)
+        self.content = bytes(rand.getrandbits(8)
+                             for _ in range(attachment_bytes))
+        words = []
+        while sum(len(w) + 1 for w in words) < comment_bytes:
+            words.append(rand.choice(WORDS))
+        self.text = ' '.join(words)[:comment_bytes]
+
+    def resolved(self, issue_id):
+        return issue_id % 2 == 1
+
+    def attachment_ids(self, issue_id):
+        return [issue_id * 100 + i for i in range(self.attachments)]
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and a small body are two writes, without this the body waits
+    # for the client's delayed ACK on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        self.server.count(self.command, endpoint(
+            self.path, self.headers.get('SOAPAction')))
+        time.sleep(self.server.latency)
+        self.server.route(self, self.command, url.path)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def send(self, body, status=200, content_type='application/json',
+             headers=()):
+        if not isinstance(body, bytes):
+            if content_type == 'application/json':
+                body = json.dumps(body)
+            body = body.encode('utf-8')
+        if (self.server.gzip and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            body = gzip.compress(body, 6)
+            headers = list(headers) + [('Content-Encoding', 'gzip')]
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send({'error': True, 'message': 'not found'}, 404)
+
+
+class FakeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, gzip=False):
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0),
+                                                 Handler)
+        self.latency = latency
+        self.gzip = gzip
+        self.requests = collections.Counter()
+        self._lock = threading.Lock()
+        self.url = 'http://127.0.0.1:%d' % self.server_port
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count(self, method, path):
+        with self._lock:
+            self.requests[method + ' ' + path] += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def route(self, handler, method, path):
+        handler.not_found()
+
+
+class FakeBugzillaREST(FakeServer):
+    def __init__(self, data, latency=0.0):
+        FakeServer.__init__(self, latency)
+        self.data = data
+
+    def bug(self, bug_id):
+        resolved = self.data.resolved(bug_id)
+        return {
+            'id': bug_id, 'summary': 'Volume %d fails to mount' % bug_id,
+            'priority': 'P1' if bug_id % 5 == 0 else 'P2',
+            'status': 'RESOLVED' if resolved else 'CONFIRMED',
+            'resolution': 'FIXED' if resolved else '',
+            'last_change_time': LAST_CHANGE, 'product': 'NAS',
+            'component': 'Firmware', 'assigned_to': 'dev@example.com',
+        }
+
+    def comments(self, bug_id):
+        return [{'id': bug_id * 100 + i, 'count': i, 'creator': 'qa@example.com',
+                 'time': '2019-01-01T00:00:%02dZ' % i, 'text': self.data.text}
+                for i in range(self.data.comments + 1)]
+
+    def attachments(self, bug_id):
+        return [{'id': a, 'bug_id': bug_id, 'file_name': 'dmesg.txt',
+                 'size': len(self.data.content), 'content_type': 'text/plain',
+                 'summary': 'kernel log'}
+                for a in self.data.attachment_ids(bug_id)]
+
+    def route(self, h, method, path):
+        if path == '/rest/version':
+            return h.send({'version': '5.0.4'})
+        if path == '/rest/extensions':
+            return h.send({'extensions': {}})
+        if path == '/rest/login':
+            return h.send({'id': 1, 'token': '1-token'})
+        if path == '/rest/bug':
+            if 'id' in h.query:
+                ids = [int(i) for i in h.query['id'][0].split(',')]
+                return h.send({'bugs': [self.bug(i) for i in ids
+                                        if i in self.data.ids]})
+            return h.send({'bugs': [{'id': i} for i in self.data.ids]})
+        m = re.match(r'/rest/bug/(\d+)(/comment|/attachment)?$', path)
+        if m:
+            ids = [int(m.group(1))] + [int(i) for i in h.query.get('ids', [])]
+            if not m.group(2):
+                return h.send({'bugs': [self.bug(ids[0])]})
+            if m.group(2) == '/comment':
+                return h.send({'bugs': dict(
+                    (str(i), {'comments': self.comments(i)}) for i in ids)})
+            return h.send({'attachments': {}, 'bugs': dict(
+                (str(i), self.attachments(i)) for i in ids)})
+        m = re.match(r'/rest/bug/attachment/(\d+)$', path)
+        if m:
+            data = base64.b64encode(self.data.content).decode('ascii')
+            return h.send({'bugs': {},
+                           'attachments': {m.group(1): {'data': data}}})
+        h.not_found()
+
+
+class FakeBugzillaCGI(FakeBugzillaREST):
+    def bug_xml(self, bug_id):
+        bug = self.bug(bug_id)
+        parts = ['<bug><bug_id>%d</bug_id><short_desc>%s</short_desc>'
+                 '<priority>%s</priority><bug_status>%s</bug_status>'
+                 % (bug_id, escape(bug['summary']), bug['priority'],
+                    bug['status'])]
+        if bug['resolution']:
+            parts.append('<resolution>%s</resolution>' % bug['resolution'])
+        parts.append('<delta_ts>2019-02-01 00:00:00 +0000</delta_ts>')
+        for c in self.comments(bug_id):
+            parts.append(
+                '<long_desc isprivate="0"><commentid>%d</commentid>'
+                '<who name="QA">%s</who><bug_when>%s</bug_when>'
+                '<thetext>%s</thetext></long_desc>' % (
+                    c['id'], c['creator'], c['time'], escape(c['text'])))
+        for a in self.attachments(bug_id):
+            parts.append(
+                '<attachment isobsolete="0" ispatch="0" isprivate="0">'
+                '<attachid>%d</attachid><desc>%s</desc>'
+                '<filename>%s</filename><type>%s</type><size>%d</size>'
+                '</attachment>' % (a['id'], a['summary'], a['file_name'],
+                                   a['content_type'], a['size']))
+        parts.append('</bug>')
+        return ''.join(parts)
+
+    def route(self, h, method, path):
+        if path.startswith('/rest/'):
+            return h.not_found()
+        if path == '/index.cgi':
+            return h.send('<html></html>', content_type='text/html', headers=[
+                ('Set-Cookie', 'Bugzilla_logincookie=cookie; path=/')])
+        if path == '/show_bug.cgi':
+            ids = [int(i) for i in h.query.get('id', [])]
+            body = ''.join(self.bug_xml(i) if i in self.data.ids else
+                           '<bug error="NotFound"><bug_id>%d</bug_id></bug>' % i
+                           for i in ids)
+            return h.send('<?xml version="1.0" encoding="UTF-8" '
+                          'standalone="yes" ?><bugzilla version="4.2.1">%s'
+                          '</bugzilla>' % body, content_type='text/xml')
+        if path == '/buglist.cgi':
+            entries = ''.join('<entry><id>%s/show_bug.cgi?id=%d</id></entry>'
+                              % (self.url, i) for i in self.data.ids)
+            return h.send('<?xml version="1.0" encoding="UTF-8"?><feed '
+                          'xmlns="http://www.w3.org/2005/Atom">%s</feed>'
+                          % entries, content_type='application/atom+xml')
+        if path == '/attachment.cgi':
+            return h.send(self.data.content,
+                          content_type='application/octet-stream')
+        h.not_found()
+
+
+MANTIS_NS = 'http://futureware.biz/mantisconnect'
+
+WSDL = '''<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/"
+    xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="%(ns)s" targetNamespace="%(ns)s">
+<types>
+<xsd:schema targetNamespace="%(ns)s">
+ <xsd:import namespace="http://schemas.xmlsoap.org/soap/encoding/"/>
+ <xsd:import namespace="http://schemas.xmlsoap.org/wsdl/"/>
+ <xsd:complexType name="ObjectRef"><xsd:all>
+  <xsd:element name="id" type="xsd:integer" minOccurs="0"/>
+  <xsd:element name="name" type="xsd:string" minOccurs="0"/>
+ </xsd:all></xsd:complexType>
+ <xsd:complexType name="AccountData"><xsd:all>
+  <xsd:element name="id" type="xsd:integer" minOccurs="0"/>
+  <xsd:element name="name" type="xsd:string" minOccurs="0"/>
+ </xsd:all></xsd:complexType>
+ <xsd:complexType name="IssueNoteData"><xsd:all>
+  <xsd:element name="id" type="xsd:integer" minOccurs="0"/>
+  <xsd:element name="reporter" type="tns:AccountData" minOccurs="0"/>
+  <xsd:element name="text" type="xsd:string" minOccurs="0"/>
+  <xsd:element name="date_submitted" type="xsd:dateTime" minOccurs="0"/>
+  <xsd:element name="last_modified" type="xsd:dateTime" minOccurs="0"/>
+ </xsd:all></xsd:complexType>
+ <xsd:complexType name="IssueNoteDataArray"><xsd:complexContent>
+  <xsd:restriction base="SOAP-ENC:Array">
+   <xsd:attribute ref="SOAP-ENC:arrayType" wsdl:arrayType="tns:IssueNoteData[]"/>
+  </xsd:restriction></xsd:complexContent></xsd:complexType>
+ <xsd:complexType name="AttachmentData"><xsd:all>
+  <xsd:element name="id" type="xsd:integer" minOccurs="0"/>
+  <xsd:element name="filename" type="xsd:string" minOccurs="0"/>
+  <xsd:element name="size" type="xsd:integer" minOccurs="0"/>
+ </xsd:all></xsd:complexType>
+ <xsd:complexType name="AttachmentDataArray"><xsd:complexContent>
+  <xsd:restriction base="SOAP-ENC:Array">
+   <xsd:attribute ref="SOAP-ENC:arrayType" wsdl:arrayType="tns:AttachmentData[]"/>
+  </xsd:restriction></xsd:complexContent></xsd:complexType>
+ <xsd:complexType name="IssueData"><xsd:all>
+  <xsd:element name="id" type="xsd:integer" minOccurs="0"/>
+  <xsd:element name="summary" type="xsd:string" minOccurs="0"/>
+  <xsd:element name="description" type="xsd:string" minOccurs="0"/>
+  <xsd:element name="priority" type="tns:ObjectRef" minOccurs="0"/>
+  <xsd:element name="status" type="tns:ObjectRef" minOccurs="0"/>
+  <xsd:element name="resolution" type="tns:ObjectRef" minOccurs="0"/>
+  <xsd:element name="last_updated" type="xsd:dateTime" minOccurs="0"/>
+  <xsd:element name="notes" type="tns:IssueNoteDataArray" minOccurs="0"/>
+  <xsd:element name="attachments" type="tns:AttachmentDataArray" minOccurs="0"/>
+ </xsd:all></xsd:complexType>
+ <xsd:complexType name="IssueDataArray"><xsd:complexContent>
+  <xsd:restriction base="SOAP-ENC:Array">
+   <xsd:attribute ref="SOAP-ENC:arrayType" wsdl:arrayType="tns:IssueData[]"/>
+  </xsd:restriction></xsd:complexContent></xsd:complexType>
+</xsd:schema>
+</types>
+<message name="mc_issue_getRequest">
+ <part name="username" type="xsd:string"/><part name="password" type="xsd:string"/>
+ <part name="issue_id" type="xsd:integer"/></message>
+<message name="mc_issue_getResponse"><part name="return" type="tns:IssueData"/></message>
+<message name="mc_filter_get_issuesRequest">
+ <part name="username" type="xsd:string"/><part name="password" type="xsd:string"/>
+ <part name="project_id" type="xsd:integer"/><part name="filter_id" type="xsd:integer"/>
+ <part name="page_number" type="xsd:integer"/><part name="per_page" type="xsd:integer"/></message>
+<message name="mc_filter_get_issuesResponse"><part name="return" type="tns:IssueDataArray"/></message>
+<message name="mc_issue_attachment_getRequest">
+ <part name="username" type="xsd:string"/><part name="password" type="xsd:string"/>
+ <part name="issue_attachment_id" type="xsd:integer"/></message>
+<message name="mc_issue_attachment_getResponse"><part name="return" type="xsd:base64Binary"/></message>
+<portType name="MantisConnectPortType">
+%(operations)s
+</portType>
+<binding name="MantisConnectBinding" type="tns:MantisConnectPortType">
+ <soap:binding style="rpc" transport="http://schemas.xmlsoap.org/soap/http"/>
+%(bindings)s
+</binding>
+<service name="MantisConnect">
+ <port name="MantisConnectPort" binding="tns:MantisConnectBinding">
+  <soap:address location="%(url)s/api/soap/mantisconnect.php"/>
+ </port>
+</service>
+</definitions>
+'''
+MANTIS_OPERATIONS = ['mc_issue_get', 'mc_filter_get_issues',
+                     'mc_issue_attachment_get']
+
+ENVELOPE = '''<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"
+ xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/"
+ xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+ xmlns:ns1="%s"><SOAP-ENV:Body>
+<ns1:%sResponse>%s</ns1:%sResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>'''
+
+
+class FakeMantis(FakeServer):
+    def __init__(self, data, latency=0.0, gzip=False):
+        FakeServer.__init__(self, latency, gzip)
+        self.data = data
+
+    def wsdl(self):
+        operations = ''.join(
+            '<operation name="%s"><input message="tns:%sRequest"/>'
+            '<output message="tns:%sResponse"/></operation>\n' % (op, op, op)
+            for op in MANTIS_OPERATIONS)
+        body = ('<soap:body use="encoded" namespace="%s" encodingStyle='
+                '"http://schemas.xmlsoap.org/soap/encoding/"/>' % MANTIS_NS)
+        bindings = ''.join(
+            '<operation name="%s"><soap:operation soapAction="%s/api/soap/'
+            'mantisconnect.php/%s" style="rpc"/><input>%s</input>'
+            '<output>%s</output></operation>\n' % (op, self.url, op, body,
+                                                   body)
+            for op in MANTIS_OPERATIONS)
+        return WSDL % dict(ns=MANTIS_NS, url=self.url, operations=operations,
+                           bindings=bindings)
+
+    def issue_xml(self, issue_id, tag='return'):
+        resolved = self.data.resolved(issue_id)
+        notes = ''.join(
+            '<item xsi:type="ns1:IssueNoteData"><id xsi:type="xsd:integer">'
+            '%d</id><reporter xsi:type="ns1:AccountData"><id xsi:type='
+            '"xsd:integer">2</id><name xsi:type="xsd:string">qa</name>'
+            '</reporter><text xsi:type="xsd:string">%s</text><last_modified '
+            'xsi:type="xsd:dateTime">2019-01-01T00:00:00+0000</last_modified>'
+            '</item>' % (issue_id * 100 + i, escape(self.data.text))
+            for i in range(self.data.comments))
+        attachments = ''.join(
+            '<item xsi:type="ns1:AttachmentData"><id xsi:type="xsd:integer">'
+            '%d</id><filename xsi:type="xsd:string">dmesg.txt</filename>'
+            '<size xsi:type="xsd:integer">%d</size></item>'
+            % (a, len(self.data.content))
+            for a in self.data.attachment_ids(issue_id))
+        return (
+            '<%s xsi:type="ns1:IssueData"><id xsi:type="xsd:integer">%d</id>'
+            '<summary xsi:type="xsd:string">Volume %d fails to mount'
+            '</summary><description xsi:type="xsd:string">%s</description>'
+            '<priority xsi:type="ns1:ObjectRef"><id xsi:type="xsd:integer">30'
+            '</id><name xsi:type="xsd:string">normal</name></priority>'
+            '<status xsi:type="ns1:ObjectRef"><id xsi:type="xsd:integer">%d'
+            '</id><name xsi:type="xsd:string">%s</name></status>'
+            '<last_updated xsi:type="xsd:dateTime">2019-02-01T00:00:00+0000'
+            '</last_updated><notes SOAP-ENC:arrayType="ns1:IssueNoteData[%d]"'
+            ' xsi:type="SOAP-ENC:Array">%s</notes><attachments SOAP-ENC:'
+            'arrayType="ns1:AttachmentData[%d]" xsi:type="SOAP-ENC:Array">%s'
+            '</attachments></%s>' % (
+                tag, issue_id, issue_id, escape(self.data.text),
+                80 if resolved else 50, 'resolved' if resolved else 'assigned',
+                self.data.comments, notes, self.data.attachments, attachments,
+                tag))
+
+    def route(self, h, method, path):
+        if path != '/api/soap/mantisconnect.php':
+            return h.not_found()
+        if method == 'GET':
+            return h.send(self.wsdl(), content_type='text/xml')
+        op = h.headers.get('SOAPAction', '').strip('"').rsplit('/', 1)[-1]
+        args = dict(re.findall(rb'<(\w+)[^>]*>([^<]*)</\1>', h.body))
+        if op == 'mc_issue_get':
+            result = self.issue_xml(int(args[b'issue_id']))
+        elif op == 'mc_filter_get_issues':
+            page, per_page = int(args[b'page_number']), int(args[b'per_page'])
+            ids = self.data.ids[(page - 1) * per_page:page * per_page]
+            result = ('<return SOAP-ENC:arrayType="ns1:IssueData[%d]" '
+                      'xsi:type="SOAP-ENC:Array">%s</return>' % (
+                          len(ids), ''.join(self.issue_xml(i, 'item')
+                                            for i in ids)))
+        elif op == 'mc_issue_attachment_get':
+            result = '<return xsi:type="xsd:base64Binary">%s</return>' % (
+                base64.b64encode(self.data.content).decode('ascii'))
+        else:
+            return h.send('unknown operation %s' % op, 500, 'text/plain')
+        h.send(ENVELOPE % (MANTIS_NS, op, result, op),
+               content_type='text/xml; charset=utf-8')
+
+
+# where each transition of the fake workflow leads
+TRANSITIONS = {
+    'Resolve Issue': 'Resolved', 'Resolved': 'Resolved',
+    'Assign to': 'Assigned', 'Assign to ': 'Assigned',
+    'Feedback': 'Assigned', 'handling': 'In Progress', 'done': 'Done',
+}
+
+
+class FakeJira(FakeServer):
+    '''
+    The Jira REST calls of the sync, with a JQL subset: key in (...), "F" ~
+    "v" (exact), "F" is not empty, linkedIssuesOfRemote("title", "glob"),
+    status not in (...), key > K and ORDER BY key.
+    '''
+    FIELDS = {'BugZilla ID': 'customfield_10216',
+              'Mantis ID': 'customfield_14100'}
+
+    def __init__(self, project='BENCH', latency=0.0):
+        FakeServer.__init__(self, latency)
+        self.project = project
+        self.issues = collections.OrderedDict()
+        self._lock_issues = threading.Lock()
+
+    def reset(self, mirrors=(), field=None, remote=False):
+        '''
+        Forget every issue, then create one mirroring each of mirrors through
+        field (e.g. 'BugZilla ID') or, with remote, a remote link title
+        '''
+        FakeServer.reset(self)
+        with self._lock_issues:
+            self.issues.clear()
+        for value in mirrors:
+            issue = self.create({'summary': 'mirror of %s' % value,
+                                 'issuetype': {'name': 'Bug'}})
+            if remote:
+                issue['remotelinks'].append(value)
+            else:
+                issue['fields'][self.FIELDS[field]] = value
+
+    def create(self, fields):
+        with self._lock_issues:
+            number = len(self.issues) + 1
+            key = '%s-%d' % (self.project, number)
+            issue = self.issues[key] = {
+                'id': str(10000 + number), 'key': key,
+                'self': '%s/rest/api/2/issue/%d' % (self.url, 10000 + number),
+                'remotelinks': [],
+                'fields': {
+                    'summary': fields.get('summary'),
+                    'description': fields.get('description'),
+                    'issuetype': fields.get('issuetype') or {'name': 'Bug'},
+                    'priority': fields.get('priority'),
+                    'status': {'name': 'To Do' if (fields.get('issuetype') or
+                                                   {}).get('name') == 'Task'
+                               else 'Open'},
+                    'comment': {'comments': [], 'total': 0},
+                    'attachment': [], 'issuelinks': [],
+                    'customfield_10216': fields.get('customfield_10216'),
+                    'customfield_14100': fields.get('customfield_14100'),
+                }}
+        return issue
+
+    def find(self, key_or_id):
+        with self._lock_issues:
+            if key_or_id in self.issues:
+                return self.issues[key_or_id]
+            for issue in self.issues.values():
+                if issue['id'] == key_or_id:
+                    return issue
+        return None
+
+    def view(self, issue):
+        return dict((k, v) for k, v in issue.items() if k != 'remotelinks')
+
+    def search(self, jql):
+        with self._lock_issues:
+            issues = list(self.issues.values())
+        m = re.search(r'key in \(([^)]*)\)', jql)
+        if m:
+            keys = set(k.strip() for k in m.group(1).split(','))
+            issues = [i for i in issues if i['key'] in keys]
+        for name in re.findall(r'"([^"]+)" is not empty', jql):
+            field = self.FIELDS[name]
+            issues = [i for i in issues if i['fields'][field]]
+        matches = [(self.FIELDS[name], value) for name, value in
+                   re.findall(r'"([^"]+)" ~ "([^"]*)"', jql)]
+        titles = re.findall(r'linkedIssuesOfRemote\("title", "([^"]*)"\)',
+                            jql)
+        if matches or titles:
+            issues = [i for i in issues if
+                      any(i['fields'][f] == v for f, v in matches) or
+                      any(fnmatch.fnmatch(t, glob) for glob in titles
+                          for t in i['remotelinks'])]
+        m = re.search(r'status not in \(([^)]*)\)', jql)
+        if m:
+            statuses = set(re.findall(r'"([^"]*)"', m.group(1)))
+            issues = [i for i in issues
+                      if i['fields']['status']['name'] not in statuses]
+        m = re.search(r'key > \w+-(\d+)', jql)
+        if m:
+            issues = [i for i in issues
+                      if int(i['key'].rsplit('-', 1)[1]) > int(m.group(1))]
+        return issues
+
+    def route(self, h, method, path):
+        prefix = '/rest/api/2/'
+        if not path.startswith(prefix):
+            return h.not_found()
+        path = path[len(prefix):]
+        if path == 'search':
+            query = h.query
+            if method == 'POST':
+                query = dict((k, [v]) for k, v in json.loads(h.body).items())
+            issues = self.search(query['jql'][0])
+            start = int(query.get('startAt', [0])[0])
+            size = int(query.get('maxResults', [50])[0])
+            return h.send({'startAt': start, 'maxResults': size,
+                           'total': len(issues),
+                           'issues': [self.view(i) for i in
+                                      issues[start:start + size]]})
+        if path == 'field':
+            return h.send([{'id': field_id, 'name': name, 'custom': True}
+                           for name, field_id in sorted(self.FIELDS.items())])
+        m = re.match(r'project/(\w+)$', path)
+        if m:
+            return h.send({'id': '10100', 'key': m.group(1),
+                           'name': m.group(1)})
+        if path == 'issue' and method == 'POST':
+            issue = self.create(json.loads(h.body)['fields'])
+            return h.send({'id': issue['id'], 'key': issue['key'],
+                           'self': issue['self']}, 201)
+        m = re.match(r'issue/([\w-]+)(?:/(\w+))?$', path)
+        issue = m and self.find(m.group(1))
+        if not issue:
+            return h.not_found()
+        action = m.group(2)
+        fields = issue['fields']
+        if action is None:
+            if method == 'PUT':
+                return h.send(b'', 204)
+            return h.send(self.view(issue))
+        if action == 'comment' and method == 'POST':
+            body = json.loads(h.body)['body']
+            with self._lock_issues:
+                comments = fields['comment']['comments']
+                comment = {'id': str(len(comments) + 1), 'body': body,
+                           'self': issue['self'] + '/comment/%d' % (
+                               len(comments) + 1)}
+                comments.append(comment)
+                fields['comment']['total'] = len(comments)
+            return h.send(comment, 201)
+        if action == 'attachments' and method == 'POST':
+            m = re.search(rb'filename="([^"]*)"', h.body)
+            name = m.group(1).decode('utf-8') if m else 'file'
+            with self._lock_issues:
+                attachment = {'id': str(len(fields['attachment']) + 1),
+                              'filename': name, 'size': len(h.body),
+                              'self': self.url + '/rest/api/2/attachment/1'}
+                fields['attachment'].append(attachment)
+            return h.send([attachment])
+        if action == 'transitions':
+            if method == 'GET':
+                return h.send({'transitions': [
+                    {'id': str(i), 'name': name, 'to': {'name': to}}
+                    for i, (name, to) in enumerate(sorted(
+                        TRANSITIONS.items()), 1)]})
+            transition_id = int(json.loads(h.body)['transition']['id'])
+            fields['status'] = {'name': sorted(TRANSITIONS.items())[
+                transition_id - 1][1]}
+            return h.send(b'', 204)
+        if action == 'remotelink':
+            if method == 'POST':
+                link = json.loads(h.body)['object']
+                with self._lock_issues:
+                    issue['remotelinks'].append(link['title'])
+                return h.send({'id': 1, 'self': issue['self'] +
+                               '/remotelink/1'}, 201)
+            return h.send([{'id': i, 'object': {'title': t, 'url': ''}}
+                           for i, t in enumerate(issue['remotelinks'], 1)])
+        h.not_found()
@@ -0,0 +1,88 @@
+'''
+Memory held by a batch of Bugzilla REST issues: the raw JSON payloads, which
+the old wrapper objects kept alive, against the model.Issue records built by
+the REST backend. Offline, with synthetic issues shaped like /rest/bug
+responses.
+
+    python bench/issue_memory.py [issues]
+'''
+import copy
+import json
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bzjira of this checkout, not an installed one
+sys.path.insert(0, ROOT)
+
+from bzjira.bugzilla import rest
+
+BUG = {
+    'id': 0, 'alias': [], 'assigned_to': 'dev@example.com',
+    'assigned_to_detail': {'email': 'dev@example.com', 'id': 2,
+                           'name': 'dev@example.com', 'real_name': 'Dev'},
+    'blocks': [], 'cc': ['qa@example.com', 'pm@example.com'],
+    'cc_detail': [{'email': 'qa@example.com', 'id': 3,
+                   'name': 'qa@example.com', 'real_name': 'QA'}] * 2,
+    'classification': 'Unclassified', 'component': 'Firmware',
+    'creation_time': '2019-01-01T00:00:00Z', 'creator': 'qa@example.com',
+    'deadline': None, 'depends_on': [], 'dupe_of': None,
+    'flags': [], 'groups': [], 'is_cc_accessible': True,
+    'is_confirmed': True, 'is_creator_accessible': True, 'is_open': True,
+    'keywords': [], 'last_change_time': '2019-02-01T00:00:00Z',
+    'op_sys': 'Linux', 'platform': 'x86', 'priority': 'P2',
+    'product': 'NAS', 'qa_contact': '', 'resolution': '',
+    'see_also': [], 'severity': 'normal', 'status': 'CONFIRMED',
+    'summary': 'Volume fails to mount after firmware update',
+    'target_milestone': '---', 'url': '', 'version': '4.3',
+    'whiteboard': '',
+}
+COMMENT = {
+    'attachment_id': None, 'bug_id': 0, 'count': 0,
+    'creation_time': '2019-01-01T00:00:00Z', 'creator': 'qa@example.com',
+    'id': 0, 'is_private': False, 'tags': [],
+    'text': 'Steps to reproduce, logs and expected results. ' * 20,
+    'time': '2019-01-01T00:00:00Z',
+}
+ATTACHMENT = {
+    'bug_id': 0, 'content_type': 'text/plain',
+    'creation_time': '2019-01-01T00:00:00Z', 'creator': 'qa@example.com',
+    'description': 'kernel log', 'file_name': 'dmesg.txt', 'flags': [],
+    'id': 0, 'is_obsolete': 0, 'is_patch': 0, 'is_private': 0,
+    'last_change_time': '2019-01-01T00:00:00Z', 'size': 123456,
+    'summary': 'kernel log',
+}
+
+
+def raw_bug(bug_id):
+    bug = copy.deepcopy(BUG)
+    bug['id'] = bug_id
+    bug['comments'] = [dict(COMMENT, id=bug_id * 10 + i, count=i)
+                       for i in range(8)]
+    bug['attachments'] = [dict(ATTACHMENT, id=bug_id * 10 + i)
+                          for i in range(3)]
+    # as if decoded from the wire, nothing shared between issues
+    return json.loads(json.dumps(bug))
+
+
+def measure(name, build, count):
+    tracemalloc.start()
+    kept = [build(bug_id) for bug_id in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-6s %6d issues  %8.1f MB  %6.0f bytes/issue' % (
+        name, len(kept), size / 1e6, size / count))
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    raw = measure('raw', raw_bug, count)
+    records = measure('model', lambda i: rest._to_issue(raw_bug(i), None),
+                      count)
+    print('model keeps %.0f%% of raw' % (100.0 * records / raw))
+
+
+if __name__ == '__main__':
+    main()
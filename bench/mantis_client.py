@@ -0,0 +1,82 @@
+'''
+Per-issue latency of reading Mantis issues and their attachments, the old
+way (a new suds client, and so a WSDL download and parse, for every call)
+against one mantis.Mantis connection with the on-disk WSDL cache.
+
+    python bench/mantis_client.py <Mantis URL> <Mantis ID> [<Mantis ID> ...]
+    python bench/mantis_client.py --fake [<Mantis ID> ...]
+
+Credentials are read from ~/.netrc. --fake runs against a local
+bench/fake_servers.FakeMantis, 20 issues with 20ms latency and gzip on.
+'''
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bzjira of this checkout, not an installed one
+sys.path.insert(0, ROOT)
+
+from requests.utils import get_netrc_auth
+from suds.cache import NoCache
+from suds.client import Client
+
+from bzjira import mantis
+from bzjira.__main__ import monkey_patch
+
+# --fake
+FAKE_ISSUES = 20
+FAKE_LATENCY = 0.02
+
+
+def fetch_uncached(mantis_server, username, passwd, mantis_id):
+    url = mantis_server + '/api/soap/mantisconnect.php?wsdl'
+    raw = Client(url, cache=NoCache()).service.mc_issue_get(
+        username, passwd, mantis_id)
+    for a in getattr(raw, 'attachments', []):
+        Client(url, cache=NoCache()).service.mc_issue_attachment_get(
+            username, passwd, a.id)
+
+
+def fetch_cached(mt, mantis_id):
+    for a in mt.issue(mantis_id).attachments:
+        a.content
+
+
+def measure(name, fetch, mantis_ids):
+    timings = []
+    for mantis_id in mantis_ids:
+        start = time.time()
+        fetch(mantis_id)
+        timings.append(time.time() - start)
+    timings.sort()
+    print('%-10s mean %.3fs  median %.3fs  max %.3fs' % (
+        name, sum(timings) / len(timings), timings[len(timings) // 2],
+        timings[-1]))
+
+
+def main():
+    # Mantis dates end in +0000, as in a sync run
+    monkey_patch()
+    if sys.argv[1] == '--fake':
+        import fake_servers
+        server = fake_servers.FakeMantis(fake_servers.Data(FAKE_ISSUES),
+                                         FAKE_LATENCY, gzip=True).start()
+        mantis_server = server.url
+        mantis_ids = sys.argv[2:] or [str(i) for i in range(1, FAKE_ISSUES + 1)]
+        username, passwd = 'bench', 'bench'
+    else:
+        mantis_server, mantis_ids = sys.argv[1], sys.argv[2:]
+        username, passwd = get_netrc_auth(mantis_server)
+
+    measure('uncached', lambda i: fetch_uncached(mantis_server, username,
+                                                 passwd, i), mantis_ids)
+    start = time.time()
+    mt = mantis.Mantis(mantis_server, username, passwd)
+    mt.client
+    print('client startup %.3fs' % (time.time() - start))
+    measure('cached', lambda i: fetch_cached(mt, i), mantis_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+'''
+Bytes on the wire and latency of mc_issue_get and mc_issue_attachment_get,
+with the default suds urllib transport (a new connection per call, no
+compression) against the pooled, gzip-compressed requests transport.
+
+    python bench/mantis_transport.py <Mantis URL> <Mantis ID> [<Mantis ID> ...]
+    python bench/mantis_transport.py --fake [<Mantis ID> ...]
+
+Credentials are read from ~/.netrc. Compression only shows when the Mantis
+web server compresses responses, e.g. PHP zlib.output_compression. --fake
+runs against a local bench/fake_servers.FakeMantis, 20 issues with 20ms
+latency and gzip on.
+'''
+import os
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bzjira of this checkout, not an installed one
+sys.path.insert(0, ROOT)
+
+from requests.utils import get_netrc_auth
+from suds.cache import NoCache
+from suds.client import Client
+from suds.transport.http import HttpTransport
+
+from bzjira import mantis
+from bzjira.__main__ import monkey_patch
+
+# --fake
+FAKE_ISSUES = 20
+FAKE_LATENCY = 0.02
+
+
+class UrllibTransport(HttpTransport):
+    def __init__(self, **kwargs):
+        HttpTransport.__init__(self, **kwargs)
+        self.wire = 0
+
+    def send(self, request):
+        reply = HttpTransport.send(self, request)
+        # nothing asks for compression, the body is what came over the wire
+        self.wire += len(reply.message)
+        return reply
+
+
+class RequestsTransport(mantis._RequestsTransport):
+    def __init__(self, session=None):
+        mantis._RequestsTransport.__init__(self, session)
+        self.wire = 0
+
+    def _reply(self, resp):
+        resp.content
+        # bytes read from the socket, before gzip decoding
+        self.wire += resp.raw.tell()
+        return mantis._RequestsTransport._reply(self, resp)
+
+
+def measure(name, transport, url, username, passwd, mantis_ids):
+    client = Client(url, cache=NoCache(), transport=transport)
+    timings = defaultdict(list)
+    wire = defaultdict(int)
+
+    def call(method, *args):
+        before = transport.wire
+        start = time.time()
+        resp = getattr(client.service, method)(username, passwd, *args)
+        timings[method].append(time.time() - start)
+        wire[method] += transport.wire - before
+        return resp
+
+    for mantis_id in mantis_ids:
+        raw = call('mc_issue_get', mantis_id)
+        for a in getattr(raw, 'attachments', []):
+            call('mc_issue_attachment_get', a.id)
+
+    for method in sorted(timings):
+        t = sorted(timings[method])
+        print('%-9s %-24s calls %4d  wire %10d bytes  mean %.3fs  '
+              'median %.3fs  max %.3fs' % (
+                  name, method, len(t), wire[method], sum(t) / len(t),
+                  t[len(t) // 2], t[-1]))
+
+
+def main():
+    # Mantis dates end in +0000, as in a sync run
+    monkey_patch()
+    if sys.argv[1] == '--fake':
+        import fake_servers
+        server = fake_servers.FakeMantis(fake_servers.Data(FAKE_ISSUES),
+                                         FAKE_LATENCY, gzip=True).start()
+        mantis_server = server.url
+        mantis_ids = sys.argv[2:] or [str(i) for i in range(1, FAKE_ISSUES + 1)]
+        username, passwd = 'bench', 'bench'
+    else:
+        mantis_server, mantis_ids = sys.argv[1], sys.argv[2:]
+        username, passwd = get_netrc_auth(mantis_server)
+    url = mantis_server + '/api/soap/mantisconnect.php?wsdl'
+
+    measure('urllib', UrllibTransport(), url, username, passwd, mantis_ids)
+    measure('requests', RequestsTransport(), url, username, passwd,
+            mantis_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Micro-benchmark of checking which source comments and attachments a Jira
+issue already mirrors: scanning every comment for every lookup (how the sync
+functions used to do it) against one MirrorIndex per issue.
+
+    python bench/mirror_index.py [<comments> [<attachments>]]
+'''
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bzjira of this checkout, not an installed one
+sys.path.insert(0, ROOT)
+
+from bzjira.mirror import MirrorIndex
+
+BZ_SERVER = 'https://bugzilla.example.com'
+
+
+def fake_issue(comments, attachments):
+    body = '%s/show_bug.cgi?id=1#c%d\n\n{quote}\n*someone*\n\n%s\n{quote}'
+    big = '%s/attachment.cgi?id=%d\nbig attachment %d'
+    bodies = [body % (BZ_SERVER, i, 'text ' * 200) for i in range(comments)]
+    bodies += [big % (BZ_SERVER, i, i) for i in range(attachments // 10)]
+    return SimpleNamespace(fields=SimpleNamespace(
+        comment=SimpleNamespace(comments=[SimpleNamespace(body=b)
+                                          for b in bodies]),
+        attachment=[SimpleNamespace(filename='log-%d.txt' % i)
+                    for i in range(attachments)]))
+
+
+def scan(issue, comments, attachments):
+    def find_comment(index):
+        for c in issue.fields.comment.comments:
+            first_line = c.body.split('\n', 1)[0]
+            if first_line.endswith('c%d' % index):
+                return c
+
+    def find_attachment(filename):
+        for a in issue.fields.attachment:
+            if a.filename == filename:
+                return a
+
+    def find_attachment_comment(attach_id):
+        for c in issue.fields.comment.comments:
+            first_line = c.body.split('\n', 1)[0]
+            if first_line.endswith('=%s' % attach_id):
+                return c
+
+    for i in range(attachments):
+        find_attachment('log-%d.txt' % i) or find_attachment_comment(i)
+    for i in range(comments):
+        find_comment(i)
+
+
+def indexed(issue, comments, attachments):
+    index = MirrorIndex(issue)
+    for i in range(attachments):
+        index.has('attachment', i) or index.has_file('log-%d.txt' % i)
+    for i in range(comments):
+        index.has('comment', i)
+
+
+def measure(name, check, *args):
+    start = time.perf_counter()
+    check(*args)
+    print('%-8s %.4fs' % (name, time.perf_counter() - start))
+
+
+def main():
+    comments = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    attachments = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    issue = fake_issue(comments, attachments)
+    print('%d comments, %d attachments' % (comments, attachments))
+    measure('scan', scan, issue, comments, attachments)
+    measure('index', indexed, issue, comments, attachments)
+
+
+if __name__ == '__main__':
+    main()
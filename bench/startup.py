@@ -0,0 +1,91 @@
+'''
+CLI startup cost per backend: the import time of what a run of that backend
+loads, and the time from spawning the process to its first request. Every
+sample is a fresh interpreter; the first request goes to a local stub server
+that answers 404 to everything, so nothing but startup is measured.
+
+    python bench/startup.py [runs]
+'''
+import http.server
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CHILD = r'''
+import sys, time
+start = time.time()
+import bzjira.__main__ as cli
+%(imports)s
+imported = time.time()
+try:
+    %(first_request)s
+except Exception:
+    pass
+print(start, imported)
+'''
+
+BACKENDS = {
+    'bugzilla': dict(
+        imports='from bzjira import bugzilla',
+        first_request="bugzilla.Bugzilla(sys.argv[1], reprobe=True)"
+                      "._get_handler()"),
+    'mantis': dict(
+        imports='from bzjira import mantis; cli.monkey_patch()',
+        first_request="mantis.Mantis(sys.argv[1], 'u', 'p').client"),
+    'jira': dict(
+        imports='',
+        first_request="cli.connect_jira(sys.argv[1]).myself()"),
+}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    def _answer(self):
+        self.server.first.setdefault(self.server.run, time.time())
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.first = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d' % server.server_port
+
+    tmp = tempfile.mkdtemp()
+    netrc = os.path.join(tmp, 'netrc')
+    with open(netrc, 'w') as f:
+        f.write('machine 127.0.0.1 login u password p\n')
+    env = dict(os.environ, NETRC=netrc, XDG_CACHE_HOME=tmp,
+               PYTHONPATH=os.pathsep.join(
+                   [os.path.dirname(os.path.dirname(os.path.abspath(
+                       __file__)))] + sys.path))
+
+    for name, code in sorted(BACKENDS.items()):
+        imports, first = [], []
+        for run in range(runs):
+            server.run = (name, run)
+            spawned = time.time()
+            out = subprocess.check_output(
+                [sys.executable, '-c', CHILD % code, url], env=env)
+            # the last line, the backend may print before it
+            start, imported = map(float, out.splitlines()[-1].split())
+            imports.append(imported - start)
+            first.append(server.first.get(server.run, float('nan')) - spawned)
+        imports.sort()
+        first.sort()
+        print('%-9s import median %.3fs  first request median %.3fs' % (
+            name, imports[runs // 2], first[runs // 2]))
+
+
+if __name__ == '__main__':
+    main()
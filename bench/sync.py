@@ -0,0 +1,129 @@
+'''
+End-to-end throughput of `python -m bzjira` against local stand-in servers
+(see bench/fake_servers.py): Bugzilla REST, Bugzilla CGI and Mantis SOAP as
+the source, Jira as the target, each in the single issue, query (-q, or the
+-p/-f filter for Mantis) and revert (-r) modes. Every run is a fresh process
+with empty Jira; -r runs start from one mirror issue per source issue.
+
+Reports issues/sec, the requests each server got and the peak RSS of the
+process. Arguments after -- are passed to bzjira, e.g. -- --workers 8.
+
+    python bench/sync.py [--issues N] [--latency MS] [--only NAME] [-- ...]
+'''
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_servers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT = 'BENCH'
+
+# (name, source, mode)
+SCENARIOS = [(source + ' ' + mode, source, mode)
+             for source in ('bugzilla-rest', 'bugzilla-cgi', 'mantis')
+             for mode in ('single', 'query', 'revert')]
+
+
+def bzjira_args(source, mode, url, ids):
+    if source == 'mantis':
+        args = ['-m', url]
+        if mode == 'single':
+            return args + [str(ids[0])]
+        if mode == 'query':
+            return args + ['-p', '1', '-f', '1']
+        return args + ['-r']
+    args = ['-b', url]
+    if mode == 'single':
+        return args + [str(ids[0])]
+    if mode == 'query':
+        return args + ['-q', 'product=NAS']
+    return args + ['-r']
+
+
+def run(cmd, env):
+    '''
+    (seconds, output, peak RSS in MB) of the command
+    '''
+    start = time.time()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = status
+    seconds = time.time() - start
+    # ru_maxrss is in kB on Linux
+    return seconds, out.decode('utf-8', 'replace'), usage.ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--issues', type=int, default=100)
+    parser.add_argument('--comments', type=int, default=5)
+    parser.add_argument('--attachments', type=int, default=2)
+    parser.add_argument('--attachment-kb', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=20,
+                        help='ms every server waits before answering')
+    parser.add_argument('--only', help='run the scenarios containing this')
+    parser.add_argument('extra', nargs='*', help='passed to bzjira')
+    args = parser.parse_args()
+
+    data = fake_servers.Data(args.issues, args.comments, args.attachments,
+                             args.attachment_kb * 1024)
+    latency = args.latency / 1000.0
+    sources = {
+        'bugzilla-rest': fake_servers.FakeBugzillaREST(data, latency).start(),
+        'bugzilla-cgi': fake_servers.FakeBugzillaCGI(data, latency).start(),
+        'mantis': fake_servers.FakeMantis(data, latency).start(),
+    }
+    jira = fake_servers.FakeJira(PROJECT, latency).start()
+
+    tmp = tempfile.mkdtemp()
+    netrc = os.path.join(tmp, 'netrc')
+    with open(netrc, 'w') as f:
+        f.write('machine 127.0.0.1 login bench password bench\n')
+
+    print('%d issues, %d comments and %d x %d kB attachments each, %gms '
+          'latency' % (args.issues, args.comments, args.attachments,
+                       args.attachment_kb, args.latency))
+    print('%-22s %7s %9s %8s %8s %8s %8s' % (
+        'scenario', 'issues', 'seconds', 'issues/s', 'source', 'jira',
+        'RSS MB'))
+    for name, source, mode in SCENARIOS:
+        if args.only and args.only not in name:
+            continue
+        server = sources[source]
+        server.reset()
+        if mode != 'revert':
+            jira.reset()
+        elif source == 'mantis':
+            jira.reset(['Mantis-%d' % i for i in data.ids], 'Mantis ID')
+        else:
+            jira.reset([str(i) for i in data.ids], 'BugZilla ID')
+
+        env = dict(os.environ, NETRC=netrc,
+                   XDG_CACHE_HOME=tempfile.mkdtemp(dir=tmp),
+                   PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+        cmd = ([sys.executable, '-m', 'bzjira', '-j', jira.url, '-k',
+                PROJECT, '-y'] + bzjira_args(source, mode, server.url,
+                                             data.ids) + args.extra)
+        seconds, out, rss = run(cmd, env)
+
+        m = re.search(r'Synced (\d+) issues, (\d+) failed', out)
+        done, failed = (int(m.group(1)), int(m.group(2))) if m else (1, 0)
+        if 'Traceback' in out and not m:
+            done, failed = 0, 1
+        print('%-22s %7d %9.2f %8.1f %8d %8d %8.1f%s' % (
+            name, done, seconds, done / seconds,
+            sum(server.requests.values()), sum(jira.requests.values()), rss,
+            '  (%d failed)' % failed if failed else ''))
+        if failed:
+            print(out[-2000:])
+
+
+if __name__ == '__main__':
+    main()
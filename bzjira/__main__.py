@@ -1,19 +1,35 @@
 import os
-from io import BytesIO
+import re
 import argparse
+import atexit
 import getpass
-from functools import partial
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import chain
 
-from jira import JIRA
 from requests.utils import get_netrc_auth
-from . import bugzilla
-from . import mantis
-
-MAX_OLD_JIRA_ATTACHMENT_BYTES = 10 * 1024 * 1024
-
-
-def sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, project_key, yes_all):
+from . import bzsync
+from . import metrics
+from . import replay
+from . import spool
+from . import transport
+from .batch import Ids, run_batch
+from .cache import ATTACHMENT_CACHE_BYTES, AttachmentCache
+from .bzsync import MAX_OLD_JIRA_ATTACHMENT_BYTES
+from .meta import JiraMeta
+from .mirror import MirrorIndex, find_mirrors, with_mirrors
+from .search import search_all
+from .state import SyncState
+from .writer import IssueWriter
+
+
+def sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, project_key, yes_all, state=None, mirrors=None,
+                          meta=None, cache=None):
     bz_id = bug.key
+    state = state or SyncState()
+    meta = meta or JiraMeta(jira)
     print('New JIRA key %s found: %s' % (bz_id, bug.fields.summary))
     comments = new_jira.comments(bug)
     attachments = bug.fields.attachment
@@ -23,23 +39,31 @@ def sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, project_key, yes
                                       bug.fields.issuetype.name,
                                       bug.fields.summary)
         issue = jira.create_issue(
-            project=project_key,
+            project={'id': meta.project_id(project_key)},
             summary=summary,
             description=bug.fields.description,
             issuetype={'name': 'Task'},
             priority={'name': bug.fields.priority.name},
         )
-        jira.create_issue_link(type='Relates', inwardIssue=issue.key, outwardIssue=bz_id)
+        meta.create_issue_link(type='Relates', inwardIssue=issue.key, outwardIssue=bz_id)
         issue.update(assignee={'name': None})
         return issue
 
-    issues_found_by_mantis_id = jira.search_issues('project = %s AND "Mantis ID" ~ "%s"' % (project_key, bz_id))
-    issues_found_by_related_task = jira.search_issues('project = %s AND issue in linkedIssues(%s, "relates to")' % (project_key, bz_id))
-    issues = issues_found_by_mantis_id + issues_found_by_related_task
-    if issues:
-        issue = issues[0]
-        issue = jira.issue(issue.key)
-        print('Corresponding Jira issue found: %s' % issues[0])
+    key, last_change = state.issue(new_jira_server, bz_id)
+    if key and last_change == bug.fields.updated:
+        print('Skip due to no change since last sync.')
+        return
+    if mirrors is not None:
+        issue = mirrors.get(bz_id)
+    elif key:
+        issue = jira.issue(key)
+    else:
+        issues_found_by_mantis_id = jira.search_issues('project = %s AND "Mantis ID" ~ "%s"' % (project_key, bz_id), fields='key')
+        issues_found_by_related_task = jira.search_issues('project = %s AND issue in linkedIssues(%s, "relates to")' % (project_key, bz_id), fields='key')
+        issues = issues_found_by_mantis_id + issues_found_by_related_task
+        issue = jira.issue(issues[0].key) if issues else None
+    if issue:
+        print('Corresponding Jira issue found: %s' % issue)
         if str(issue.fields.status) == 'Closed':
            print('Skip due to issue closed.')
            return
@@ -52,108 +76,122 @@ def sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, project_key, yes
             ans = input("Create a new issue? ")
             if ans not in ['y', 'Y', 'yes']:
                 return
-        issue = create_issue(bug)
+        with metrics.phase('create'):
+            issue = create_issue(bug)
         print('New Jira issue created: %s' % issue)
+    state.set_issue(new_jira_server, bz_id, issue.key)
+    index = MirrorIndex(issue, state.items(new_jira_server, bz_id))
+
+    def upload(a, filename):
+        chunks = lambda: a.iter_content(spool.CHUNK_BYTES)
+        with open_attachment(cache, new_jira_server, a.id, chunks) as f:
+            with metrics.phase('attach'):
+                jira.add_attachment(issue, f, filename)
+        index.add_file(filename)
+        print('File %s (%d bytes)attached' % (filename, a.size))
+        state.add_item(new_jira_server, bz_id, 'attachment', a.id)
+
+    def post(body, kind, item_id, message):
+        with metrics.phase('comment'):
+            jira.add_comment(issue, body)
+        index.add_comment(body)
+        print(message)
+        state.add_item(new_jira_server, bz_id, kind, item_id)
+
+    with IssueWriter() as writer:
+        for a in attachments:
+            root, ext = os.path.splitext(a.filename)
+            filename = '{}-{}{}'.format(root, a.id, ext)
+            import urllib.request, urllib.error, urllib.parse
+            filename = urllib.parse.quote(filename.encode('utf-8'))
+            if len(filename) >= 255:
+                ext_len = len(ext)
+                filename = filename[:255-ext_len] + ext
+                print('Filename too long, truncate to 255')
+            if index.has('attachment', a.id) or index.has_file(filename):
+                continue
 
-    def find_attachment(filename):
-        for a in issue.fields.attachment:
-            if a.filename == filename:
-                return a
-
-    def find_attachment_comment(attach_id):
-        for c in issue.fields.comment.comments:
-            first_line = c.body.split('\n', 1)[0]
-            if attach_id in first_line:
-                return c
-
-    for a in attachments:
-        root, ext = os.path.splitext(a.filename)
-        filename = '{}-{}{}'.format(root, a.id, ext)
-        import urllib.request, urllib.error, urllib.parse
-        filename = urllib.parse.quote(filename.encode('utf-8'))
-        if len(filename) >= 255:
-            ext_len = len(ext)
-            filename = filename[:255-ext_len] + ext
-            print('Filename too long, truncate to 255')
-        if find_attachment(filename):
-            continue
-
-        if a.size > MAX_OLD_JIRA_ATTACHMENT_BYTES:
-            if find_attachment_comment(a.id):
+            if a.size > MAX_OLD_JIRA_ATTACHMENT_BYTES:
+                downlaod_url = '%s/secure/attachment/%s/%s' % (new_jira_server, a.id, filename)
+                comment = '{}\nbig attachment {}'.format(downlaod_url,
+                                                         a.filename)
+                writer.write(post, comment, 'attachment', a.id,
+                             'Comment for file over 10MB:' + comment)
+            else:
+                writer.attach(upload, a, filename)
+
+        for c in comments:
+            comment_id = c.id
+            if index.has('comment', comment_id):
                 continue
-            downlaod_url = '%s/secure/attachment/%s/%s' % (new_jira_server, a.id, filename)
-            comment = '{}\nbig attachment {}'.format(downlaod_url,
-                                                     a.filename)
-            jira.add_comment(issue, comment)
-            print('Comment for file over 10MB:' + comment)
-        else:
-            jira.add_attachment(issue, BytesIO(a.get()), filename)
-            print('File %s (%d bytes)attached' % (filename, a.size))
-
-    def find_comment(comment_id):
-        for c in issue.fields.comment.comments:
-            first_line = c.body.split('\n', 1)[0]
-            if first_line.endswith('#comment-%s' % comment_id):
-                return c
-
-    for c in comments:
-        comment_id = c.id
-        if find_comment(comment_id):
-            continue
-        body = '''%s/browse/%s?focusedCommentId=%s#comment-%s
+            body = '''%s/browse/%s?focusedCommentId=%s#comment-%s
 
 {quote}
 *%s %s*
 
 %s
 {quote}
-        ''' % (new_jira_server, bz_id, comment_id, comment_id, c.author.displayName, c.created, c.body)
-        jira.add_comment(issue, body)
-        print('Comment %s created' % comment_id)
+            ''' % (new_jira_server, bz_id, comment_id, comment_id, c.author.displayName, c.created, c.body)
+            writer.write(post, body, 'comment', comment_id,
+                         'Comment %s created' % comment_id)
 
     bug_status = bug.fields.status.name.upper()
     if bug_status in ['VERIFIED', 'CLOSE', 'DONE', 'CLOSED']:
         if issue.fields.status.name == 'Open':
-            jira.transition_issue(issue, 'Assign to')
+            meta.transition(issue, 'Assign to')
         elif issue.fields.status.name == 'Assigned':
-            jira.transition_issue(issue, 'Resolved',
+            meta.transition(issue, 'Resolved',
                 customfield_12044='NA', # build path
                 fixVersions=[{'name':'NA'}],
                 customfield_13443={'value':'---'}, # resolved reason
                 customfield_12014='NA', # root cause
                 customfield_11707='NA', # solution 
                 comment='Change to Resolved due to JIRA #%s is %s' % (bz_id, bug.status))
+    state.set_issue(new_jira_server, bz_id, issue.key, bug.fields.updated)
 
 
-def sync_bz_to_jira(bz, bz_id, jira, project_key, yes_all):
+def sync_bz_to_jira(bz, bz_id, jira, project_key, yes_all, bug=None, state=None, mirrors=None, meta=None,
+                    cache=None):
     '''
     issues_in_proj = jira.search_issues('project = project_key AND "BugZilla ID" ~ "%s"' % jira_id)
     found jira_id
     create new issue if not found
     create attachment if not exists, (use <desc>-<attachid> as filename)
     create comment if not exists
+
+    bug can be given when it was already fetched, e.g. by bz.issues(), and
+    mirrors when the Jira issues of a batch were looked up together, see
+    bz_mirrors()
     '''
-    bug = bz.issue(bz_id)
+    state = state or SyncState()
+    meta = meta or JiraMeta(jira)
+    if bug is None:
+        with metrics.phase('fetch'):
+            bug = bz.issue(bz_id)
     if not bug:
         return
     bz_server = bz.bz_server
 
-    print('Bugzilla id %s found: %s' % (bz_id, bug.short_desc))
+    print('Bugzilla id %s found: %s' % (bz_id, bug.summary))
 
     def create_issue(bug):
-        issue = jira.create_issue(project=project_key,
-                                  summary=bug.short_desc,
-                                  description=bug.long_desc[0].thetext,
-                                  issuetype={'name': 'Bug'},
-                                  priority={'name': 'Critical' if bug.priority == 'P1' else 'Major'},
-                                  customfield_10216=str(bug.bug_id))
+        issue = jira.create_issue(project={'id': meta.project_id(project_key)},
+                                  **bzsync.issue_fields(bug))
         return issue
 
-    issues = jira.search_issues('project = %s AND "BugZilla ID" ~ "%s"' % (project_key, bz_id))
-    if issues:
-        issue = issues[0]
-        issue = jira.issue(issue.key)
-        print('Corresponding Jira issue found: %s' % issues[0])
+    key, last_change = state.issue(bz_server, bz_id)
+    if key and last_change == bug.last_change:
+        print('Skip due to no change since last sync.')
+        return
+    if mirrors is not None:
+        issue = mirrors.get(str(bz_id))
+    elif key:
+        issue = jira.issue(key)
+    else:
+        issues = jira.search_issues('project = %s AND "BugZilla ID" ~ "%s"' % (project_key, bz_id), fields='key')
+        issue = jira.issue(issues[0].key) if issues else None
+    if issue:
+        print('Corresponding Jira issue found: %s' % issue)
         if str(issue.fields.status) == 'Closed':
            print('Skip due to issue closed.')
            return
@@ -167,91 +205,66 @@ def sync_bz_to_jira(bz, bz_id, jira, project_key, yes_all):
             if ans not in ['y', 'Y', 'yes']:
                 return
         # create
-        issue = create_issue(bug)
+        with metrics.phase('create'):
+            issue = create_issue(bug)
         print('New Jira issue created: %s' % issue)
-
-    def find_attachment(filename):
-        for a in issue.fields.attachment:
-            if a.filename == filename:
-                return a
-
-    def find_comment(index):
-        for c in issue.fields.comment.comments:
-            first_line = c.body.split('\n', 1)[0]
-            if first_line.endswith('c%d' % index):
-                return c
-
-    for a in bug.attachment:
-        if not a.filename:
-            print('skip attachment %s due to its name %s' % (a.attachid,
-                                                             a.filename))
-            continue
-
-        root, ext = os.path.splitext(a.filename)
-        filename = '%s-%s%s' % (root, a.attachid, ext)
-        if filename.encode('utf-8') != filename:
-            import urllib.request, urllib.error, urllib.parse
-            filename = urllib.parse.quote(filename.encode('utf-8'))
-
-        if len(filename) >= 255:
-            ext_len = len(ext)
-            filename = filename[:255-ext_len] + ext
-            print('Filename too long, truncate to 255')
-
-        if find_attachment(filename):
-            continue
-        if len(a.content) < MAX_OLD_JIRA_ATTACHMENT_BYTES:
-            jira.add_attachment(issue, BytesIO(a.content), filename)
-            print('File %s (%d bytes)attached' % (filename, len(a.content)))
-        else:
-            if find_attachment_comment(a.attachid):
+    state.set_issue(bz_server, bz_id, issue.key)
+    index = MirrorIndex(issue, state.items(bz_server, bz_id))
+
+    def upload(a, filename):
+        with open_attachment(cache, bz_server, a.id, a.chunks) as f:
+            with metrics.phase('attach'):
+                jira.add_attachment(issue, f, filename)
+        index.add_file(filename)
+        print('File %s (%d bytes)attached' % (filename, a.size))
+        state.add_item(bz_server, bz_id, 'attachment', a.id)
+
+    def post(body, kind, item_id, message):
+        with metrics.phase('comment'):
+            jira.add_comment(issue, body)
+        index.add_comment(body)
+        print(message)
+        state.add_item(bz_server, bz_id, kind, item_id)
+
+    with IssueWriter() as writer:
+        for a in bug.attachments:
+            filename = bzsync.attachment_filename(a)
+            if not filename:
                 continue
-            downlaod_url = bz.url + 'attachment.cgi?id=' + str(a.attachid)
-            comment = '{}\nbig attachment {}'.format(downlaod_url,
-                                                     a.attachid)
-            jira.add_comment(issue, comment)
-            print('Comment for file over 10MB:' + comment)
+            if index.has('attachment', a.id) or index.has_file(filename):
+                continue
+            if a.size < MAX_OLD_JIRA_ATTACHMENT_BYTES:
+                writer.attach(upload, a, filename)
+            else:
+                comment = bzsync.big_attachment_comment(bz_server, a)
+                writer.write(post, comment, 'attachment', a.id,
+                             'Comment for file over 10MB:' + comment)
+
+        for c in bug.comments:
+            if index.has('comment', c.id):
+                continue
+            body = bzsync.comment_body(bz_server, bz_id, c)
+            writer.write(post, body, 'comment', c.id, 'Comment %s created' % c.id)
 
-    for i, c in enumerate(bug.long_desc):
-        if i == 0:
-            continue
-        if find_comment(i):
-            continue
-        body = '''%s/show_bug.cgi?id=%s#c%d
+    if bzsync.should_resolve(bug, str(issue.fields.status)):
+        meta.transition(issue, 'Resolve Issue', **bzsync.resolve_fields(bug))
+    state.set_issue(bz_server, bz_id, issue.key, bug.last_change)
 
-{quote}
-*%s %s*
 
-%s
-{quote}
-        ''' % (bz_server, bz_id, i, c.who, c.bug_when, c.thetext)
-        jira.add_comment(issue, body)
-        print('Comment %s created' % i)
-
-    if (bug.status in ['RESOLVED', 'VERIFIED'] and
-        str(issue.fields.status) not in ['Resolved', 'Verified', 'Closed']):
-        resolution_map = {
-            'FIXED': 'Fixed',
-            'INVALID': 'Invalid',
-            'WONTFIX': "Won't Fix",
-            'LATER': 'Remind',
-            'DUPLICATE': 'Duplicate',
-            'WORKSFORME': 'Cannot Reproduce',
-            'SpecChanged': 'Spec Changed'
-        }
-        jira.transition_issue(issue, 'Resolve Issue',
-        resolution={'name': resolution_map[bug.resolution]},
-        comment='Change to Resolved due to Bugzilla #%s is %s' % (bz_id, bug.status))
-
-
-def sync_mantis_to_jira(mantis_server, username, passwd, mantis_id, jira, project_key, board_id, yes_all):
-
-    bug = mantis.issue(mantis_server, username, passwd, mantis_id)
+def sync_mantis_to_jira(mt, mantis_id, jira, project_key, board_id, yes_all, bug=None, state=None, mirrors=None,
+                        meta=None, cache=None):
+
+    mantis_server = mt.mantis_server
+    state = state or SyncState()
+    meta = meta or JiraMeta(jira)
+    if bug is None:
+        with metrics.phase('fetch'):
+            bug = mt.issue(mantis_id)
 
     print('Mantis id %s found: %s' % (mantis_id, bug.summary))
 
     def create_issue(bug):
-        issue = jira.create_issue(project=project_key,
+        issue = jira.create_issue(project={'id': meta.project_id(project_key)},
                                   summary='[Mantis#%s] ' % bug.id + bug.summary,
                                   description=bug.description,
                                   issuetype={'name': 'Task'},
@@ -262,13 +275,21 @@ def sync_mantis_to_jira(mantis_server, username, passwd, mantis_id, jira, projec
         issue.update(assignee={'name': None})
         return issue
 
-    issues_found_by_mantis_id = jira.search_issues('project = %s AND "Mantis ID" ~ "Mantis-%s"' % (project_key, mantis_id))
-    issues_found_by_related_task = jira.search_issues('project = %s AND issueFunction in linkedIssuesOfRemote("title", "Mantis-%s")' % (project_key, mantis_id))
-    issues = issues_found_by_mantis_id + issues_found_by_related_task
-    if issues:
-        issue = issues[0]
-        issue = jira.issue(issue.key)
-        print('Corresponding Jira issue found: %s' % issues[0])
+    key, last_change = state.issue(mantis_server, mantis_id)
+    if key and last_change == bug.last_change:
+        print('Skip due to no change since last sync.')
+        return
+    if mirrors is not None:
+        issue = mirrors.get(str(mantis_id))
+    elif key:
+        issue = jira.issue(key)
+    else:
+        issues_found_by_mantis_id = jira.search_issues('project = %s AND "Mantis ID" ~ "Mantis-%s"' % (project_key, mantis_id), fields='key')
+        issues_found_by_related_task = jira.search_issues('project = %s AND issueFunction in linkedIssuesOfRemote("title", "Mantis-%s")' % (project_key, mantis_id), fields='key')
+        issues = issues_found_by_mantis_id + issues_found_by_related_task
+        issue = jira.issue(issues[0].key) if issues else None
+    if issue:
+        print('Corresponding Jira issue found: %s' % issue)
         if str(issue.fields.status) == 'Closed':
            print('Skip due to issue closed.')
            return
@@ -282,92 +303,88 @@ def sync_mantis_to_jira(mantis_server, username, passwd, mantis_id, jira, projec
             if ans not in ['y', 'Y', 'yes']:
                 return
         # create
-        issue = create_issue(bug)
+        with metrics.phase('create'):
+            issue = create_issue(bug)
         print('New Jira issue created: %s' % issue)
-
-    def find_attachment(filename):
-        # TODO: use filename as key?
-        for a in issue.fields.attachment:
-            if a.filename == filename:
-                return a
-
-    def find_attachment_comment(attach_id):
-        for c in issue.fields.comment.comments:
-            first_line = c.body.split('\n', 1)[0]
-            if first_line.endswith('=%s' % attach_id):
-                return c
-
-    def find_comment(index):
-        for c in issue.fields.comment.comments:
-            first_line = c.body.split('\n', 1)[0]
-            if first_line.endswith('c%d' % index):
-                return c
+    state.set_issue(mantis_server, mantis_id, issue.key)
+    index = MirrorIndex(issue, state.items(mantis_server, mantis_id))
 
     def move_to_current_sprint(board_id, issue):
-        for sprint in jira.sprints(board_id):
-            if sprint.state == 'ACTIVE':
-                cur_srpint = sprint
-                break
-        else:
+        sprint = meta.active_sprint(board_id)
+        if sprint is None:
             print('[WARN] cannot find active sprint on board %s for moving' % board_id)
             return
         jira.add_issues_to_sprint(sprint.id, [issue.key])
         print('Move issue %s to sprint %s' % (issue.key, sprint.name))
 
-    for a in bug.attachments:
-        root, ext = os.path.splitext(a.filename)
-        if root.encode('utf-8') != root:
-            import urllib.request, urllib.error, urllib.parse
-            root = urllib.parse.quote(root.encode('utf-8'))
-        if len(root) + len(str(a.id)) + len(ext) > 255:
-            root = root[:255-len(str(a.id))-len(ext)-1]
-        filename = '%s-%s%s' % (root, a.id, ext)
-        if find_attachment(filename):
-            continue
+    def upload(a, filename):
         try:
-            content = BytesIO(a.content)
+            content = open_attachment(cache, mantis_server, a.id, a.chunks)
         except:
             print('[ERROR] get attachment %s failed' % a)
-            continue
-        content_len = content.getbuffer().nbytes
-        if content_len < MAX_OLD_JIRA_ATTACHMENT_BYTES:
-            aa = jira.add_attachment(issue, content, filename)
-            print('File %s (%d bytes)attached' % (filename, content_len))
-        else:
-            if find_attachment_comment(a.id):
+            return
+        with content, metrics.phase('attach'):
+            jira.add_attachment(issue, content, filename)
+        index.add_file(filename)
+        print('File %s (%d bytes)attached' % (filename, a.size))
+        state.add_item(mantis_server, mantis_id, 'attachment', a.id)
+
+    def post(body, kind, item_id, message):
+        with metrics.phase('comment'):
+            jira.add_comment(issue, body)
+        index.add_comment(body)
+        print(message)
+        state.add_item(mantis_server, mantis_id, kind, item_id)
+
+    commented = False
+    with IssueWriter() as writer:
+        for a in bug.attachments:
+            root, ext = os.path.splitext(a.filename)
+            if root.encode('utf-8') != root:
+                import urllib.request, urllib.error, urllib.parse
+                root = urllib.parse.quote(root.encode('utf-8'))
+            if len(root) + len(str(a.id)) + len(ext) > 255:
+                root = root[:255-len(str(a.id))-len(ext)-1]
+            filename = '%s-%s%s' % (root, a.id, ext)
+            if index.has('attachment', a.id) or index.has_file(filename):
                 continue
-            downlaod_url = (mantis_server +
-                            '/file_download.php?&type=bug&file_id=' +
-                            str(a.id))
-            comment = '{}\nbig attachment {}'.format(downlaod_url,
-                                                     a.filename)
-            jira.add_comment(issue, comment)
-            print('Comment for file over 10MB:' + comment)
-
-    for i, c in enumerate(bug.notes):
-        if find_comment(c.id):
-            continue
-        body = '''%s/view.php?id=%s#c%s
+            if a.size < MAX_OLD_JIRA_ATTACHMENT_BYTES:
+                writer.attach(upload, a, filename)
+            else:
+                downlaod_url = (mantis_server +
+                                '/file_download.php?&type=bug&file_id=' +
+                                str(a.id))
+                comment = '{}\nbig attachment {}'.format(downlaod_url,
+                                                         a.filename)
+                writer.write(post, comment, 'attachment', a.id,
+                             'Comment for file over 10MB:' + comment)
+
+        for i, c in enumerate(bug.comments):
+            if index.has('comment', c.id):
+                continue
+            body = '''%s/view.php?id=%s#c%s
 
 {quote}
 *%s %s*
 
 %s
 {quote}
-        ''' % (mantis_server, mantis_id, c.id, c.who, c.when, c.text)
-        jira.add_comment(issue, body)
-        print('Comment %s created' % i)
-        if board_id:
-            move_to_current_sprint(board_id, issue)
+            ''' % (mantis_server, mantis_id, c.id, c.author, c.created, c.text)
+            writer.write(post, body, 'comment', c.id, 'Comment %s created' % i)
+            commented = True
+
+    if commented and board_id:
+        move_to_current_sprint(board_id, issue)
 
     if bug.status in ['resolved', 'closed']:
         if issue.fields.issuetype.name == 'Bug':
             if issue.fields.status.name == 'Open':
-                jira.transition_issue(issue, 'Assign to ')
+                meta.transition(issue, 'Assign to ')
             elif issue.fields.status.name in ['Assigned', 'Need more info']:
+                status = None
                 if issue.fields.status.name == 'Need more info':
-                    jira.transition_issue(issue, 'Feedback')
-                jira.transition_issue(issue, 'Resolved',
+                    status = meta.transition(issue, 'Feedback')
+                meta.transition(issue, 'Resolved', status,
                     customfield_12044='NA', # build path
                     fixVersions=[{'name':'NA'}],
                     customfield_13443={'value':'---'}, # resolved reason
@@ -375,11 +392,209 @@ def sync_mantis_to_jira(mantis_server, username, passwd, mantis_id, jira, projec
                     customfield_11707='NA', # solution
                     comment='Change to Resolved due to Mantis #%s is %s' % (mantis_id, bug.status))
         elif issue.fields.issuetype.name == 'Task':
+            status = None
             if issue.fields.status.name in ['To Do', 'reopen']:
-                jira.transition_issue(issue, 'handling')
+                status = meta.transition(issue, 'handling')
             comment = 'Change to Close due to Mantis #%s is %s' % (mantis_id, bug.status)
             jira.add_comment(issue, comment)
-            jira.transition_issue(issue, 'done')
+            meta.transition(issue, 'done', status)
+    state.set_issue(mantis_server, mantis_id, issue.key, bug.last_change)
+
+
+SYNCED_FILENAME = re.compile(r'-(\d+)$')
+
+
+def open_attachment(cache, source, attach_id, chunks):
+    '''
+    Attachment content from cache (an AttachmentCache or None), else from
+    chunks(), an iterable of bytes written straight to the cache if any
+    '''
+    with metrics.phase('download'):
+        if cache is None:
+            return spool.from_chunks(chunks())
+        return cache.open(source, attach_id, chunks)
+
+
+def bz_id_of(issue):
+    bz_id = issue.fields.customfield_10216
+    if bz_id and bz_id.isdigit():
+        return bz_id
+
+
+def mantis_id_of(issue):
+    mantis_id = issue.fields.customfield_14100
+    if mantis_id and mantis_id.startswith('Mantis-'):
+        return mantis_id[len('Mantis-'):]
+
+
+def new_jira_key_of(issue):
+    key = issue.fields.customfield_14100
+    if key and len(key.split('-')[0]) == 8: # QTSHBS00, QTSHBM00
+        return key
+
+
+def bz_mirrors(jira, project_key, state, bz_server, bz_ids):
+    known_keys = {}
+    for bz_id in bz_ids:
+        key, _ = state.issue(bz_server, bz_id)
+        if key:
+            known_keys[bz_id] = key
+    return find_mirrors(jira, project_key, 'BugZilla ID', 'customfield_10216',
+                        bz_ids, known_keys)
+
+
+def mantis_mirrors(jira, project_key, state, mantis_server, mantis_ids):
+    known_keys = {}
+    for mantis_id in mantis_ids:
+        key, _ = state.issue(mantis_server, mantis_id)
+        if key:
+            known_keys['Mantis-' + mantis_id] = key
+
+    def linked_values(issue):
+        return [link.object.title for link in jira.remote_links(issue)]
+
+    found = find_mirrors(
+        jira, project_key, 'Mantis ID', 'customfield_14100',
+        ['Mantis-' + mantis_id for mantis_id in mantis_ids], known_keys,
+        'issueFunction in linkedIssuesOfRemote("title", "%s")', linked_values)
+    return dict((value[len('Mantis-'):], issue)
+                for value, issue in found.items())
+
+
+def new_jira_mirrors(jira, project_key, state, new_jira_server, keys):
+    known_keys = {}
+    for key in keys:
+        jira_key, _ = state.issue(new_jira_server, key)
+        if jira_key:
+            known_keys[key] = jira_key
+
+    def linked_values(issue):
+        values = []
+        for link in issue.fields.issuelinks:
+            linked = getattr(link, 'outwardIssue', None) or link.inwardIssue
+            values.append(linked.key)
+        return values
+
+    return find_mirrors(
+        jira, project_key, 'Mantis ID', 'customfield_14100', keys, known_keys,
+        'issue in linkedIssues(%s, "relates to")', linked_values)
+
+
+def rebuild_state(state, source, jira, jql, source_id_of):
+    '''
+    Forget what state knows about source and fill it again from the mirror
+    issues in Jira, by the marker on the first line of synced comments and
+    the -<id> suffix of attachment filenames
+    '''
+    state.forget_source(source)
+    issues = search_all(
+        jira, jql, 'comment,attachment,customfield_10216,customfield_14100',
+        by_key=True)
+    count = 0
+    for issue in issues:
+        source_id = source_id_of(issue)
+        if not source_id:
+            continue
+        state.set_issue(source, source_id, issue.key)
+        index = MirrorIndex(issue)
+        for kind, item_id in index.items:
+            state.add_item(source, source_id, kind, item_id)
+        for filename in index.filenames:
+            m = SYNCED_FILENAME.search(os.path.splitext(filename)[0])
+            if m:
+                state.add_item(source, source_id, 'attachment', m.group(1))
+        count += 1
+    print('Sync state of %d issues rebuilt from Jira' % count)
+
+
+SINCE_FORMATS = ['%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+
+def parse_since(value):
+    for fmt in SINCE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    raise ValueError('time %r is not one of %s' % (value, SINCE_FORMATS))
+
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    '''
+    Seconds in a duration like 90, 90s, 30m or 2h
+    '''
+    m = re.match(r'^(\d+(?:\.\d+)?)([smh]?)$', value.strip())
+    if not m:
+        raise ValueError('duration %r is not like 90s, 30m or 2h' % value)
+    return float(m.group(1)) * DURATION_UNITS[m.group(2) or 's']
+
+
+def jql_since(since):
+    # relative minutes so the Jira user timezone does not matter
+    age = datetime.now(timezone.utc) - since
+    return '-%dm' % (age.total_seconds() // 60 + 1)
+
+
+def jql_and(jql, condition):
+    m = re.search(r'\border\s+by\b', jql, re.IGNORECASE)
+    if m:
+        return '(%s) AND %s %s' % (jql[:m.start()], condition, jql[m.start():])
+    return '(%s) AND %s' % (jql, condition)
+
+
+def new_jira_changed(new_jira, keys, since, chunk_size=100):
+    '''
+    The keys of issues updated at since or later
+    '''
+    changed = set()
+    for i in range(0, len(keys), chunk_size):
+        jql = 'key in (%s) AND updated >= %s' % (
+            ', '.join(keys[i:i + chunk_size]), jql_since(since))
+        changed.update(issue.key for issue in search_all(
+            new_jira, jql, 'key', validate_query=False))
+    return [key for key in keys if key in changed]
+
+
+def connect_jira(server, prompt='Jira'):
+    import jira.client
+    from jira import JIRA
+    from jira.resilientsession import ResilientSession
+
+    class Session(ResilientSession):
+        # JIRA() already asks for the fields before returning, install the
+        # transport on its session from the start
+        def __init__(self, *args, **kwargs):
+            ResilientSession.__init__(self, *args, **kwargs)
+            transport.install(self)
+    jira.client.ResilientSession = Session
+    # retries are left to the shared transport, see transport.install(), and
+    # nothing synced depends on the server version JIRA() would ask for
+    options = dict(max_retries=0, get_server_info=False)
+    if not get_netrc_auth(server):
+        user = input("%s Username:" % prompt)
+        passwd = getpass.getpass()
+        client = JIRA(server, basic_auth=(user, passwd), **options)
+    else:
+        client = JIRA(server, **options)
+    return client
+
+
+def replay_state(path):
+    '''
+    SyncState starting from a copy of the state the recording in path was
+    made with, so the replay skips and finds what the recorded run did
+    '''
+    snapshot = os.path.join(path, replay.STATE)
+    if not os.path.exists(snapshot):
+        return SyncState()
+    fd, copy = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    atexit.register(os.remove, copy)
+    shutil.copyfile(snapshot, copy)
+    return SyncState(copy)
 
 
 def monkey_patch():
@@ -393,7 +608,7 @@ def monkey_patch():
 
 def main():
     parser = argparse.ArgumentParser(description='Convert Bugzilla/Mantis issue to JIRA issue')
-    parser.add_argument('bz_id', help='Bugzilla ID')
+    parser.add_argument('bz_id', nargs='?', help='Bugzilla ID')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-b', metavar='', help='Bugzilla Server URL')
     group.add_argument('-m', metavar='', help='Mantis Server URL')
@@ -406,23 +621,154 @@ def main():
     parser.add_argument('-r', action='store_true', default=False, help='Revert')
     parser.add_argument('-p', metavar='', help='Mantis Project ID')
     parser.add_argument('-f', metavar='', help='Mantis Filter ID')
+    parser.add_argument('--workers', metavar='N', type=int, default=1,
+                        help='Sync N issues in parallel for -q/-r/-f (needs -y)')
+    parser.add_argument('--state', metavar='FILE',
+                        help='SQLite file keeping what is synced between runs')
+    parser.add_argument('--rebuild-state', action='store_true', default=False,
+                        help='Refill --state from the issues in Jira and exit')
+    parser.add_argument('--since', metavar='TIME', nargs='?', const='last',
+                        help='Only sync issues changed since TIME (UTC, '
+                        'YYYY-MM-DD [HH:MM]), or since the last run kept in '
+                        '--state when TIME is left out')
+    parser.add_argument('--rate', metavar='N', type=float, default=0,
+                        help='At most N requests per second to each server '
+                        '(default: no limit)')
+    parser.add_argument('--connect-timeout', metavar='SEC', type=float,
+                        default=transport.TIMEOUT[0],
+                        help='Give up connecting to a server after SEC seconds')
+    parser.add_argument('--read-timeout', metavar='SEC', type=float,
+                        default=transport.TIMEOUT[1],
+                        help='Give up waiting for a response after SEC seconds')
+    parser.add_argument('--reprobe', action='store_true', default=False,
+                        help='Ask Bugzilla again whether it supports REST '
+                        'instead of using the cached answer')
+    parser.add_argument('--deadline', metavar='TIME',
+                        help='Stop starting new issues TIME (e.g. 90s, 30m, '
+                        '2h) after the start, the rest are reported as skipped')
+    parser.add_argument('--attachment-cache', metavar='MB', type=float,
+                        default=ATTACHMENT_CACHE_BYTES // (1024 * 1024),
+                        help='Keep up to MB of downloaded attachments for '
+                        'reruns (0 to keep none)')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Write request and phase timings to FILE at the '
+                        'end, in the Prometheus text format if it ends with '
+                        '.prom, JSON otherwise')
+    parser.add_argument('--async', metavar='N', type=int, dest='async_requests',
+                        help='Sync -b -q/-r on an asyncio loop with up to N '
+                        'requests in flight (needs -y and aiohttp)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar='DIR',
+                       help='Save every HTTP request and response in DIR for '
+                       '--replay')
+    group.add_argument('--replay', metavar='DIR',
+                       help='Answer HTTP requests from a --record DIR instead '
+                       'of the servers')
+    parser.add_argument('--replay-timing', choices=('recorded', 'none'),
+                        default='recorded',
+                        help='Answer as slowly as the servers did, or at once '
+                        'and without --rate (default: recorded)')
     args = parser.parse_args()
-
+    if args.workers > 1 and not args.y:
+        parser.error('--workers needs -y, prompts cannot run in parallel')
+    if args.async_requests:
+        if not (args.y and args.b and (args.q or args.r)):
+            parser.error('--async needs -y and -b with -q or -r')
+        try:
+            from . import aio
+        except ImportError:
+            parser.error('--async needs aiohttp, pip install bzjira[async]')
+        if args.record or args.replay:
+            parser.error('--record and --replay do not cover --async')
+    if args.replay and args.state:
+        parser.error('--replay runs on the state saved by --record, leave out '
+                     '--state')
+    if args.rebuild_state and not args.state:
+        parser.error('--rebuild-state needs --state')
+    if (args.bz_id is None and not args.rebuild_state and not args.r
+            and not (args.p and args.f)):
+        parser.error('the following arguments are required: bz_id')
+    if args.since == 'last' and not (args.state or args.replay):
+        parser.error('--since without TIME needs --state')
+    deadline = None
+    if args.deadline:
+        try:
+            deadline = time.monotonic() + parse_duration(args.deadline)
+        except ValueError as e:
+            parser.error(str(e))
+
+
+    if args.metrics:
+        # also when the run fails, that is when the numbers are wanted
+        atexit.register(metrics.default().write, args.metrics)
+
+    # a recording holds every request of the run, so nothing is answered
+    # from the probe, WSDL or attachment caches instead
+    recording = None
+    rate = args.rate
+    if args.record:
+        recording = replay.Recorder(args.record)
+        snapshot = os.path.join(args.record, replay.STATE)
+        if args.state and os.path.exists(args.state):
+            shutil.copyfile(args.state, snapshot)
+        elif os.path.exists(snapshot):
+            os.remove(snapshot)
+    elif args.replay:
+        recording = replay.Player(args.replay, args.replay_timing == 'recorded')
+        if args.replay_timing == 'none':
+            rate = 0
+    transport.set_default(transport.Transport(
+        rate=rate, timeout=(args.connect_timeout, args.read_timeout),
+        deadline=deadline, recording=recording))
 
     jira_server = args.j
-    if not get_netrc_auth(jira_server):
-        user = input("Jira Username:")
-        passwd = getpass.getpass()
-        jira = JIRA(jira_server, basic_auth=(user, passwd))
+    jira = connect_jira(jira_server)
+    meta = JiraMeta(jira)
+    cache = None
+    if args.attachment_cache and recording is None:
+        cache = AttachmentCache(max_bytes=int(args.attachment_cache * 1024 * 1024))
+
+    if args.replay:
+        state = replay_state(args.replay)
     else:
-        jira = JIRA(jira_server)
-    jira.search_issues = partial(jira.search_issues, maxResults=1000)
+        state = SyncState(args.state) if args.state else SyncState()
+    if args.rebuild_state:
+        if args.b:
+            jql = 'project = %s AND "BugZilla ID" is not empty' % args.k
+            rebuild_state(state, args.b, jira, jql, bz_id_of)
+        elif args.m:
+            jql = 'project = %s AND "Mantis ID" is not empty' % args.k
+            rebuild_state(state, args.m, jira, jql, mantis_id_of)
+        elif args.nj:
+            jql = 'project = %s AND "Mantis ID" is not empty' % args.k
+            rebuild_state(state, args.nj, jira, jql, new_jira_key_of)
+        return
+
+    # high-water mark of this source, project and query
+    cursor_name = '%s|%s|%s' % (args.b or args.m or args.nj, args.k,
+                                '-r' if args.r else args.bz_id or
+                                'filter %s/%s' % (args.p, args.f))
+    run_start = datetime.now(timezone.utc)
+    since = None
+    if args.since:
+        since = args.since
+        if since == 'last':
+            # nothing kept on the first run, so sync everything
+            since = state.cursor(cursor_name)
+        try:
+            since = since and parse_since(since)
+        except ValueError as e:
+            parser.error(str(e))
+        if since:
+            print('Sync issues changed since %s' % since)
+    summary = None
 
     bz_server = args.b
 
     if args.b:  # bugzilla
+        from . import bugzilla
         bz_server = args.b
-        bz = bugzilla.Bugzilla(bz_server)
+        bz = bugzilla.Bugzilla(bz_server, reprobe=args.reprobe or recording is not None)
         auth = get_netrc_auth(bz_server)
         if not auth:
             bz_username = input("Bugzilla Username:")
@@ -430,80 +776,140 @@ def main():
         else:
             bz_username, bz_passwd = auth
         bz.login(bz_username, bz_passwd)
+        def sync(pair):
+            bug, mirrors = pair
+            sync_bz_to_jira(bz, bug.id, jira, args.k, args.y, bug=bug, state=state, mirrors=mirrors, meta=meta, cache=cache)
+        label = lambda pair: str(pair[0].id)
+        def with_bz_mirrors(bugs):
+            return with_mirrors(bugs, lambda bug: str(bug.id),
+                                lambda bz_ids: bz_mirrors(jira, args.k, state, bz_server, bz_ids),
+                                unchanged=lambda bug: state.unchanged(bz_server, bug.id, bug.last_change))
+        def run(bz_ids):
+            if args.async_requests:
+                jira_auth = jira._session.auth or get_netrc_auth(jira_server)
+                return aio.sync_bz(bz, bz_ids, jira_server, jira_auth, args.k, state,
+                                   args.async_requests, deadline, cache)
+            bz_ids = Ids(bz_ids)
+            return run_batch(sync, with_bz_mirrors(bz.issues(bz_ids)), args.workers, label,
+                             deadline=deadline, ids=bz_ids)
         if args.q:  # query
-            bz_id_list = bz.buglist(args.bz_id)
-            for bz_id in bz_id_list:
-                sync_bz_to_jira(bz, bz_id, jira, args.k, args.y)
+            summary = run(bz.buglist(args.bz_id, since))
         elif args.r:  # find jira
-            issues = jira.search_issues('project = %s AND "BugZilla ID" is not empty '
-            'AND status not in ("Resolved", "Closed", "Remind", "Verified")' % (args.k))
-            for issue in issues:
-                bz_id = issue.fields.customfield_10216
-                if bz_id.startswith('Mantis-'):
-                    continue
-                if bz_id.startswith('QTSHBS'):
-                    continue
-                try:
-                    int(bz_id)
-                except ValueError:
-                    continue
-                sync_bz_to_jira(bz, bz_id, jira, args.k, args.y)
+            issues = search_all(jira, 'project = %s AND "BugZilla ID" is not empty '
+            'AND status not in ("Resolved", "Closed", "Remind", "Verified")' % (args.k),
+            'customfield_10216', by_key=True)
+            if since:
+                changed = set(str(bz_id) for bz_id in bz.buglist('', since))
+            def bz_id_list():
+                for issue in issues:
+                    bz_id = issue.fields.customfield_10216
+                    if bz_id.startswith('Mantis-'):
+                        continue
+                    if bz_id.startswith('QTSHBS'):
+                        continue
+                    try:
+                        int(bz_id)
+                    except ValueError:
+                        continue
+                    if since and bz_id not in changed:
+                        continue
+                    yield bz_id
+            summary = run(bz_id_list())
         else:  # single bz id
-            sync_bz_to_jira(bz, args.bz_id, jira, args.k, args.y)
+            sync_bz_to_jira(bz, args.bz_id, jira, args.k, args.y, state=state, meta=meta, cache=cache)
     elif args.m:
+        from . import mantis
+        monkey_patch()
         auth = get_netrc_auth(args.m)
         if not auth:
             username = input("Username:")
             passwd = getpass.getpass()
         else:
             username, passwd = auth
+        mt = mantis.Mantis(args.m, username, passwd,
+                           0 if recording is not None else mantis.WSDL_CACHE_DAYS)
+        resolve = lambda mantis_ids: mantis_mirrors(jira, args.k, state, args.m, mantis_ids)
         if args.p and args.f:
-            for bz_id in mantis.filter_get_issues(args.m, username, passwd, args.p, args.f):
-                sync_mantis_to_jira(args.m, username, passwd, bz_id, jira, args.k, args.o, args.y)
+            def sync(pair):
+                bug, mirrors = pair
+                sync_mantis_to_jira(mt, bug.id, jira, args.k, args.o, args.y, bug=bug, state=state, mirrors=mirrors, meta=meta, cache=cache)
+            bugs = mt.filter_get_issues(args.p, args.f, since=since)
+            unchanged = lambda bug: state.unchanged(args.m, bug.id, bug.last_change)
+            summary = run_batch(sync, with_mirrors(bugs, lambda bug: str(bug.id), resolve,
+                                                   unchanged=unchanged),
+                                args.workers, lambda pair: str(pair[0].id), deadline=deadline)
         elif args.r:  # find jira
-            issues_found_by_mantis_id = jira.search_issues('project = %s AND "Mantis ID" is not empty AND status not in ("Resolved", "Closed", "Verified", "Abort")' % (args.k))
-            issues_found_by_related_task = jira.search_issues('project = %s AND issueFunction in linkedIssuesOfRemote("title", "Mantis-*") AND status not in ("Close", "Abort")' % (args.k))
-            issues = issues_found_by_mantis_id + issues_found_by_related_task
-            for issue in issues:
-                bz_id = issue.fields.customfield_14100
-                if bz_id is None:
-                    for remote_link in jira.remote_links(issue):
-                        remote_link_title = remote_link.object.title
-                        if remote_link_title.startswith('Mantis-'):
-                            bz_id = remote_link_title
-                if not bz_id.startswith('Mantis-'):
-                    continue
-                bz_id = bz_id.lstrip('Mantis-')
-                sync_mantis_to_jira(args.m, username, passwd, bz_id, jira, args.k, args.o, args.y)
+            issues_found_by_mantis_id = search_all(jira, 'project = %s AND "Mantis ID" is not empty AND status not in ("Resolved", "Closed", "Verified", "Abort")' % (args.k), 'customfield_14100', by_key=True)
+            issues_found_by_related_task = search_all(jira, 'project = %s AND issueFunction in linkedIssuesOfRemote("title", "Mantis-*") AND status not in ("Close", "Abort")' % (args.k), 'customfield_14100', by_key=True)
+            issues = chain(issues_found_by_mantis_id, issues_found_by_related_task)
+            if since:
+                changed = set(str(i) for i in mt.changed_issue_ids(args.p or 0, since))
+            def bz_id_list():
+                for issue in issues:
+                    bz_id = issue.fields.customfield_14100
+                    if bz_id is None:
+                        for remote_link in jira.remote_links(issue):
+                            remote_link_title = remote_link.object.title
+                            if remote_link_title.startswith('Mantis-'):
+                                bz_id = remote_link_title
+                    if not bz_id.startswith('Mantis-'):
+                        continue
+                    bz_id = bz_id.lstrip('Mantis-')
+                    if since and bz_id not in changed:
+                        continue
+                    yield bz_id
+            def sync(pair):
+                bz_id, mirrors = pair
+                sync_mantis_to_jira(mt, bz_id, jira, args.k, args.o, args.y, state=state, mirrors=mirrors, meta=meta, cache=cache)
+            mantis_ids = Ids(bz_id_list())
+            summary = run_batch(sync, with_mirrors(mantis_ids, str, resolve),
+                                args.workers, lambda pair: pair[0], deadline=deadline,
+                                ids=mantis_ids)
         else:
-            sync_mantis_to_jira(args.m, username, passwd, args.bz_id, jira, args.k, args.o, args.y)
+            sync_mantis_to_jira(mt, args.bz_id, jira, args.k, args.o, args.y, state=state, meta=meta, cache=cache)
     elif args.nj:
         new_jira_server = args.nj
-        if not get_netrc_auth(new_jira_server):
-            user = input("New Jira Username:")
-            passwd = getpass.getpass()
-            new_jira = JIRA(new_jira_server, basic_auth=(user, passwd))
-        else:
-            new_jira = JIRA(new_jira_server)
+        new_jira = connect_jira(new_jira_server, 'New Jira')
+        def sync(pair):
+            bz_id, mirrors = pair
+            with metrics.phase('fetch'):
+                bug = new_jira.issue(bz_id)
+            sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, args.k, args.y, state=state, mirrors=mirrors, meta=meta, cache=cache)
+        label = lambda pair: pair[0]
+        def run(keys):
+            keys = Ids(keys)
+            return run_batch(sync, with_mirrors(keys, str,
+                                                lambda keys: new_jira_mirrors(jira, args.k, state, new_jira_server, keys)),
+                             args.workers, label, deadline=deadline, ids=keys)
         if args.q:  # query
-            buglist = new_jira.search_issues(args.bz_id, startAt=0, maxResults=200)
-            for bug_entry in buglist:
-                bug = new_jira.issue(bug_entry.key)
-                sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, args.k, args.y)
+            jql = args.bz_id
+            if since:
+                jql = jql_and(jql, 'updated >= %s' % jql_since(since))
+            buglist = search_all(new_jira, jql, 'key')
+            summary = run(bug_entry.key for bug_entry in buglist)
         elif args.r:  # find jira
-            issues = jira.search_issues('project = %s AND "Mantis ID" is not empty '
+            issues = search_all(jira, 'project = %s AND "Mantis ID" is not empty '
                 'AND status not in ("Resolved", "Closed", "Verified", "Abort")' % (
-                    args.k))
-            for issue in issues:
-                bz_id = issue.fields.customfield_14100
-                if len(bz_id.split('-')[0]) != 8: # QTSHBS00, QTSHBM00
-                    continue
-                bug = new_jira.issue(bz_id)
-                sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, args.k, args.y)
+                    args.k), 'customfield_14100', by_key=True)
+            def bz_id_list():
+                for issue in issues:
+                    bz_id = issue.fields.customfield_14100
+                    if len(bz_id.split('-')[0]) != 8: # QTSHBS00, QTSHBM00
+                        continue
+                    yield bz_id
+            keys = list(bz_id_list())
+            if since:
+                keys = new_jira_changed(new_jira, keys, since)
+            summary = run(keys)
         else:  # single jira id
             bug = new_jira.issue(args.bz_id)
-            sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, args.k, args.y)
+            sync_new_jira_to_jira(new_jira_server, new_jira, bug, jira, args.k, args.y, state=state, meta=meta, cache=cache)
+
+    if summary:
+        summary.report()
+        if not summary.failed and not summary.stopped:
+            state.set_cursor(cursor_name,
+                             run_start.strftime(SINCE_FORMATS[0]))
 
 if __name__ == '__main__':
-    monkey_patch()
     main()
@@ -0,0 +1,574 @@
+import asyncio
+import contextvars
+import json
+import sys
+import time
+import traceback
+from functools import partial
+from io import StringIO
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from . import bzsync, metrics, spool, transport
+from .batch import Summary, log
+from .bugzilla import cgi, rest
+from .mirror import (MIRROR_FIELDS, MirrorIndex, _chunked, field_jql,
+                     key_jql)
+
+# requests in flight at once
+LIMIT = 100
+
+_output = contextvars.ContextVar('output', default=None)
+
+
+class _TaskOutput(object):
+    '''
+    Replacement of sys.stdout while the engine runs: what the sync of an
+    issue prints is kept and written out in one piece when it is done, like
+    batch._ThreadOutput does for threads.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __getattr__(self, key):
+        return getattr(self.stream, key)
+
+    def write(self, s):
+        buf = _output.get()
+        if buf is not None:
+            return buf.write(s)
+        return self.stream.write(s)
+
+    def flush(self):
+        if _output.get() is None:
+            self.stream.flush()
+
+
+class Response(object):
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise IOError('%s %s for %s' % (self.status, self.reason,
+                                            self.url))
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+    def objects(self):
+        '''
+        The JSON body with objects as attributes, the way jira.Issue reads
+        '''
+        return json.loads(self.body.decode('utf-8'),
+                          object_hook=lambda d: SimpleNamespace(**d))
+
+
+class HTTP(object):
+    '''
+    aiohttp session following the shared transport policy, see transport.py:
+    retries with backoff, Retry-After, per-host rate limit and circuit
+    breaker, timeouts and the deadline. At most limit requests are in flight.
+    '''
+    def __init__(self, limit=LIMIT):
+        self.transport = transport.default()
+        self.semaphore = asyncio.Semaphore(limit)
+        connect, read = self.transport.timeout
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect,
+                                          sock_read=read))
+
+    async def close(self):
+        await self.session.close()
+
+    async def request(self, method, url, retry=True, idempotent=None,
+                      read=None, **kwargs):
+        '''
+        Response of the request, its body read. retry=False sends it once,
+        for bodies that cannot be sent again. idempotent tells whether a
+        failure after sending is safe to retry, by default from the method.
+        read(resp), a coroutine function, consumes the body of a successful
+        aiohttp response instead, the Response body is what it returns.
+        '''
+        if idempotent is None:
+            idempotent = method in transport.IDEMPOTENT_METHODS
+        statuses = (transport.RETRY_STATUS if idempotent
+                    else transport.RETRY_STATUS_UNSAFE)
+        host = urlsplit(url).netloc
+        path = metrics.endpoint(url)
+        bucket, breaker = self.transport.limits(host)
+        attempt = 0
+        while True:
+            wait = self.transport.circuit_wait(host, breaker)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            await asyncio.sleep(bucket.reserve())
+            result = error = retry_after = None
+            try:
+                async with self.semaphore:
+                    start = time.monotonic()
+                    try:
+                        async with self.session.request(method, url,
+                                                        **kwargs) as resp:
+                            if read and resp.status < 300:
+                                body = await read(resp)
+                            else:
+                                body = await resp.read()
+                            result = Response(url, resp.status, resp.reason,
+                                              resp.headers, body)
+                            sent = resp.request_info.headers.get(
+                                'Content-Length')
+                            received = resp.content.total_bytes
+                    except Exception:
+                        metrics.request(host, method, path, 'error',
+                                        time.monotonic() - start)
+                        raise
+                    metrics.request(host, method, path, result.status,
+                                    time.monotonic() - start,
+                                    int(sent or 0), received)
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as e:
+                if not idempotent and not isinstance(
+                        e, aiohttp.ClientConnectorError):
+                    raise
+                error = e
+            else:
+                if result.status not in statuses:
+                    breaker.success()
+                    return result
+                retry_after = transport.parse_retry_after(
+                    result.headers.get('Retry-After'))
+            breaker.failure()
+
+            attempt += 1
+            delay = self.transport.policy.delay(attempt, retry_after)
+            if not retry or not self.transport.should_retry(attempt, delay):
+                if result is not None:
+                    return result
+                raise error
+            log('[WARN] %s failed (%s), retry %d/%d in %.1fs' % (
+                url, error or '%s %s' % (result.status, result.reason),
+                attempt, self.transport.policy.tries - 1, delay))
+            await asyncio.sleep(delay)
+
+
+class RESTBugzilla(object):
+    '''
+    Async counterpart of bugzilla.rest.RESTBugzilla, logged in with its token
+    '''
+    def __init__(self, http, bz_server, token):
+        self.http = http
+        self.bz_server = bz_server
+        self.token = token
+
+    async def _get(self, path, params=()):
+        params = list(params)
+        if self.token:
+            params.append(('token', self.token))
+        resp = await self.http.request('GET', self.bz_server + path,
+                                       params=params)
+        resp.raise_for_status()
+        # attachment data makes for big bodies
+        return await asyncio.get_running_loop().run_in_executor(
+            None, resp.json)
+
+    async def issues(self, bz_ids):
+        '''
+        model.Issue of the bugs found, three requests for all of them. The
+        comments and attachments are asked for those found, the calls for
+        them fail on any missing id.
+        '''
+        bugs = await self._get('/rest/bug', [
+            ('id', ','.join(str(bz_id) for bz_id in bz_ids))])
+        # NOTE: ids not found are left out, same as the blocking client
+        found = [str(bug['id']) for bug in bugs['bugs']]
+        if not found:
+            return []
+        more = [('ids', bz_id) for bz_id in found[1:]]
+        comments, attachments = await asyncio.gather(
+            self._get('/rest/bug/%s/comment' % found[0], more),
+            self._get('/rest/bug/%s/attachment' % found[0],
+                      more + [('exclude_fields', 'data')]))
+        issues = []
+        for bug in bugs['bugs']:
+            bz_id = str(bug['id'])
+            bug['comments'] = comments['bugs'][bz_id]['comments']
+            bug['attachments'] = attachments['bugs'][bz_id]
+            issues.append(rest._to_issue(bug, self))
+        return issues
+
+    async def attachment_chunks(self, attach_id):
+        data = await self._get('/rest/bug/attachment/%s' % attach_id,
+                               [('include_fields', 'data')])
+        return spool.base64_chunks(
+            data['attachments'][str(attach_id)]['data'])
+
+    async def open_attachment(self, attach_id):
+        return spool.from_chunks(await self.attachment_chunks(attach_id))
+
+
+class CGIBugzilla(object):
+    '''
+    Async counterpart of bugzilla.cgi.CGIBugzilla, logged in with its cookies
+    '''
+    def __init__(self, http, bz_server, cookies):
+        self.http = http
+        self.bz_server = bz_server
+        self.cookies = cookies
+
+    async def _get(self, path, params, read=None):
+        resp = await self.http.request('GET', self.bz_server + path,
+                                       params=params, cookies=self.cookies,
+                                       read=read)
+        resp.raise_for_status()
+        return resp.body
+
+    async def issues(self, bz_ids):
+        '''
+        model.Issue of the bugs found, parsed off the loop as the XML comes
+        '''
+        params = [('ctype', 'xml'), ('excludefield', 'attachmentdata')]
+        params += [('id', str(bz_id)) for bz_id in bz_ids]
+        return await self._get('/show_bug.cgi', params, read=self._parse)
+
+    async def _parse(self, resp):
+        loop = asyncio.get_running_loop()
+        parser = cgi.BugParser(self)
+        bugs = []
+        async for data in resp.content.iter_chunked(spool.CHUNK_BYTES):
+            bugs += await loop.run_in_executor(None, parser.feed, data)
+        bugs += await loop.run_in_executor(None, parser.close)
+        return bugs
+
+    async def attachment_chunks(self, attach_id):
+        return [await self._get('/attachment.cgi', [('id', str(attach_id))])]
+
+    async def open_attachment(self, attach_id):
+        return spool.from_chunks(await self.attachment_chunks(attach_id))
+
+
+class Jira(object):
+    '''
+    The Jira REST calls the Bugzilla sync makes. Issues come back as
+    attribute objects shaped like jira.Issue, with the MIRROR_FIELDS.
+    '''
+    def __init__(self, http, server, auth):
+        self.http = http
+        self.server = server.rstrip('/')
+        self.auth = aiohttp.BasicAuth(*auth) if auth else None
+        self._transitions = {}
+
+    async def _call(self, method, path, **kwargs):
+        resp = await self.http.request(
+            method, '%s/rest/api/2/%s' % (self.server, path),
+            auth=self.auth, **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    async def search(self, jql, page_size=100):
+        issues = []
+        while True:
+            page = (await self._call('POST', 'search', idempotent=True, json={
+                'jql': jql, 'startAt': len(issues), 'maxResults': page_size,
+                'fields': MIRROR_FIELDS, 'validateQuery': False,
+            })).objects()
+            issues.extend(page.issues)
+            if not page.issues or len(issues) >= page.total:
+                return issues
+
+    async def issue(self, key):
+        return (await self._call('GET', 'issue/%s' % key, params={
+            'fields': ','.join(MIRROR_FIELDS)})).objects()
+
+    async def create_issue(self, project_key, fields):
+        fields = dict(fields, project={'key': project_key})
+        created = (await self._call('POST', 'issue',
+                                    json={'fields': fields})).json()
+        return await self.issue(created['key'])
+
+    async def add_comment(self, key, body):
+        await self._call('POST', 'issue/%s/comment' % key,
+                         json={'body': body})
+
+    async def add_attachment(self, key, f, filename):
+        form = aiohttp.FormData()
+        form.add_field('file', f, filename=filename)
+        # a form with a file is consumed by sending it
+        await self._call('POST', 'issue/%s/attachments' % key, data=form,
+                         headers={'X-Atlassian-Token': 'no-check'},
+                         retry=False)
+
+    async def _transition_id(self, key, name):
+        found = (await self._call('GET', 'issue/%s/transitions' % key)).json()
+        return next((t['id'] for t in found['transitions']
+                     if t['name'].lower() == name.lower()), None)
+
+    async def transition(self, issue, name, comment=None, **fields):
+        '''
+        Like JiraMeta.transition(), the id looked up once per workflow step
+        '''
+        step = (issue.key.rsplit('-', 1)[0], issue.fields.issuetype.name,
+                issue.fields.status.name, name.lower())
+        if step not in self._transitions:
+            # the issues of a chunk share the lookup made by the first one
+            self._transitions[step] = asyncio.ensure_future(
+                self._transition_id(issue.key, name))
+        try:
+            transition_id = await self._transitions[step]
+        except Exception:
+            self._transitions.pop(step, None)
+            raise
+        if transition_id is None:
+            raise ValueError('no transition %r for %s' % (name, issue.key))
+        data = {'transition': {'id': transition_id}, 'fields': fields}
+        if comment:
+            data['update'] = {'comment': [{'add': {'body': comment}}]}
+        await self._call('POST', 'issue/%s/transitions' % issue.key,
+                         json=data)
+
+
+async def bz_mirrors(jira, project_key, state, bz_server, bz_ids,
+                     chunk_size=50):
+    '''
+    Async counterpart of __main__.bz_mirrors(), {bz_id: issue}
+    '''
+    by_key = {}
+    for bz_id in bz_ids:
+        key, _ = state.issue(bz_server, bz_id)
+        if key:
+            by_key[key] = bz_id
+    queries = [key_jql(chunk) for chunk in _chunked(by_key, chunk_size)]
+    found = {}
+    for issues in await asyncio.gather(*map(jira.search, queries)):
+        for issue in issues:
+            if issue.key in by_key:
+                found[by_key[issue.key]] = issue
+
+    missing = [bz_id for bz_id in bz_ids if bz_id not in found]
+    chunks = list(_chunked(missing, chunk_size))
+    results = await asyncio.gather(*[
+        jira.search(field_jql(project_key, 'BugZilla ID', chunk))
+        for chunk in chunks])
+    for chunk, issues in zip(chunks, results):
+        for issue in issues:
+            bz_id = issue.fields.customfield_10216
+            if bz_id in chunk and bz_id not in found:
+                found[bz_id] = issue
+    return found
+
+
+async def sync_bz_issue(bz, jira, project_key, bug, state, mirror, cache=None):
+    '''
+    What __main__.sync_bz_to_jira() does with -y, for a bug fetched with the
+    other bugs of its chunk and its Jira issue (or None) looked up with
+    theirs. Attachments are uploaded concurrently, comments in order.
+    '''
+    bz_server = bz.bz_server
+    bz_id = bug.id
+    print('Bugzilla id %s found: %s' % (bz_id, bug.summary))
+
+    key, last_change = state.issue(bz_server, bz_id)
+    if key and last_change == bug.last_change:
+        print('Skip due to no change since last sync.')
+        return
+    issue = mirror
+    if issue:
+        print('Corresponding Jira issue found: %s' % issue.key)
+        if issue.fields.status.name == 'Closed':
+            print('Skip due to issue closed.')
+            return
+    else:
+        with metrics.phase('create'):
+            issue = await jira.create_issue(project_key,
+                                            bzsync.issue_fields(bug))
+        print('New Jira issue created: %s' % issue.key)
+    state.set_issue(bz_server, bz_id, issue.key)
+    index = MirrorIndex(issue, state.items(bz_server, bz_id))
+
+    async def upload(a, filename):
+        with metrics.phase('download'):
+            f = cache and cache.get(bz_server, a.id)
+            if not f:
+                chunks = a.chunks()
+                if asyncio.iscoroutine(chunks):
+                    chunks = await chunks
+                # decoding and writing the content blocks, off the loop
+                if cache:
+                    store = partial(cache.put, bz_server, a.id, chunks)
+                else:
+                    store = partial(spool.from_chunks, chunks)
+                f = await asyncio.get_running_loop().run_in_executor(
+                    None, store)
+        with f, metrics.phase('attach'):
+            await jira.add_attachment(issue.key, f, filename)
+        index.add_file(filename)
+        print('File %s (%d bytes)attached' % (filename, a.size))
+        state.add_item(bz_server, bz_id, 'attachment', a.id)
+
+    async def post(body, kind, item_id, message):
+        with metrics.phase('comment'):
+            await jira.add_comment(issue.key, body)
+        index.add_comment(body)
+        print(message)
+        state.add_item(bz_server, bz_id, kind, item_id)
+
+    uploads = []
+    for a in bug.attachments:
+        filename = bzsync.attachment_filename(a)
+        if not filename:
+            continue
+        if index.has('attachment', a.id) or index.has_file(filename):
+            continue
+        if a.size < bzsync.MAX_OLD_JIRA_ATTACHMENT_BYTES:
+            uploads.append(asyncio.ensure_future(upload(a, filename)))
+        else:
+            comment = bzsync.big_attachment_comment(bz_server, a)
+            await post(comment, 'attachment', a.id,
+                       'Comment for file over 10MB:' + comment)
+    try:
+        for c in bug.comments:
+            if index.has('comment', c.id):
+                continue
+            await post(bzsync.comment_body(bz_server, bz_id, c), 'comment',
+                       c.id, 'Comment %s created' % c.id)
+    finally:
+        # the first failed upload is raised, after all of them are done
+        results = await asyncio.gather(*uploads, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    if bzsync.should_resolve(bug, issue.fields.status.name):
+        with metrics.phase('transition'):
+            await jira.transition(issue, 'Resolve Issue',
+                                  **bzsync.resolve_fields(bug))
+    state.set_issue(bz_server, bz_id, issue.key, bug.last_change)
+
+
+async def _sync_buffered(bz, jira, project_key, bug, state, mirror, cache,
+                         summary):
+    buf = StringIO()
+    _output.set(buf)
+    try:
+        with metrics.phase('sync'):
+            await sync_bz_issue(bz, jira, project_key, bug, state, mirror,
+                                cache)
+    except Exception as e:
+        print('[ERROR] sync %s failed' % bug.id)
+        traceback.print_exc(file=sys.stdout)
+        summary.add_failed(str(bug.id), e)
+    else:
+        summary.add_done()
+    finally:
+        _output.set(None)
+        sys.stdout.stream.write(buf.getvalue())
+        sys.stdout.stream.flush()
+
+
+async def _chunk_or_each(fetch, ids, what):
+    '''
+    Async counterpart of batch.chunk_or_each(): ([await fetch(ids)], {}),
+    or if that fails the results of fetch([id]) for every id, with
+    {id: error} of those failing again. what names the step for the log,
+    e.g. 'fetching %d issues'.
+    '''
+    try:
+        return [await fetch(ids)], {}
+    except Exception as e:
+        print('[WARN] %s at once failed (%r), trying them one by one' %
+              (what % len(ids), e))
+    results = await asyncio.gather(*[fetch([item_id]) for item_id in ids],
+                                   return_exceptions=True)
+    failed = dict((str(item_id), result)
+                  for item_id, result in zip(ids, results)
+                  if isinstance(result, Exception))
+    return [result for result in results
+            if not isinstance(result, Exception)], failed
+
+
+def _add_failed(summary, what, failed):
+    for item_id, e in sorted(failed.items()):
+        print('[ERROR] %s %s failed: %r' % (what, item_id, e))
+        summary.add_failed(item_id, e)
+
+
+def _bugzilla(http, bz):
+    # reuse the login of the blocking client
+    handler = bz._handler
+    if hasattr(handler, 'token'):
+        return RESTBugzilla(http, bz.bz_server, handler.token)
+    cookies = dict(handler._cookie_jar or {})
+    return CGIBugzilla(http, bz.bz_server, cookies)
+
+
+async def _sync_bz(bz, bz_ids, jira_server, jira_auth, project_key, state,
+                   limit, deadline, cache, chunk_size):
+    http = HTTP(limit)
+    summary = Summary()
+    try:
+        abz = _bugzilla(http, bz)
+        jira = Jira(http, jira_server, jira_auth)
+        # one chunk is synced while the next is fetched
+        pending = None
+        for chunk in _chunked(bz_ids, chunk_size):
+            if deadline is not None and time.monotonic() >= deadline:
+                summary.stopped = True
+                for bz_id in chunk:
+                    summary.add_skipped(str(bz_id))
+                break
+            with metrics.phase('fetch'):
+                found, failed = await _chunk_or_each(abz.issues, chunk,
+                                                     'fetching %d issues')
+            _add_failed(summary, 'fetch', failed)
+            bugs = [bug for issues in found for bug in issues]
+            # unchanged bugs are skipped before their mirror is looked at
+            changed = [str(bug.id) for bug in bugs if not state.unchanged(
+                bz.bz_server, bug.id, bug.last_change)]
+            with metrics.phase('lookup'):
+                found, failed = await _chunk_or_each(
+                    partial(bz_mirrors, jira, project_key, state,
+                            bz.bz_server), changed,
+                    'looking up the mirrors of %d issues')
+            # without its mirror looked up a bug would be created again
+            _add_failed(summary, 'mirror lookup of', failed)
+            bugs = [bug for bug in bugs if str(bug.id) not in failed]
+            mirrors = {}
+            for found_mirrors in found:
+                mirrors.update(found_mirrors)
+            if pending:
+                await pending
+            pending = asyncio.gather(*[
+                _sync_buffered(abz, jira, project_key, bug, state,
+                               mirrors.get(str(bug.id)), cache, summary)
+                for bug in bugs])
+        if pending:
+            await pending
+    finally:
+        await http.close()
+    return summary
+
+
+def sync_bz(bz, bz_ids, jira_server, jira_auth, project_key, state,
+            limit=LIMIT, deadline=None, cache=None, chunk_size=100):
+    '''
+    Sync the Bugzilla bugs bz_ids to Jira on an asyncio loop, keeping up to
+    limit requests in flight. bz is the logged in bugzilla.Bugzilla and
+    jira_auth is (user, password) or None, cache an AttachmentCache or None.
+    Returns a batch.Summary.
+    '''
+    out = _TaskOutput(sys.stdout)
+    sys.stdout = out
+    try:
+        return asyncio.run(_sync_bz(bz, bz_ids, jira_server, jira_auth,
+                                    project_key, state, limit, deadline,
+                                    cache, chunk_size))
+    finally:
+        sys.stdout = out.stream
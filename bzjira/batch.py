@@ -0,0 +1,295 @@
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from io import StringIO
+
+from . import metrics
+
+
+class _ThreadOutput(object):
+    '''
+    Replacement of sys.stdout while workers are running. Everything a worker
+    prints goes to its own buffer and is written out in one piece when the
+    issue is done, so logs of different issues never interleave.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, key):
+        return getattr(self.stream, key)
+
+    def write(self, s):
+        buf = getattr(self._local, 'buf', None)
+        if buf is not None:
+            return buf.write(s)
+        with self._lock:
+            return self.stream.write(s)
+
+    def flush(self):
+        if getattr(self._local, 'buf', None) is None:
+            self.stream.flush()
+
+    def begin(self):
+        self._local.buf = StringIO()
+
+    def end(self):
+        buf, self._local.buf = self._local.buf, None
+        with self._lock:
+            self.stream.write(buf.getvalue())
+            self.stream.flush()
+
+
+def log(line):
+    '''
+    print(line) in one write: while run_batch() runs, it goes to the output
+    of the issue being synced on this thread, else it never lands in the
+    middle of an issue's output written out meanwhile
+    '''
+    sys.stdout.write(line + '\n')
+
+
+def bind_output(func):
+    '''
+    Wrap func so that when it runs on another thread its output goes where
+    the output of the calling thread goes, i.e. into the buffer of the issue
+    being synced by run_batch()
+    '''
+    out = sys.stdout
+    if not isinstance(out, _ThreadOutput):
+        return func
+    buf = getattr(out._local, 'buf', None)
+
+    def wrapper(*args, **kwargs):
+        out._local.buf = buf
+        try:
+            return func(*args, **kwargs)
+        finally:
+            out._local.buf = None
+    return wrapper
+
+
+class Failed(object):
+    '''
+    Yielded by an item source in place of what it could not fetch, counted
+    as failed by run_batch() without calling sync
+    '''
+    def __init__(self, name, error):
+        self.name = name
+        self.error = error
+
+
+def chunk_or_each(fetch_chunk, fetch_one, ids, id_of=lambda item: item.id):
+    '''
+    Yield what fetch_chunk(ids) yields. If it fails, the ids it has not
+    yielded yet are fetched one by one with fetch_one(id) (None for a missing
+    one), and an id failing again is yielded as Failed.
+    '''
+    done = set()
+    try:
+        for item in fetch_chunk(ids):
+            done.add(str(id_of(item)))
+            yield item
+    except Exception as e:
+        print('[WARN] fetching %d issues at once failed (%r), fetching them '
+              'one by one' % (len(ids), e))
+        for item_id in ids:
+            if str(item_id) in done:
+                continue
+            try:
+                item = fetch_one(item_id)
+            except Exception as e:
+                yield Failed(str(item_id), e)
+            else:
+                if item is not None:
+                    yield item
+
+
+class Ids(object):
+    '''
+    Iterator over the issue ids of a run where listing them is cheap, e.g.
+    the result of a Jira search. Given to run_batch(), it lets the ids never
+    synced be listed when the deadline passes, the ones already pulled into
+    a chunk of the item source included.
+    '''
+    def __init__(self, ids):
+        self._ids = iter(ids)
+        self.pulled = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item_id = next(self._ids)
+        self.pulled.append(str(item_id))
+        return item_id
+
+    def rest(self):
+        '''
+        Every id, pulling the ones not pulled yet
+        '''
+        return self.pulled + [str(item_id) for item_id in self._ids]
+
+
+class Summary(object):
+    def __init__(self):
+        self.done = 0
+        self.failed = []
+        self.skipped = []
+        # True when the deadline stopped the run before the end of the items
+        self.stopped = False
+        # True when the skipped issues are all of those not synced
+        self.listed = False
+        self._lock = threading.Lock()
+
+    def add_done(self):
+        with self._lock:
+            self.done += 1
+
+    def add_failed(self, name, e):
+        with self._lock:
+            self.failed.append((name, e))
+
+    def add_skipped(self, name):
+        with self._lock:
+            self.skipped.append(name)
+
+    def report(self):
+        print('Synced %d issues, %d failed' % (self.done, len(self.failed)))
+        for name, e in self.failed:
+            print('  %s: %r' % (name, e))
+        if self.stopped:
+            print('Deadline passed, %d issues skipped%s' % (
+                len(self.skipped),
+                '' if self.listed else ' and the rest not looked at'))
+            for name in self.skipped:
+                print('  %s' % name)
+
+
+def _sync_one(sync, item, label, summary):
+    if isinstance(item, Failed):
+        print('[ERROR] fetch %s failed: %r' % (item.name, item.error))
+        summary.add_failed(item.name, item.error)
+        return
+    try:
+        with metrics.phase('sync'):
+            sync(item)
+    except Exception as e:
+        print('[ERROR] sync %s failed' % label(item))
+        traceback.print_exc(file=sys.stdout)
+        summary.add_failed(label(item), e)
+    else:
+        summary.add_done()
+
+
+def _sync_one_buffered(out, sync, item, label, summary):
+    out.begin()
+    try:
+        _sync_one(sync, item, label, summary)
+    finally:
+        out.end()
+
+
+def _pulled(items, summary):
+    '''
+    Iterate items. An error of the iterator itself, e.g. the search listing
+    the ids, ends the iteration and is counted as failed instead of escaping
+    run_batch() without a summary.
+    '''
+    items = iter(items)
+    while True:
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        except Exception as e:
+            print('[ERROR] listing the issues failed, the rest are not synced')
+            traceback.print_exc(file=sys.stdout)
+            summary.add_failed('(rest of the issues)', e)
+            return
+        yield item
+
+
+def _label(item, label):
+    return item.name if isinstance(item, Failed) else label(item)
+
+
+def _expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _skip_rest(summary, ids, seen):
+    '''
+    Add the ids run_batch() did not pull an item of as skipped
+    '''
+    try:
+        rest = ids.rest()
+    except Exception as e:
+        print('[WARN] listing the issues not synced failed: %r' % e)
+        return
+    for item_id in rest:
+        if item_id not in seen:
+            seen.add(item_id)
+            summary.add_skipped(item_id)
+    summary.listed = True
+
+
+def run_batch(sync, items, workers=1, label=str, deadline=None, ids=None):
+    '''
+    Call sync(item) for every item, on a pool of `workers` threads when more
+    than one. A failing item is reported and counted but does not stop the
+    others. Items are pulled lazily so a long query result is never fully
+    queued up front. A Failed item, or an error pulling the next item, is
+    counted as failed too.
+
+    deadline is a time.monotonic() value. Once it passes no more items are
+    started; the ones already pulled are reported as skipped, the others are
+    not fetched at all. When ids, the Ids the items are made from, is given,
+    the ids of the others are listed as skipped too, which needs the label
+    of an item to be its id.
+    '''
+    summary = Summary()
+    items = _pulled(items, summary)
+    seen = set()
+    if workers <= 1:
+        for item in items:
+            seen.add(_label(item, label))
+            if _expired(deadline):
+                summary.stopped = True
+                summary.add_skipped(_label(item, label))
+                break
+            _sync_one(sync, item, label, summary)
+        if summary.stopped and ids is not None:
+            _skip_rest(summary, ids, seen)
+        return summary
+
+    out = _ThreadOutput(sys.stdout)
+    sys.stdout = out
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for item in items:
+                seen.add(_label(item, label))
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del pending[future]
+                if _expired(deadline):
+                    summary.stopped = True
+                    summary.add_skipped(_label(item, label))
+                    break
+                future = pool.submit(_sync_one_buffered, out, sync, item,
+                                     label, summary)
+                pending[future] = item
+            if summary.stopped:
+                for future, item in pending.items():
+                    if future.cancel():
+                        summary.add_skipped(_label(item, label))
+        if summary.stopped and ids is not None:
+            _skip_rest(summary, ids, seen)
+    finally:
+        sys.stdout = out.stream
+    return summary
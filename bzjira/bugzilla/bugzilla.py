@@ -1,32 +1,97 @@
+import hashlib
+import json
+import os
+import time
+
 import requests
 
+from .. import transport
+from ..cache import cache_dir
 from .cgi import CGIBugzilla
 from .rest import RESTBugzilla
 
+PROBE_CACHE_DAYS = 7
+
 
 class Bugzilla(object):
-    def __init__(self, bz_server):
+    '''
+    Bugzilla server, talking REST when the server has it and CGI otherwise.
+    What the server supports is probed once and kept on disk for
+    probe_days, reprobe=True asks again.
+    '''
+    def __init__(self, bz_server, probe_days=PROBE_CACHE_DAYS, reprobe=False):
         self.bz_server = bz_server
+        self.probe_days = probe_days
+        self.reprobe = reprobe
+        self.version = None
+        self.extensions = []
         self._handler = None
 
     def __getattr__(self, key):
         return getattr(self._handler, key)
 
-    def _is_support_rest(self):
+    def _probe_path(self):
+        name = hashlib.sha1(self.bz_server.rstrip('/').encode('utf-8'))
+        return os.path.join(cache_dir('bugzilla'), name.hexdigest() + '.json')
+
+    def _load_probe(self):
         try:
-            resp = requests.get('%s/rest/version' % self.bz_server)
-            resp.raise_for_status()
-            print('Bugzilla %s' % resp.json())
-            return True
-        except Exception:
-            print('Legacy bugzilla')
-            return False
+            with open(self._probe_path()) as f:
+                probe = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if (probe.get('server') != self.bz_server or
+                time.time() - probe['probed'] > self.probe_days * 86400):
+            return None
+        return probe
+
+    def _save_probe(self, probe):
+        path = self._probe_path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(probe, f)
+        os.replace(path + '.tmp', path)
+
+    def _probe(self, session):
+        '''
+        {'rest': bool, 'version': str, 'extensions': [name, ...]}
+
+        Only a clear answer counts: REST when /rest/version gives a version,
+        legacy when it is a client error or not JSON. Network errors and
+        server errors are raised instead of falling back to CGI.
+        '''
+        resp = session.get('%s/rest/version' % self.bz_server)
+        if 400 <= resp.status_code < 500 and resp.status_code != 429:
+            return {'rest': False, 'version': None, 'extensions': []}
+        resp.raise_for_status()
+        try:
+            version = resp.json()['version']
+        except (ValueError, KeyError, TypeError):
+            return {'rest': False, 'version': None, 'extensions': []}
+
+        resp = session.get('%s/rest/extensions' % self.bz_server)
+        extensions = []
+        if resp.ok:
+            extensions = sorted(resp.json().get('extensions', {}))
+        return {'rest': True, 'version': version, 'extensions': extensions}
 
     def _get_handler(self):
-        if self._is_support_rest():
-            return RESTBugzilla(self.bz_server)
+        session = transport.install(requests.Session())
+        probe = None if self.reprobe else self._load_probe()
+        cached = probe is not None
+        if not cached:
+            probe = self._probe(session)
+            probe.update(server=self.bz_server, probed=time.time())
+            self._save_probe(probe)
+        self.version = probe['version']
+        self.extensions = probe['extensions']
+
+        note = ' (cached)' if cached else ''
+        if probe['rest']:
+            print('Bugzilla %s%s' % (self.version, note))
+            return RESTBugzilla(self.bz_server, session)
         else:
-            return CGIBugzilla(self.bz_server)
+            print('Legacy bugzilla%s' % note)
+            return CGIBugzilla(self.bz_server, session)
 
     def login(self, username, passwd):
         if not self._handler:
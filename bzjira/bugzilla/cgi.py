@@ -1,25 +1,18 @@
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
 import requests
 import xmltodict
-import base64
+
+from .. import model, spool, transport
+from ..batch import chunk_or_each
 
 
 class CGIBugzilla(object):
-    def __init__(self, bz_server):
+    def __init__(self, bz_server, session=None):
         self.bz_server = bz_server
         self._cookie_jar = None
-        self.session = requests.Session()
-        a = requests.adapters.HTTPAdapter(max_retries=15)
-        self.session.mount(bz_server, a)
-
-    def _get(self, *args, **kwargs):
-        retry_num = 10
-        while retry_num > 0:
-            retry_num -= 1
-            try:
-                return self.session.get(*args, **kwargs)
-            except (requests.exceptions.ChunkedEncodingError):
-                if retry_num <= 0:
-                    raise
+        self.session = session or transport.install(requests.Session())
 
     def login(self, username, passwd):
         resp = self.session.post(
@@ -32,105 +25,169 @@ class CGIBugzilla(object):
         self._cookie_jar = resp.cookies
 
     def issue(self, bz_id):
-        resp = self._get(
-            '%s/show_bug.cgi?ctype=xml&id=%s' % (self.bz_server, bz_id),
-            cookies=self._cookie_jar)
+        for bug in self.issues([bz_id]):
+            return bug
+        return None
+
+    def _issues(self, bz_ids):
+        params = [('ctype', 'xml'), ('excludefield', 'attachmentdata')]
+        params += [('id', bz_id) for bz_id in bz_ids]
+        resp = self.session.get('%s/show_bug.cgi' % self.bz_server,
+                                params=params, cookies=self._cookie_jar,
+                                stream=True)
         resp.raise_for_status()
-        content = xmltodict.parse(resp.content)
-        if content['bugzilla']['bug'].get('@error') == 'NotFound':
-            # NOTE: Due to we have two bugzilla and for compatible reason they
-            # the new bugzilla's start from 200000. so id not found may happen.
-            # just ignore them until we have a better solution
-            return None
-        return DQVBZIssue(content)
-
-    def buglist(self, query_string):
-        resp = self._get(
+        resp.raw.decode_content = True
+        return parse_bugs(resp.raw, self)
+
+    def _issue(self, bz_id):
+        return next(self._issues([str(bz_id)]), None)
+
+    def issues(self, bz_ids, chunk_size=100):
+        '''
+        Fetch many bugs with one show_bug.cgi request per chunk_size bugs.
+        The XML is parsed while it is downloaded and each bug is yielded as
+        soon as its element is complete. Attachment data is excluded, see
+        model.Attachment.open(). If a chunk fails, the bugs of it not
+        yielded yet are fetched one by one.
+        '''
+        chunk = []
+        for bz_id in bz_ids:
+            chunk.append(str(bz_id))
+            if len(chunk) >= chunk_size:
+                yield from chunk_or_each(self._issues, self._issue, chunk)
+                chunk = []
+        if chunk:
+            yield from chunk_or_each(self._issues, self._issue, chunk)
+
+    def attachment_chunks(self, attach_id):
+        resp = self.session.get('%s/attachment.cgi' % self.bz_server,
+                                params={'id': attach_id},
+                                cookies=self._cookie_jar, stream=True)
+        resp.raise_for_status()
+        return _content(resp)
+
+    def open_attachment(self, attach_id):
+        return spool.from_chunks(self.attachment_chunks(attach_id))
+
+    def buglist(self, query_string, since=None):
+        if since:
+            # relative time so the server timezone does not matter, rounded
+            # up to whole hours
+            age = datetime.now(timezone.utc) - since
+            query_string += '&chfieldfrom=-%dh&chfieldto=Now' % (
+                age.total_seconds() // 3600 + 1)
+        resp = self.session.get(
             '%s/buglist.cgi?ctype=rss&%s' % (self.bz_server, query_string),
             cookies=self._cookie_jar)
         resp.raise_for_status()
-        for entry in xmltodict.parse(resp.content)['feed']['entry']:
+        entries = xmltodict.parse(resp.content)['feed'].get('entry') or []
+        if not isinstance(entries, list):
+            entries = [entries]
+        for entry in entries:
             yield entry['id'].split('=')[-1]
 
 
-class BZIssue(object):
-    def __init__(self, xmldict):
-        self._raw = xmldict['bugzilla']['bug']
-
-    @property
-    def bug_id(self):
-        return self._raw['bug_id']
-
-    @property
-    def priority(self):
-        return self._raw['priority']
-
-    @property
-    def short_desc(self):
-        return self._raw['short_desc']
-
-    @property
-    def status(self):
-        return self._raw['bug_status']
-
-    @property
-    def resolution(self):
-        return self._raw['resolution']
-
-    @property
-    def long_desc(self):
-        a = self._raw['long_desc']
-        if isinstance(a, list):
-            return [LongDesc(d) for d in a]
-        else:
-            return [LongDesc(a)]
-
-    @property
-    def attachment(self):
-        a = self._raw.get('attachment')
-        if not a:
-            return []
-        elif isinstance(a, list):
-            return [Attachment(d) for d in a]
+def _content(resp):
+    '''
+    Body of the streamed resp as it downloads, closed at the end
+    '''
+    with resp:
+        yield from resp.iter_content(spool.CHUNK_BYTES)
+
+
+class BugParser(object):
+    '''
+    show_bug.cgi XML parsed a piece at a time: feed() and close() return the
+    bugs completed by what they got, as model.Issue
+    '''
+    def __init__(self, bz):
+        self.bz = bz
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self._root = None
+
+    def feed(self, data):
+        self._parser.feed(data)
+        return list(self._bugs())
+
+    def close(self):
+        self._parser.close()
+        return list(self._bugs())
+
+    def _bugs(self):
+        for event, elem in self._parser.read_events():
+            if self._root is None:
+                self._root = elem
+            if event != 'end' or elem.tag != 'bug':
+                continue
+            bug = _to_dict(elem)
+            # drop the finished <bug> so memory does not grow with the chunk
+            self._root.clear()
+            if bug.get('@error'):
+                # NOTE: Due to we have two bugzilla and for compatible reason
+                # they the new bugzilla's start from 200000. so id not found
+                # may happen. just ignore them until we have a better solution
+                continue
+            yield _to_issue(bug, self.bz)
+
+
+def parse_bugs(stream, bz):
+    '''
+    Yield the bugs of a show_bug.cgi XML stream as model.Issue, each as soon
+    as its element is complete
+    '''
+    parser = BugParser(bz)
+    for data in iter(lambda: stream.read(spool.CHUNK_BYTES), b''):
+        yield from parser.feed(data)
+    yield from parser.close()
+
+
+def _to_dict(elem):
+    '''
+    Convert an element to the same structure xmltodict.parse() gives
+    '''
+    d = dict(('@' + k, v) for k, v in elem.attrib.items())
+    for child in elem:
+        value = _to_dict(child)
+        if child.tag not in d:
+            d[child.tag] = value
+        elif isinstance(d[child.tag], list):
+            d[child.tag].append(value)
         else:
-            return [Attachment(a)]
-
-
-class DQVBZIssue(BZIssue):
-    @property
-    def short_desc(self):
-        return "[DQV#%s] %s" % (self.bug_id, self._raw['short_desc'])
-
-
-class LongDesc(object):
-    def __init__(self, raw):
-        self._raw = raw
-
-    @property
-    def who(self):
-        return self._raw['who']['@name']
-
-    @property
-    def bug_when(self):
-        return self._raw['bug_when']
-
-    @property
-    def thetext(self):
-        return self._raw['thetext']
-
-
-class Attachment(object):
-    def __init__(self, raw):
-        self._raw = raw
-
-    @property
-    def attachid(self):
-        return self._raw['attachid']
-
-    @property
-    def filename(self):
-        return self._raw['filename']
-
-    @property
-    def content(self):
-        return base64.b64decode(self._raw['data']['#text'])
+            d[child.tag] = [d[child.tag], value]
+    text = (elem.text or '').strip()
+    if text:
+        if not d:
+            return text
+        d['#text'] = text
+    return d or None
+
+
+def _as_list(value):
+    # xmltodict gives a single child as the element itself
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _to_issue(bug, bz):
+    comments = [model.Comment(i, c['who']['@name'], c['bug_when'],
+                              c['thetext'])
+                for i, c in enumerate(_as_list(bug['long_desc']))]
+    return model.Issue(
+        id=bug['bug_id'],
+        summary="[DQV#%s] %s" % (bug['bug_id'], bug['short_desc']),
+        description=comments[0].text if comments else '',
+        priority=bug['priority'],
+        status=bug['bug_status'],
+        resolution=bug.get('resolution'),
+        last_change=bug['delta_ts'],
+        # the first comment is the description
+        comments=comments[1:],
+        attachments=[model.Attachment(
+            a['attachid'], a['filename'], int(a['size']), bz,
+            # attachment data is excluded from show_bug.cgi, but some
+            # servers send it anyway
+            a['data']['#text'] if 'data' in a else None)
+            for a in _as_list(bug.get('attachment'))])
@@ -1,14 +1,17 @@
+from datetime import timezone
 from urllib.parse import parse_qs
-import base64
 
 import requests
 
+from .. import model, spool, transport
+from ..batch import chunk_or_each
+
 
 class RESTBugzilla(object):
-    def __init__(self, bz_server):
+    def __init__(self, bz_server, session=None):
         self.bz_server = bz_server
         self.token = None
-        self.session = requests.Session()
+        self.session = session or transport.install(requests.Session())
 
     def login(self, username, passwd):
         resp = self.session.get(
@@ -46,7 +49,7 @@ class RESTBugzilla(object):
         resp.raise_for_status()
         return resp.json()
 
-    def _get_comments(self, bz_id):
+    def _get_comments(self, bz_id, more_ids=()):
         '''
         {
             bugs: {
@@ -62,12 +65,13 @@ class RESTBugzilla(object):
             '%s/rest/bug/%s/comment' % (self.bz_server, bz_id),
             params={
                 'token': self.token,
+                'ids': list(more_ids),
             }
         )
         resp.raise_for_status()
         return resp.json()
 
-    def _get_attachments(self, bz_id):
+    def _get_attachments(self, bz_id, more_ids=()):
         '''
         {
            attachments : {},
@@ -84,11 +88,38 @@ class RESTBugzilla(object):
             '%s/rest/bug/%s/attachment' % (self.bz_server, bz_id),
             params={
                 'token': self.token,
+                'ids': list(more_ids),
+                'exclude_fields': 'data',
             }
         )
         resp.raise_for_status()
         return resp.json()
 
+    def attachment_chunks(self, attach_id):
+        '''
+        {
+           attachments : {
+              $attach_id : {
+                 data : ...
+              }
+           },
+           bugs : {}
+        }
+        '''
+        resp = self.session.get(
+            '%s/rest/bug/attachment/%s' % (self.bz_server, attach_id),
+            params={
+                'token': self.token,
+                'include_fields': 'data',
+            }
+        )
+        resp.raise_for_status()
+        data = resp.json()['attachments'][str(attach_id)]['data']
+        return spool.base64_chunks(data)
+
+    def open_attachment(self, attach_id):
+        return spool.from_chunks(self.attachment_chunks(attach_id))
+
     def issue(self, bz_id):
         bz_id = str(bz_id)
         # get bug body
@@ -104,12 +135,68 @@ class RESTBugzilla(object):
         # and merge attachments
         raw = self._get_attachments(bz_id)
         bug['attachments'] = raw['bugs'][bz_id]
-        return DQVBZIssue(bug)
+        return _to_issue(bug, self)
+
+    def _get_bugs(self, bz_ids):
+        '''
+        {
+            bugs: [
+                {
+                    ...
+                },
+                ...
+            ]
+        }
+        '''
+        resp = self.session.get(
+            '%s/rest/bug' % self.bz_server,
+            params={
+                'token': self.token,
+                'id': ','.join(bz_ids),
+            }
+        )
+        resp.raise_for_status()
+        return resp.json()
 
-    def buglist(self, query_string):
+    def _issues(self, bz_ids):
+        bugs = dict((str(bug['id']), bug)
+                    for bug in self._get_bugs(bz_ids)['bugs'])
+        # NOTE: ids not found are left out, same as issue() returns None
+        bz_ids = [bz_id for bz_id in bz_ids if bz_id in bugs]
+        if not bz_ids:
+            return
+
+        comments = self._get_comments(bz_ids[0], bz_ids[1:])['bugs']
+        attachments = self._get_attachments(bz_ids[0], bz_ids[1:])['bugs']
+        for bz_id in bz_ids:
+            # popped so the raw chunk shrinks as the issues are built
+            bug = bugs.pop(bz_id)
+            bug['comments'] = comments.pop(bz_id)['comments']
+            bug['attachments'] = attachments.pop(bz_id)
+            yield _to_issue(bug, self)
+
+    def issues(self, bz_ids, chunk_size=100):
+        '''
+        Like issue() but for many bugs. Every chunk_size bugs are fetched
+        with three requests in total instead of three requests per bug. If
+        that fails, the bugs of the chunk are fetched one by one.
+        '''
+        chunk = []
+        for bz_id in bz_ids:
+            chunk.append(str(bz_id))
+            if len(chunk) >= chunk_size:
+                yield from chunk_or_each(self._issues, self.issue, chunk)
+                chunk = []
+        if chunk:
+            yield from chunk_or_each(self._issues, self.issue, chunk)
+
+    def buglist(self, query_string, since=None):
         params = parse_qs(query_string)
         params['token'] = self.token
         params['include_fields'] = 'id'
+        if since:
+            params['last_change_time'] = since.astimezone(
+                timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
         resp = self.session.get(
             '%s/rest/bug' % (self.bz_server),
             params=params
@@ -119,80 +206,18 @@ class RESTBugzilla(object):
             yield bug['id']
 
 
-class BZIssue(object):
-    def __init__(self, raw):
-        self._raw = raw
-
-    @property
-    def bug_id(self):
-        return self._raw['id']
-
-    @property
-    def priority(self):
-        return self._raw['priority']
-
-    @property
-    def short_desc(self):
-        return self._raw['summary']
-
-    @property
-    def status(self):
-        return self._raw['status']
-
-    @property
-    def resolution(self):
-        return self._raw['resolution']
-
-    @property
-    def long_desc(self):
-        d = list()
-        for comment in self._raw['comments']:
-            d.append(LongDesc(comment))
-        return d
-
-    @property
-    def attachment(self):
-        a = list()
-        for attachment in self._raw['attachments']:
-            a.append(Attachment(attachment))
-        return a
-
-
-class DQVBZIssue(BZIssue):
-    @property
-    def short_desc(self):
-        return u"[DQV#%s] %s" % (self.bug_id, self._raw['summary'])
-
-
-class LongDesc(object):
-    def __init__(self, raw):
-        self._raw = raw
-
-    @property
-    def who(self):
-        return self._raw['creator']
-
-    @property
-    def bug_when(self):
-        return self._raw['time']
-
-    @property
-    def thetext(self):
-        return self._raw['text']
-
-
-class Attachment(object):
-    def __init__(self, raw):
-        self._raw = raw
-
-    @property
-    def attachid(self):
-        return self._raw['id']
-
-    @property
-    def filename(self):
-        return self._raw['file_name']
-
-    @property
-    def content(self):
-        return base64.b64decode(self._raw['data'])
+def _to_issue(bug, bz):
+    comments = [model.Comment(i, c['creator'], c['time'], c['text'])
+                for i, c in enumerate(bug['comments'])]
+    return model.Issue(
+        id=bug['id'],
+        summary=u"[DQV#%s] %s" % (bug['id'], bug['summary']),
+        description=comments[0].text if comments else '',
+        priority=bug['priority'],
+        status=bug['status'],
+        resolution=bug['resolution'],
+        last_change=bug['last_change_time'],
+        # the first comment is the description
+        comments=comments[1:],
+        attachments=[model.Attachment(a['id'], a['file_name'], a['size'], bz)
+                     for a in bug['attachments']])
@@ -0,0 +1,77 @@
+import os
+import urllib.parse
+
+# bigger attachments are linked in a comment instead of uploaded
+MAX_OLD_JIRA_ATTACHMENT_BYTES = 10 * 1024 * 1024
+
+RESOLUTIONS = {
+    'FIXED': 'Fixed',
+    'INVALID': 'Invalid',
+    'WONTFIX': "Won't Fix",
+    'LATER': 'Remind',
+    'DUPLICATE': 'Duplicate',
+    'WORKSFORME': 'Cannot Reproduce',
+    'SpecChanged': 'Spec Changed'
+}
+
+
+def issue_fields(bug):
+    '''
+    Fields of the Jira issue created for a Bugzilla bug, but the project
+    '''
+    return dict(summary=bug.summary,
+                description=bug.description,
+                issuetype={'name': 'Bug'},
+                priority={'name': 'Critical' if bug.priority == 'P1' else 'Major'},
+                customfield_10216=str(bug.id))
+
+
+def attachment_filename(a):
+    '''
+    <name>-<attachment id><ext>, quoted when not ASCII and cut to 255
+    characters. None when the attachment has no name.
+    '''
+    if not a.filename:
+        print('skip attachment %s due to its name %s' % (a.id, a.filename))
+        return None
+
+    root, ext = os.path.splitext(a.filename)
+    filename = '%s-%s%s' % (root, a.id, ext)
+    if filename.encode('utf-8') != filename:
+        filename = urllib.parse.quote(filename.encode('utf-8'))
+
+    if len(filename) >= 255:
+        ext_len = len(ext)
+        filename = filename[:255-ext_len] + ext
+        print('Filename too long, truncate to 255')
+    return filename
+
+
+def big_attachment_comment(bz_server, a):
+    downlaod_url = '%s/attachment.cgi?id=%s' % (bz_server, a.id)
+    return '{}\nbig attachment {}'.format(downlaod_url, a.id)
+
+
+def comment_body(bz_server, bz_id, c):
+    return '''%s/show_bug.cgi?id=%s#c%d
+
+{quote}
+*%s %s*
+
+%s
+{quote}
+            ''' % (bz_server, bz_id, c.id, c.author, c.created, c.text)
+
+
+def resolve_fields(bug):
+    '''
+    Fields of the Resolve Issue transition when the bug is resolved
+    '''
+    return dict(
+        resolution={'name': RESOLUTIONS[bug.resolution]},
+        comment='Change to Resolved due to Bugzilla #%s is %s' % (bug.id, bug.status))
+
+
+def should_resolve(bug, jira_status):
+    return (bug.status in ['RESOLVED', 'VERIFIED'] and
+            jira_status not in ['Resolved', 'Verified', 'Closed'])
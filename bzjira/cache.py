@@ -0,0 +1,130 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# default size cap of the attachment cache
+ATTACHMENT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS attachment (
+    source TEXT NOT NULL,
+    attach_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (source, attach_id)
+);
+CREATE INDEX IF NOT EXISTS attachment_digest ON attachment (digest);
+'''
+
+
+def cache_dir(*parts):
+    '''
+    Directory for data kept between runs, $XDG_CACHE_HOME/bzjira/<parts>
+    (~/.cache/bzjira/<parts> by default). Created if missing.
+    '''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(base, 'bzjira', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class AttachmentCache(object):
+    '''
+    Attachment content kept on disk between runs, so a rerun uploads from
+    here instead of downloading from the source server again.
+
+    Files are stored once per sha256 of their content and indexed by (source
+    server, attachment id) in SQLite. When the files add up to more than
+    max_bytes, the least recently used are removed.
+    '''
+    def __init__(self, path=None, max_bytes=ATTACHMENT_CACHE_BYTES):
+        self.path = path or cache_dir('attachments')
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(os.path.join(self.path, 'index.db'),
+                                   check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def _file(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def get(self, source, attach_id):
+        '''
+        The cached content opened for reading, or None
+        '''
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT digest FROM attachment WHERE source = ? AND '
+                'attach_id = ?', (source, str(attach_id))).fetchone()
+            if not row:
+                return None
+            try:
+                f = open(self._file(row[0]), 'rb')
+            except FileNotFoundError:
+                # removed behind our back, fetched again by the caller
+                self._db.execute(
+                    'DELETE FROM attachment WHERE digest = ?', row)
+                return None
+            self._db.execute(
+                'UPDATE attachment SET used = ? WHERE source = ? AND '
+                'attach_id = ?', (time.time(), source, str(attach_id)))
+            return f
+
+    def put(self, source, attach_id, chunks):
+        '''
+        Store the content, an iterable of bytes written to the cache as it
+        comes, and return the cached copy opened for reading
+        '''
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            path = self._file(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # same content under another id is already there
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO attachment VALUES (?, ?, ?, ?, ?)',
+                (source, str(attach_id), digest, size, time.time()))
+            result = open(path, 'rb')
+            self._evict(keep=digest)
+        return result
+
+    def open(self, source, attach_id, chunks):
+        '''
+        The content of the attachment, from the cache or else stored from
+        chunks(), see put()
+        '''
+        return (self.get(source, attach_id) or
+                self.put(source, attach_id, chunks()))
+
+    def _evict(self, keep):
+        rows = self._db.execute(
+            'SELECT digest, MAX(size), MAX(used) FROM attachment '
+            'GROUP BY digest ORDER BY MAX(used) DESC').fetchall()
+        total = 0
+        for digest, size, _ in rows:
+            if digest == keep or total + size <= self.max_bytes:
+                total += size
+                continue
+            self._db.execute('DELETE FROM attachment WHERE digest = ?',
+                             (digest,))
+            try:
+                os.unlink(self._file(digest))
+            except FileNotFoundError:
+                pass
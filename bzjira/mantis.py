@@ -1,120 +1,243 @@
-import base64
-
+import re
+import threading
+from datetime import timezone
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from suds.cache import NoCache, ObjectCache
+from suds import WebFault
 from suds.client import Client
+from suds.properties import Unskin
+from suds.transport import Reply, Transport, TransportError
 from suds.bindings.binding import Binding
 Binding.replyfilter = (lambda s,r: r.replace(b'\x08', b''))
 
-def issue(mantis_server, username, passwd, mantis_id):
-    client = Client(mantis_server + '/api/soap/mantisconnect.php?wsdl')
-    resp = client.service.mc_issue_get(username, passwd, mantis_id)
-    i = MantisIssue(resp, mantis_server, username, passwd)
-    return i
-
-
-def filter_get_issues(mantis_server, username, passwd, project_id, filter_id,
-                      page_num=1, per_page=10000):
-    client = Client(mantis_server + '/api/soap/mantisconnect.php?wsdl')
-    resp = client.service.mc_filter_get_issues(username, passwd, project_id,
-                                               filter_id, page_num, per_page)
-    for i in resp:
-        yield i.id
-
-
-class MantisIssue(object):
-    def __init__(self, raw, mantis_server, username, passwd):
-        self._raw = raw
+from . import model, spool, transport
+from .cache import cache_dir
+
+WSDL_CACHE_DAYS = 7
+# connections kept per host, enough for --workers and attachment downloads
+POOL_SIZE = 32
+
+
+class _RequestsTransport(Transport):
+    '''
+    suds transport on a pooled requests.Session: connections are kept alive
+    between calls and responses come gzip compressed, which matters for the
+    verbose SOAP XML and the base64 attachments. Requests go through the
+    shared transport policy. SOAP faults are HTTP 500 and are not retried.
+
+    Clones of the suds client share the session.
+    '''
+    def __init__(self, session=None):
+        Transport.__init__(self)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=POOL_SIZE))
+            session.mount('https://', HTTPAdapter(pool_maxsize=POOL_SIZE))
+            session.headers['Accept-Encoding'] = 'gzip'
+            # every Mantis call only reads, so a POST is safe to retry
+            transport.install(session,
+                              transport.IDEMPOTENT_METHODS + ('POST',))
+        self.session = session
+
+    def _reply(self, resp):
+        if resp.status_code >= 400:
+            raise TransportError(resp.reason, resp.status_code,
+                                 BytesIO(resp.content))
+        return resp
+
+    def open(self, request):
+        return BytesIO(self._reply(self.session.get(request.url)).content)
+
+    def send(self, request):
+        resp = self._reply(self.session.post(
+            request.url, data=request.message, headers=request.headers))
+        if resp.status_code in (202, 204):
+            return None
+        return Reply(resp.status_code, resp.headers, resp.content)
+
+    def __deepcopy__(self, memo):
+        return self.__class__(self.session)
+
+
+class Mantis(object):
+    '''
+    Connection to a Mantis server. The WSDL is downloaded and parsed once per
+    run, and the parsed result is kept on disk for cache_days so later runs
+    do not download it at all (0 for no disk cache).
+    '''
+    def __init__(self, mantis_server, username, passwd,
+                 cache_days=WSDL_CACHE_DAYS):
         self.mantis_server = mantis_server
         self.username = username
         self.passwd = passwd
+        self._cache = NoCache()
+        if cache_days:
+            self._cache = ObjectCache(location=cache_dir('suds'),
+                                      days=cache_days)
+        self._client = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
 
     @property
-    def id(self):
-        return self._raw.id
-
-    @property
-    def priority(self):
+    def client(self):
+        # suds client is not thread safe, every thread gets its own clone
+        # sharing the parsed WSDL
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = Client(
+                        self.mantis_server + '/api/soap/mantisconnect.php?wsdl',
+                        cache=self._cache, transport=_RequestsTransport())
+                client = _clone(self._client)
+            self._local.client = client
+        return client
+
+    def issue(self, mantis_id):
+        resp = self.client.service.mc_issue_get(self.username, self.passwd,
+                                                mantis_id)
+        return _to_issue(resp, self)
+
+    def filter_get_issues(self, project_id, filter_id, per_page=100,
+                          since=None):
+        '''
+        Yield model.Issue of every issue matched by the filter, built from the
+        full IssueData in the filter response, one page at a time.
+
+        With since, only issues last updated at since or later are yielded.
+        Paging stops at the first older one when the filter sorts last
+        updated first, as Mantis does by default, and goes to the end for any
+        other sort.
+        '''
+        newest_first = since and self._newest_first(project_id, filter_id)
+        seen = set()
+        page_num = 1
+        while True:
+            resp = self.client.service.mc_filter_get_issues(
+                self.username, self.passwd, project_id, filter_id, page_num,
+                per_page)
+            # NOTE: mantis returns the last page again for a page number
+            # past the end, so stop once a page brings nothing new
+            new = [i for i in resp if i.id not in seen]
+            for i in new:
+                seen.add(i.id)
+                if since and _utc(i.last_updated) < since:
+                    if newest_first:
+                        return
+                    continue
+                yield _to_issue(i, self)
+            if len(resp) < per_page or not new:
+                break
+            page_num += 1
+
+    def _newest_first(self, project_id, filter_id):
+        '''
+        Whether the saved filter sorts by last updated, newest first. False
+        when it cannot be told.
+        '''
+        try:
+            filters = self.client.service.mc_filter_get(
+                self.username, self.passwd, project_id)
+        except WebFault:
+            return False
+        for f in filters or []:
+            if str(f.id) == str(filter_id):
+                return _newest_first(getattr(f, 'filter_string', None) or '')
+        return False
+
+    def changed_issue_ids(self, project_id, since, per_page=100):
+        '''
+        Ids of issues in the project (0 for all projects) last updated at
+        since or later, read from every page of the issue headers. Those come
+        in the order of the user's current filter, which also decides whether
+        closed issues are listed at all.
+        '''
+        seen = set()
+        page_num = 1
+        while True:
+            resp = self.client.service.mc_project_get_issue_headers(
+                self.username, self.passwd, project_id, page_num, per_page)
+            new = [i for i in resp if i.id not in seen]
+            for i in new:
+                seen.add(i.id)
+                if _utc(i.last_updated) < since:
+                    continue
+                yield i.id
+            if len(resp) < per_page or not new:
+                break
+            page_num += 1
+
+    def attachment_chunks(self, attachment_id):
+        resp = self.client.service.mc_issue_attachment_get(self.username,
+                                                           self.passwd,
+                                                           attachment_id)
+        return spool.base64_chunks(resp)
+
+    def open_attachment(self, attachment_id):
+        return spool.from_chunks(self.attachment_chunks(attachment_id))
+
+
+def _clone(client):
+    '''
+    client.clone() with the options unlinked from the transport's meanwhile,
+    deep copying the link never ends on Python 3 (suds.properties.Endpoint).
+    The clone links its own copy of the transport.
+    '''
+    options = Unskin(client.options)
+    linked = Unskin(client.options.transport.options)
+    options.unlink(linked)
+    try:
+        return client.clone()
+    finally:
+        options.link(linked)
+
+
+def _newest_first(filter_string):
+    '''
+    Whether the first sort of a filter_string, PHP serialized (Mantis 1.x)
+    or JSON (2.x) after the version prefix, is last_updated DESC
+    '''
+    values = {}
+    for key in ('sort', 'dir'):
+        m = (re.search(r'"%s";s:\d+:"([^"]*)"' % key, filter_string) or
+             re.search(r'"%s"\s*:\s*"([^"]*)"' % key, filter_string))
+        if not m:
+            return False
+        values[key] = m.group(1).split(',')[0].strip()
+    return (values['sort'] == 'last_updated' and
+            values['dir'].upper() == 'DESC')
+
+
+def _utc(dt):
+    # naive datetime is taken as local time
+    return dt.astimezone(timezone.utc)
+
+
+def _to_issue(raw, mantis):
+    # not every issue has comments(notes)
+    notes = getattr(raw, 'notes', [])
+    return model.Issue(
+        id=raw.id,
+        summary=raw.summary,
+        description='\n'.join([
+            raw.description,
+            getattr(raw, 'additional_information', ''),
+            getattr(raw, 'steps_to_reproduce', '')]),
         # normal, TBD
-        return self._raw.priority.name
-
-    @property
-    def summary(self):
-        return self._raw.summary
-
-    @property
-    def description(self):
-        description = self._raw.description
-
-        additional_information = ''
-        if hasattr(self._raw, 'additional_information'):
-            additional_information = self._raw.additional_information
-
-        steps_to_reproduce = ''
-        if hasattr(self._raw, 'steps_to_reproduce'):
-            steps_to_reproduce = self._raw.steps_to_reproduce
-
-        return '\n'.join([description, additional_information, steps_to_reproduce])
-
-
-
-    @property
-    def status(self):
-        return self._raw.status.name
-
-    @property
-    def notes(self):
-        # not every issue has comments(notes)
-        if not hasattr(self._raw, 'notes'):
-            return []
-        a = self._raw.notes
-        return [Note(d) for d in a]
-
-    @property
-    def attachments(self):
-        a = self._raw.attachments
-        return [Attachment(d, self) for d in a]
-
-
-class Note(object):
-    def __init__(self, raw):
-        self._raw = raw
-
-    @property
-    def id(self):
-        return self._raw.id
-
-    @property
-    def who(self):
-        if hasattr(self._raw.reporter, 'name'):
-            return self._raw.reporter.name
-        else:
-             return 'NoName(%s)' % self._raw.reporter.id
-
-    @property
-    def when(self):
-        return self._raw.last_modified
-
-    @property
-    def text(self):
-        return self._raw.text
-
-
-class Attachment(object):
-    def __init__(self, raw, issue):
-        self._raw = raw
-        self._issue = issue
-
-    @property
-    def id(self):
-        return self._raw.id
-
-    @property
-    def filename(self):
-        return self._raw.filename
-
-    @property
-    def content(self):
-        client = Client(self._issue.mantis_server + '/api/soap/mantisconnect.php?wsdl')
-        resp = client.service.mc_issue_attachment_get(self._issue.username,
-                                                      self._issue.passwd,
-                                                      self.id)
-        return base64.b64decode(resp)
+        priority=raw.priority.name,
+        status=raw.status.name,
+        resolution=getattr(getattr(raw, 'resolution', None), 'name', None),
+        last_change=str(raw.last_updated),
+        comments=[model.Comment(n.id, _reporter_name(n.reporter),
+                                n.last_modified, n.text) for n in notes],
+        attachments=[model.Attachment(a.id, a.filename, a.size, mantis)
+                     for a in getattr(raw, 'attachments', [])])
+
+
+def _reporter_name(reporter):
+    if hasattr(reporter, 'name'):
+        return reporter.name
+    return 'NoName(%s)' % reporter.id
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+
+from . import metrics
+
+
+class JiraMeta(object):
+    '''
+    Jira metadata the sync needs over and over: project ids, active sprints
+    per board, transition ids per (project, issue type, status) and issue
+    link types. Each is asked once and kept for ttl seconds, or for the
+    whole run when ttl is None.
+    '''
+    def __init__(self, jira, ttl=None):
+        self.jira = jira
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, fetch):
+        with self._lock:
+            if key in self._cache:
+                value, fetched = self._cache[key]
+                if self.ttl is None or time.monotonic() - fetched < self.ttl:
+                    return value
+        # fetched outside the lock, two threads may both ask, which is fine
+        value = fetch()
+        with self._lock:
+            self._cache[key] = (value, time.monotonic())
+        return value
+
+    def project_id(self, project_key):
+        return self._get(('project', project_key),
+                         lambda: self.jira.project(project_key).id)
+
+    def active_sprint(self, board_id):
+        '''
+        The active sprint of the board, None if there is none
+        '''
+        def fetch():
+            for sprint in self.jira.sprints(board_id):
+                if sprint.state == 'ACTIVE':
+                    return sprint
+            return None
+        return self._get(('sprint', board_id), fetch)
+
+    def transition(self, issue, name, status=None, **fields):
+        '''
+        jira.transition_issue() with the transition id looked up once per
+        workflow step instead of on every call. status is the status the
+        issue is in, issue.fields.status by default. Returns the status the
+        issue goes to, to chain transitions.
+        '''
+        project = issue.key.rsplit('-', 1)[0]
+        issuetype = issue.fields.issuetype.name
+        status = status or issue.fields.status.name
+
+        def fetch():
+            for t in self.jira.transitions(issue):
+                if t['name'].lower() == name.lower():
+                    return t['id'], t['to']['name']
+            return None
+        found = self._get(('transition', project, issuetype, status,
+                           name.lower()), fetch)
+        # what jira.transition_issue() does for an unknown name
+        transition_id, to_status = found or (name, None)
+        with metrics.phase('transition'):
+            self.jira.transition_issue(issue, transition_id, **fields)
+        return to_status
+
+    def link_types(self):
+        return self._get(('link_types',), self.jira.issue_link_types)
+
+    def create_issue_link(self, type, inwardIssue, outwardIssue):
+        '''
+        jira.create_issue_link() without fetching the link types each time.
+        type may be the name of the link type or its inward or outward
+        description.
+        '''
+        for lt in self.link_types():
+            if type == lt.name:
+                break
+            if type == lt.outward:
+                type = lt.name
+                break
+            if type == lt.inward:
+                type = lt.name
+                inwardIssue, outwardIssue = outwardIssue, inwardIssue
+                break
+        data = {
+            'type': {'name': type},
+            'inwardIssue': {'key': inwardIssue},
+            'outwardIssue': {'key': outwardIssue},
+        }
+        return self.jira._session.post(self.jira._get_url('issueLink'),
+                                       data=json.dumps(data))
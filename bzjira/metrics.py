@@ -0,0 +1,229 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# upper bounds in seconds, as Prometheus histogram buckets
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300,
+           float('inf'))
+
+# issue ids and keys in a path, e.g. /rest/bug/123/comment,
+# /rest/api/2/issue/ABC-12/transitions, but not the API version
+_ID = re.compile(r'(?<!/api)/(?:[A-Z][A-Z0-9_]*-)?\d+(?=/|$)')
+# file names of Jira attachment downloads
+_ATTACHMENT_NAME = re.compile(r'(/secure/attachment/\{id\})/.*')
+
+
+def endpoint(url, soap_action=None):
+    '''
+    The path of url with ids replaced by {id}, so the requests of one API
+    call share a name. SOAP calls all go to one path and are told apart by
+    their SOAPAction.
+    '''
+    path = _ID.sub('/{id}', urlsplit(url).path)
+    path = _ATTACHMENT_NAME.sub(r'\1/{name}', path)
+    if soap_action:
+        if isinstance(soap_action, bytes):
+            # suds encodes its headers
+            soap_action = soap_action.decode('utf-8', 'replace')
+        path += '#' + soap_action.strip('"').rsplit('/', 1)[-1]
+    return path
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            yield bound, total
+
+
+class _Endpoint(object):
+    def __init__(self):
+        self.statuses = {}
+        self.sent = 0
+        self.received = 0
+        self.latency = Histogram()
+
+
+class Metrics(object):
+    '''
+    Counters of one run: per endpoint (host, method, path) the requests by
+    status, bytes sent and received and a latency histogram of every
+    attempt, and per sync phase a histogram of its durations.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self.endpoints = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def request(self, host, method, path, status, seconds, sent=0,
+                received=0):
+        '''
+        Count one attempt, status is the HTTP status or 'error' when no
+        response came
+        '''
+        with self._lock:
+            e = self.endpoints.get((host, method, path))
+            if e is None:
+                e = self.endpoints[(host, method, path)] = _Endpoint()
+            e.statuses[str(status)] = e.statuses.get(str(status), 0) + 1
+            e.sent += sent
+            e.received += received
+            e.latency.observe(seconds)
+
+    def received(self, host, method, path, count):
+        '''
+        Count bytes of a streamed body, as its caller reads them
+        '''
+        with self._lock:
+            self.endpoints[(host, method, path)].received += count
+
+    def observe_phase(self, name, seconds):
+        with self._lock:
+            if name not in self.phases:
+                self.phases[name] = Histogram()
+            self.phases[name].observe(seconds)
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Time the block as one occurrence of phase name, e.g. 'attach'
+        '''
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.monotonic() - start)
+
+    def report(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'seconds': time.time() - self.started,
+                'endpoints': [dict(
+                    host=host, method=method, path=path,
+                    requests=sum(e.statuses.values()),
+                    statuses=dict(e.statuses),
+                    bytes_sent=e.sent, bytes_received=e.received,
+                    **_summary(e.latency))
+                    for (host, method, path), e in
+                    sorted(self.endpoints.items())],
+                'phases': dict((name, _summary(h))
+                               for name, h in sorted(self.phases.items())),
+            }
+
+    def prometheus(self):
+        '''
+        The counters in the Prometheus text format, for the node exporter
+        textfile collector
+        '''
+        lines = []
+
+        def header(name, kind, help):
+            lines.append('# HELP bzjira_%s %s' % (name, help))
+            lines.append('# TYPE bzjira_%s %s' % (name, kind))
+
+        def histogram(name, labels, h):
+            for bound, count in h.cumulative():
+                lines.append('bzjira_%s_bucket{%sle="%s"} %d' % (
+                    name, labels, _bound(bound), count))
+            lines.append('bzjira_%s_sum{%s} %f' % (name, labels[:-1], h.sum))
+            lines.append('bzjira_%s_count{%s} %d' % (name, labels[:-1],
+                                                      h.count))
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            labels = dict((key, 'host="%s",method="%s",path="%s",' % tuple(
+                _escape(v) for v in key)) for key, _ in endpoints)
+            header('requests_total', 'counter', 'HTTP requests by status')
+            for key, e in endpoints:
+                for status, count in sorted(e.statuses.items()):
+                    lines.append('bzjira_requests_total{%sstatus="%s"} %d' % (
+                        labels[key], status, count))
+            header('request_bytes_sent_total', 'counter', 'Bytes sent')
+            for key, e in endpoints:
+                lines.append('bzjira_request_bytes_sent_total{%s} %d' % (
+                    labels[key][:-1], e.sent))
+            header('request_bytes_received_total', 'counter',
+                   'Bytes received')
+            for key, e in endpoints:
+                lines.append('bzjira_request_bytes_received_total{%s} %d' % (
+                    labels[key][:-1], e.received))
+            header('request_seconds', 'histogram', 'HTTP request latency')
+            for key, e in endpoints:
+                histogram('request_seconds', labels[key], e.latency)
+            header('phase_seconds', 'histogram', 'Time spent per sync phase')
+            for name, h in sorted(self.phases.items()):
+                histogram('phase_seconds', 'phase="%s",' % _escape(name), h)
+            header('last_run_timestamp_seconds', 'gauge',
+                   'Start of the last run')
+            lines.append('bzjira_last_run_timestamp_seconds %f' % self.started)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''
+        Write the report to path, in the Prometheus text format when it ends
+        with .prom, JSON otherwise. Replaced atomically so a collector never
+        reads half a file.
+        '''
+        if path.endswith('.prom'):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.report(), indent=2, sort_keys=True) + '\n'
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+def _summary(h):
+    return dict(count=h.count, seconds=h.sum,
+                buckets=dict((_bound(bound), count)
+                             for bound, count in h.cumulative()))
+
+
+def _bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _escape(value):
+    return (value.replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+_default = Metrics()
+
+
+def default():
+    return _default
+
+
+def request(host, method, path, status, seconds, sent=0, received=0):
+    _default.request(host, method, path, status, seconds, sent, received)
+
+
+def received(host, method, path, count):
+    _default.received(host, method, path, count)
+
+
+def phase(name):
+    return _default.phase(name)
@@ -0,0 +1,155 @@
+import re
+import threading
+
+from . import metrics
+from .batch import Failed
+from .search import search_all
+
+# everything the sync functions read from a mirror issue
+MIRROR_FIELDS = ['summary', 'status', 'issuetype', 'comment', 'attachment',
+                 'issuelinks', 'customfield_10216', 'customfield_14100']
+
+
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _search(jira, jql):
+    return search_all(jira, jql, MIRROR_FIELDS, validate_query=False)
+
+
+def key_jql(keys):
+    return 'key in (%s)' % ', '.join(keys)
+
+
+def field_jql(project_key, field, values):
+    # text fields have no `in`, the ~ matches are filtered by the caller
+    return 'project = %s AND (%s)' % (project_key, ' OR '.join(
+        '"%s" ~ "%s"' % (field, value) for value in values))
+
+
+def find_mirrors(jira, project_key, field, field_id, values, known_keys=None,
+                 link_jql=None, linked_values=None, chunk_size=50):
+    '''
+    Map source values to the Jira issues mirroring them, as {value: issue}.
+    Values without a mirror are left out.
+
+    1. values in known_keys (value -> Jira key, e.g. from the sync state) are
+       fetched with `key in (...)`
+    2. the rest by the text field, e.g. "BugZilla ID", matched exactly
+    3. what is still missing, if link_jql is given, by ORing link_jql % value
+       clauses; linked_values(issue) tells which values an issue links to
+
+    Every step is a chunked JQL search returning MIRROR_FIELDS, so the sync
+    does not need to fetch the issues again.
+    '''
+    known_keys = known_keys or {}
+    found = {}
+
+    by_key = dict((key, value) for value, key in known_keys.items()
+                  if value in values)
+    for chunk in _chunked(by_key, chunk_size):
+        for issue in _search(jira, key_jql(chunk)):
+            if issue.key in by_key:
+                found[by_key[issue.key]] = issue
+
+    missing = [value for value in values if value not in found]
+    for chunk in _chunked(missing, chunk_size):
+        for issue in _search(jira, field_jql(project_key, field, chunk)):
+            value = getattr(issue.fields, field_id, None)
+            if value in chunk and value not in found:
+                found[value] = issue
+
+    if link_jql:
+        missing = [value for value in values if value not in found]
+        for chunk in _chunked(missing, chunk_size):
+            jql = 'project = %s AND (%s)' % (project_key, ' OR '.join(
+                link_jql % value for value in chunk))
+            for issue in _search(jira, jql):
+                for value in linked_values(issue):
+                    if value in chunk and value not in found:
+                        found[value] = issue
+    return found
+
+
+def with_mirrors(items, id_of, resolve, chunk_size=50, unchanged=None):
+    '''
+    Yield (item, mirrors) for every item. resolve(ids) is called once per
+    chunk_size items and the {id: issue} it returns is shared by the chunk.
+    Items for which unchanged(item) is true are left out of resolve, the
+    sync skips them before looking at mirrors.
+    If resolve fails, mirrors is None for the chunk and every sync looks up
+    its own mirror. batch.Failed items are passed on as they are.
+    '''
+    chunks = _chunked(items, chunk_size)
+    while True:
+        # pulling a chunk is where a lazy source, e.g. bz.issues(), fetches
+        with metrics.phase('fetch'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        ids = [id_of(item) for item in chunk if not isinstance(item, Failed)
+               and not (unchanged and unchanged(item))]
+        try:
+            with metrics.phase('lookup'):
+                mirrors = resolve(ids) if ids else {}
+        except Exception as e:
+            print('[WARN] looking up the mirrors of %d issues failed (%r), '
+                  'looking them up one by one' % (len(ids), e))
+            mirrors = None
+        for item in chunk:
+            yield item if isinstance(item, Failed) else (item, mirrors)
+
+
+# first line of comments posted by the sync, e.g.
+#   <bugzilla>/show_bug.cgi?id=1#c3             comment 3
+#   <jira>/browse/X-1?focusedCommentId=3#comment-3
+#   <bugzilla>/attachment.cgi?id=3              big attachment 3
+#   <jira>/secure/attachment/3/<filename>
+MARKERS = [
+    ('comment', re.compile(r'#c(?:omment-)?(\d+)$')),
+    ('attachment', re.compile(r'=(\d+)$')),
+    ('attachment', re.compile(r'/secure/attachment/(\d+)/')),
+]
+
+
+class MirrorIndex(object):
+    '''
+    What a Jira issue already mirrors: (kind, id) items parsed once from the
+    first line of its comments, plus its attachment filenames. The sync adds
+    what it posts, so lookups stay O(1) for the whole issue.
+
+    synced seeds items known from elsewhere, e.g. SyncState.items().
+    '''
+    def __init__(self, issue, synced=()):
+        self._lock = threading.Lock()
+        self.items = set(synced)
+        self.filenames = set(a.filename for a in issue.fields.attachment)
+        for c in issue.fields.comment.comments:
+            self.add_comment(c.body)
+
+    def add_comment(self, body):
+        end = body.find('\n')
+        first_line = (body if end < 0 else body[:end]).rstrip()
+        for kind, marker in MARKERS:
+            m = marker.search(first_line)
+            if m:
+                with self._lock:
+                    self.items.add((kind, m.group(1)))
+
+    def add_file(self, filename):
+        with self._lock:
+            self.filenames.add(filename)
+
+    def has(self, kind, item_id):
+        return (kind, str(item_id)) in self.items
+
+    def has_file(self, filename):
+        return filename in self.filenames
@@ -0,0 +1,82 @@
+from . import spool
+
+
+class Issue(object):
+    '''
+    Source issue as the sync needs it, filled once by the backend, which
+    then drops the raw payload.
+
+    comments do not include the description. last_change is the source
+    last-modified time, compared as an opaque string.
+    '''
+    __slots__ = ('id', 'summary', 'description', 'priority', 'status',
+                 'resolution', 'last_change', 'comments', 'attachments')
+
+    def __init__(self, id, summary, description, priority, status,
+                 resolution, last_change, comments, attachments):
+        self.id = id
+        self.summary = summary
+        self.description = description
+        self.priority = priority
+        self.status = status
+        self.resolution = resolution
+        self.last_change = last_change
+        self.comments = comments
+        self.attachments = attachments
+
+    def __repr__(self):
+        return '<Issue %s>' % self.id
+
+
+class Comment(object):
+    '''
+    id is what the sync marks the mirrored comment with, e.g. the comment
+    number in Bugzilla and the note id in Mantis
+    '''
+    __slots__ = ('id', 'author', 'created', 'text')
+
+    def __init__(self, id, author, created, text):
+        self.id = id
+        self.author = author
+        self.created = created
+        self.text = text
+
+
+class Attachment(object):
+    '''
+    Attachment metadata. The content is only downloaded by open() or
+    chunks(), through source.open_attachment(id) or
+    source.attachment_chunks(id), unless data (base64) came with the issue.
+    '''
+    __slots__ = ('id', 'filename', 'size', '_source', '_data')
+
+    def __init__(self, id, filename, size, source, data=None):
+        self.id = id
+        self.filename = filename
+        self.size = size
+        self._source = source
+        self._data = data
+
+    def __repr__(self):
+        return '<Attachment %s %s>' % (self.id, self.filename)
+
+    @property
+    def content(self):
+        with self.open() as f:
+            return f.read()
+
+    def chunks(self):
+        '''
+        Content as an iterable of bytes, decoded as it is read
+        '''
+        if self._data is not None:
+            return spool.base64_chunks(self._data)
+        return self._source.attachment_chunks(self.id)
+
+    def open(self):
+        '''
+        Content as a spool.Spool
+        '''
+        if self._data is not None:
+            return spool.from_base64(self._data)
+        return self._source.open_attachment(self.id)
@@ -0,0 +1,276 @@
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from io import BytesIO
+from itertools import islice
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+
+# one JSON line per exchange, in the order the responses came
+INDEX = 'exchanges.jsonl'
+BODIES = 'bodies'
+# copy of --state as it was when the recording started
+STATE = 'state.db'
+# response headers not true of the decoded body kept in the recording
+_BODY_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+# query and form fields with credentials, kept out of the recording
+SECRETS = ('password', 'token', 'api_key', 'Bugzilla_password',
+           'Bugzilla_token', 'Bugzilla_api_key')
+REDACTED = 'REDACTED'
+
+
+class NotRecorded(requests.exceptions.RequestException):
+    '''
+    The replayed run sent a request the recorded run did not. Not retried.
+    '''
+
+
+class Recording(object):
+    '''
+    Directory of HTTP exchanges. install() puts the adapter() of the
+    Recorder or Player in front of every adapter of a session, see
+    transport.Transport.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def _body_file(self, digest):
+        return os.path.join(self.path, BODIES, digest[:2], digest[2:])
+
+    def install(self, session):
+        for prefix, adapter in list(session.adapters.items()):
+            session.mount(prefix, self.adapter(adapter))
+        return session
+
+
+class Recorder(Recording):
+    '''
+    Writes every exchange to path: the method, URL and request body digest
+    it is matched by on replay, the response and the seconds it took
+    including reading the body. Bodies are stored once per content.
+    SECRETS in the URL and in form bodies are replaced by REDACTED first,
+    request headers are left out. Responses are kept as sent, tokens and
+    cookies included.
+    '''
+    def __init__(self, path):
+        Recording.__init__(self, path)
+        os.makedirs(os.path.join(path, BODIES), exist_ok=True)
+        self._index = open(os.path.join(path, INDEX), 'w')
+        self._lock = threading.Lock()
+
+    def adapter(self, adapter):
+        return _RecordAdapter(self, adapter)
+
+    def add(self, request, status, reason, headers, content, seconds):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._body_file(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = '%s.%d' % (path, threading.get_ident())
+            with open(tmp, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        self._write(request, seconds, status=status, reason=reason,
+                    headers=headers, content=digest)
+
+    def add_error(self, request, error, seconds):
+        '''
+        Record a request that got no response but error
+        '''
+        self._write(request, seconds, error=type(error).__name__,
+                    reason=str(error))
+
+    def _write(self, request, seconds, **exchange):
+        exchange.update(method=request.method, url=_redacted(request.url),
+                        body=_body_digest(request), seconds=seconds)
+        line = json.dumps(exchange, sort_keys=True) + '\n'
+        with self._lock:
+            self._index.write(line)
+            self._index.flush()
+
+
+class Player(Recording):
+    '''
+    Answers requests from a recording instead of the network. A request gets
+    the first unused exchange with its method, URL and body, else the first
+    unused one with its method and URL (bodies like multipart uploads differ
+    between runs), else the last one again. SECRETS are matched redacted,
+    as recorded. With timing, each answer takes as long as it did when
+    recorded, else it comes at once.
+    '''
+    def __init__(self, path, timing=True):
+        Recording.__init__(self, path)
+        self.timing = timing
+        # (method, url) -> [first unused index, exchanges in order]
+        self._exchanges = {}
+        self._lock = threading.Lock()
+        with open(os.path.join(path, INDEX)) as f:
+            for line in f:
+                exchange = json.loads(line)
+                exchange['used'] = False
+                key = (exchange['method'], exchange['url'])
+                self._exchanges.setdefault(key, [0, []])[1].append(exchange)
+
+    def adapter(self, adapter):
+        return _ReplayAdapter(self)
+
+    def take(self, request):
+        url = _redacted(request.url)
+        body = _body_digest(request)
+        with self._lock:
+            queue = self._exchanges.get((request.method, url))
+            if queue is None:
+                raise NotRecorded('%s %s is not in the recording %s' % (
+                    request.method, url, self.path))
+            first, exchanges = queue
+            unused = [e for e in islice(exchanges, first, None)
+                      if not e['used']]
+            exchange = (next((e for e in unused if e['body'] == body), None)
+                        or next(iter(unused), None) or
+                        exchanges[-1])
+            exchange['used'] = True
+            while first < len(exchanges) and exchanges[first]['used']:
+                first += 1
+            queue[0] = first
+        return exchange
+
+    def content(self, exchange):
+        with open(self._body_file(exchange['content']), 'rb') as f:
+            return f.read()
+
+
+class _RecordAdapter(HTTPAdapter):
+    def __init__(self, recorder, adapter):
+        HTTPAdapter.__init__(self)
+        self.recorder = recorder
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        try:
+            resp = self.adapter.send(request, **kwargs)
+            # streamed bodies too, the caller reads them from memory
+            content = resp.content or b''
+        except requests.exceptions.RequestException as e:
+            self.recorder.add_error(request, e, time.monotonic() - start)
+            raise
+        headers = _raw_headers(resp)
+        self.recorder.add(request, resp.status_code, resp.reason, headers,
+                          content, time.monotonic() - start)
+        return _response(self, request, resp.status_code, resp.reason,
+                         headers, content)
+
+    def close(self):
+        self.adapter.close()
+
+
+class _ReplayAdapter(HTTPAdapter):
+    def __init__(self, player):
+        HTTPAdapter.__init__(self)
+        self.player = player
+
+    def send(self, request, **kwargs):
+        exchange = self.player.take(request)
+        if self.player.timing:
+            time.sleep(exchange['seconds'])
+        if 'error' in exchange:
+            error = getattr(requests.exceptions, exchange['error'], None)
+            if not (isinstance(error, type) and
+                    issubclass(error, requests.exceptions.RequestException)):
+                error = requests.exceptions.ConnectionError
+            raise error(exchange['reason'], request=request)
+        return _response(self, request, exchange['status'],
+                         exchange['reason'], exchange['headers'],
+                         self.player.content(exchange))
+
+
+def _response(adapter, request, status, reason, headers, content):
+    '''
+    requests.Response with the decoded content as its body, readable from
+    raw like one from the network
+    '''
+    raw_headers = HTTPHeaderDict()
+    message = http.client.HTTPMessage()
+    for name, value in headers:
+        if name.lower() not in _BODY_HEADERS:
+            raw_headers.add(name, value)
+            message[name] = value
+    raw_headers['Content-Length'] = str(len(content))
+    raw = HTTPResponse(body=BytesIO(content), headers=raw_headers,
+                       status=status, reason=reason, preload_content=False,
+                       decode_content=False,
+                       original_response=_Original(message))
+    return adapter.build_response(request, raw)
+
+
+class _Original(object):
+    '''
+    Stands in for the http.client response urllib3 wraps, requests reads
+    the cookies from its msg
+    '''
+    def __init__(self, msg):
+        self.msg = msg
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def _redact(query):
+    '''
+    query with the values of SECRETS replaced, as is when it has none
+    '''
+    fields = parse_qsl(query, keep_blank_values=True)
+    if not any(name in SECRETS for name, _ in fields):
+        return query
+    return urlencode([(name, REDACTED if name in SECRETS else value)
+                      for name, value in fields])
+
+
+def _redacted(url):
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(query=_redact(parts.query)))
+
+
+def _body_digest(request):
+    '''
+    _digest() of the request body, with SECRETS redacted from a form
+    '''
+    body = request.body
+    content_type = request.headers.get('Content-Type') or ''
+    if (content_type.startswith('application/x-www-form-urlencoded') and
+            isinstance(body, (str, bytes))):
+        if isinstance(body, bytes):
+            body = body.decode('latin-1')
+        body = _redact(body)
+    return _digest(body)
+
+
+def _digest(body):
+    '''
+    sha256 of a request body, None for no body or a streamed one
+    '''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not isinstance(body, bytes):
+        return None
+    return hashlib.sha256(body).hexdigest()
+
+
+def _raw_headers(resp):
+    '''
+    Response headers as sent, repeated ones like Set-Cookie kept apart
+    '''
+    headers = getattr(resp.raw, 'headers', None)
+    if headers is None:
+        headers = resp.headers
+    return [[name, value] for name, value in headers.items()]
@@ -0,0 +1,31 @@
+def search_all(jira, jql, fields, page_size=100, by_key=False,
+               validate_query=True):
+    '''
+    Yield every issue matched by jql, with only the given fields, fetching
+    one page of page_size issues at a time.
+
+    With by_key, pages follow `key > <last key> ORDER BY key` instead of
+    startAt, so issues that drop out of the result while it is walked (e.g.
+    synced to Resolved) do not shift the pages and make others be skipped.
+    Only for JQL within one project and without ORDER BY.
+    '''
+    start = 0
+    last_key = None
+    while True:
+        if by_key:
+            query = jql
+            if last_key:
+                query = '(%s) AND key > %s' % (jql, last_key)
+            page = jira.search_issues(query + ' ORDER BY key ASC',
+                                      maxResults=page_size, fields=fields,
+                                      validate_query=validate_query)
+        else:
+            page = jira.search_issues(jql, startAt=start,
+                                      maxResults=page_size, fields=fields,
+                                      validate_query=validate_query)
+        for issue in page:
+            yield issue
+        if not page or len(page) >= page.total - (0 if by_key else start):
+            return
+        start += len(page)
+        last_key = page[-1].key
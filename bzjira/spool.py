@@ -0,0 +1,62 @@
+import base64
+from tempfile import SpooledTemporaryFile
+
+SPOOL_MAX_BYTES = 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+_WHITESPACE = b' \t\r\n'
+
+
+class Spool(SpooledTemporaryFile):
+    '''
+    Attachment content on its way to Jira. Up to SPOOL_MAX_BYTES it is kept in
+    memory, above that it moves to a temp file, so memory use does not grow
+    with the attachment size.
+
+    mode, name and len are what jira.add_attachment and requests look at, so
+    the upload is streamed from the spool instead of being read in first.
+    '''
+    mode = 'rb'
+    name = None
+
+    def __init__(self, name=None):
+        super(Spool, self).__init__(max_size=SPOOL_MAX_BYTES)
+        self.name = name
+        self.len = 0
+
+    def write(self, b):
+        self.len += len(b)
+        return super(Spool, self).write(b)
+
+
+def from_chunks(chunks, name=None):
+    spool = Spool(name)
+    for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def base64_chunks(data):
+    '''
+    Decode base64 text a piece at a time, as an iterator of bytes
+    '''
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    rest = b''
+    # a multiple of 4 so every step decodes whole groups
+    step = CHUNK_BYTES // 3 * 4
+    for i in range(0, len(data), step):
+        block = rest + data[i:i + step].translate(None, _WHITESPACE)
+        end = len(block) - len(block) % 4
+        rest = block[end:]
+        yield base64.b64decode(block[:end])
+    if rest:
+        yield base64.b64decode(rest)
+
+
+def from_base64(data, name=None):
+    '''
+    Decode base64 text (as in XML, JSON or SOAP payloads) a piece at a time,
+    so there is never a second full copy of the content in memory.
+    '''
+    return from_chunks(base64_chunks(data), name)
@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS issue (
+    source TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    jira_key TEXT NOT NULL,
+    last_change TEXT,
+    PRIMARY KEY (source, source_id)
+);
+CREATE TABLE IF NOT EXISTS item (
+    source TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    PRIMARY KEY (source, source_id, kind, item_id)
+);
+CREATE TABLE IF NOT EXISTS cursor (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+class SyncState(object):
+    '''
+    Local record of the sync, per source server and source issue id: the
+    Jira key it is mirrored to, the comments and attachments already synced,
+    and the source last-modified time when it was last synced. Also the
+    high-water marks of incremental runs.
+
+    path ':memory:' keeps the record for the current run only.
+    '''
+    def __init__(self, path=':memory:'):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def _query(self, sql, *args):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _update(self, sql, *args):
+        with self._lock, self._db:
+            self._db.execute(sql, args)
+
+    def issue(self, source, source_id):
+        '''
+        (jira_key, last_change) or (None, None) if never synced
+        '''
+        rows = self._query(
+            'SELECT jira_key, last_change FROM issue '
+            'WHERE source = ? AND source_id = ?', source, str(source_id))
+        return rows[0] if rows else (None, None)
+
+    def unchanged(self, source, source_id, last_change):
+        '''
+        Whether the issue is synced as of last_change, so a sync skips it
+        '''
+        key, synced = self.issue(source, source_id)
+        return key is not None and synced == last_change
+
+    def set_issue(self, source, source_id, jira_key, last_change=None):
+        self._update(
+            'INSERT OR REPLACE INTO issue VALUES (?, ?, ?, ?)',
+            source, str(source_id), jira_key, last_change)
+
+    def items(self, source, source_id):
+        '''
+        set of (kind, item_id) already synced, kind is 'comment' or
+        'attachment'
+        '''
+        rows = self._query(
+            'SELECT kind, item_id FROM item '
+            'WHERE source = ? AND source_id = ?', source, str(source_id))
+        return set(rows)
+
+    def add_item(self, source, source_id, kind, item_id):
+        self._update(
+            'INSERT OR IGNORE INTO item VALUES (?, ?, ?, ?)',
+            source, str(source_id), kind, str(item_id))
+
+    def cursor(self, name):
+        rows = self._query('SELECT value FROM cursor WHERE name = ?', name)
+        return rows[0][0] if rows else None
+
+    def set_cursor(self, name, value):
+        self._update('INSERT OR REPLACE INTO cursor VALUES (?, ?)',
+                     name, value)
+
+    def forget_source(self, source):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM issue WHERE source = ?', (source,))
+            self._db.execute('DELETE FROM item WHERE source = ?', (source,))
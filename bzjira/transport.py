@@ -0,0 +1,361 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+from . import metrics
+from .batch import log
+
+RETRY_STATUS = (429, 502, 503, 504)
+# statuses telling the request was not processed, safe to retry a POST on
+RETRY_STATUS_UNSAFE = (429, 503)
+RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# (connect, read) seconds
+TIMEOUT = (10, 120)
+
+
+class Retry(Exception):
+    '''
+    Raised by the send function given to Transport.call() for an attempt
+    worth retrying. When attempts run out, call() returns result if given,
+    else raises error.
+    '''
+    def __init__(self, result=None, error=None, retry_after=None):
+        Exception.__init__(self, error or result)
+        self.result = result
+        self.error = error
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(IOError):
+    pass
+
+
+class RetryPolicy(object):
+    '''
+    Exponential backoff with full jitter: attempt n waits a random time up to
+    backoff * 2 ** n seconds, at most max_backoff. A Retry-After given by the
+    server is waited instead, up to max_retry_after.
+    '''
+    def __init__(self, tries=6, backoff=0.5, max_backoff=30,
+                 max_retry_after=300):
+        self.tries = tries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+
+class TokenBucket(object):
+    '''
+    Allows rate requests per second on average and bursts of up to burst.
+    rate 0 means no limit.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        '''
+        Take a token and return how long to wait before using it. Later
+        callers queue up behind the tokens already taken.
+        '''
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def take(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class CircuitBreaker(object):
+    '''
+    Opens after threshold failed attempts in a row. While open, calls wait
+    instead of piling more load on a server that is down, see
+    Transport.circuit_wait(). After reset seconds calls go through again,
+    the first failure opens it again and the first success closes it.
+    '''
+    def __init__(self, threshold=10, reset=30):
+        self.threshold = threshold
+        self.reset = reset
+        self._failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        '''
+        Seconds until calls go through again, 0 when they do now
+        '''
+        with self._lock:
+            if self._opened is None:
+                return 0
+            return max(0, self.reset - (time.monotonic() - self._opened))
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened = time.monotonic()
+
+
+def parse_retry_after(value):
+    '''
+    Seconds to wait from a Retry-After header, given in seconds or as an
+    HTTP date. None when missing or unreadable.
+    '''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class Transport(object):
+    '''
+    Retry, rate limit and circuit breaker shared by every client talking to
+    the same hosts. Each host gets its own token bucket and breaker.
+
+    rate is the requests per second allowed per host, 0 for no limit.
+    timeout is the (connect, read) timeout of requests not giving their own.
+    No retry is started that would end after deadline, a time.monotonic()
+    value. recording, a replay.Recorder or replay.Player, records or
+    replays the requests of every session installed.
+    '''
+    def __init__(self, policy=None, rate=0, burst=None, threshold=10,
+                 reset=30, timeout=TIMEOUT, deadline=None, recording=None):
+        self.policy = policy or RetryPolicy()
+        self.rate = rate
+        self.timeout = timeout
+        self.deadline = deadline
+        self.burst = burst
+        self.threshold = threshold
+        self.reset = reset
+        self.recording = recording
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def limits(self, host):
+        '''
+        (TokenBucket, CircuitBreaker) of the host
+        '''
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (
+                    TokenBucket(self.rate, self.burst),
+                    CircuitBreaker(self.threshold, self.reset))
+            return self._hosts[host]
+
+    def in_time(self, delay):
+        '''
+        Whether waiting delay seconds still ends before the deadline
+        '''
+        return (self.deadline is None or
+                time.monotonic() + delay < self.deadline)
+
+    def should_retry(self, attempt, delay):
+        '''
+        Whether attempt number attempt may be retried after delay seconds
+        '''
+        return attempt < self.policy.tries and self.in_time(delay)
+
+    def circuit_wait(self, host, breaker):
+        '''
+        Seconds to wait before calling host, until its open breaker lets
+        calls through again. Raises CircuitOpenError when that is after the
+        deadline.
+        '''
+        wait = breaker.remaining()
+        if not wait:
+            return 0
+        if not self.in_time(wait):
+            raise CircuitOpenError(
+                '%s failed %d times in a row, not trying again before the '
+                'deadline' % (host, breaker._failures))
+        log('[WARN] %s failed %d times in a row, waiting %.0fs before '
+            'trying again' % (host, breaker._failures, wait))
+        return wait
+
+    def call(self, url, send, retry_on=RETRY_ERRORS, retry=True):
+        '''
+        Call send() until it neither raises Retry nor one of retry_on, or the
+        policy runs out of tries. retry=False calls it once, still waiting
+        for the rate limit and breaker and counting the outcome in the
+        breaker.
+        '''
+        host = urlsplit(url).netloc
+        bucket, breaker = self.limits(host)
+        attempt = 0
+        while True:
+            wait = self.circuit_wait(host, breaker)
+            if wait:
+                time.sleep(wait)
+                continue
+            bucket.take()
+            try:
+                result = send()
+            except Retry as e:
+                breaker.failure()
+                failure, retry_after = e, e.retry_after
+            except retry_on as e:
+                breaker.failure()
+                failure, retry_after = Retry(error=e), None
+            else:
+                breaker.success()
+                return result
+
+            attempt += 1
+            delay = self.policy.delay(attempt, retry_after)
+            if not retry or not self.should_retry(attempt, delay):
+                if failure.result is not None:
+                    return failure.result
+                raise failure.error
+            log('[WARN] %s failed (%s), retry %d/%d in %.1fs' % (
+                url, failure.error or _reason(failure.result), attempt,
+                self.policy.tries - 1, delay))
+            time.sleep(delay)
+
+    def install(self, session, idempotent=IDEMPOTENT_METHODS):
+        '''
+        Route every request of a requests.Session through call(). Requests
+        whose method is not in idempotent are only retried when the server
+        says it did not process them, and requests streaming a body are sent
+        once since the body cannot be read again, see call().
+        '''
+        if self.recording is not None:
+            self.recording.install(session)
+        request = _measured(session.request)
+
+        def wrapper(method, url, *args, **kwargs):
+            # the JIRA client passes timeout=None explicitly
+            if kwargs.get('timeout') is None:
+                kwargs['timeout'] = self.timeout
+            data = kwargs.get('data')
+            once = data is not None and hasattr(data, 'read')
+            if method.upper() in idempotent or once:
+                statuses, retry_on = RETRY_STATUS, RETRY_ERRORS
+            else:
+                statuses = RETRY_STATUS_UNSAFE
+                retry_on = (requests.exceptions.ConnectTimeout,)
+
+            def send():
+                resp = request(method, url, *args, **kwargs)
+                if resp.status_code in statuses:
+                    resp.close()
+                    raise Retry(result=resp, retry_after=parse_retry_after(
+                        resp.headers.get('Retry-After')))
+                return resp
+            return self.call(url, send, retry_on, retry=not once)
+        session.request = wrapper
+        return session
+
+
+def _measured(request):
+    '''
+    Wrap session.request to count every attempt in metrics. Streamed bodies
+    without a Content-Length are counted as they are read.
+    '''
+    def wrapper(method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        path = metrics.endpoint(
+            url, (kwargs.get('headers') or {}).get('SOAPAction'))
+        start = time.monotonic()
+        try:
+            resp = request(method, url, *args, **kwargs)
+        except Exception:
+            metrics.request(parts.netloc, method.upper(), path, 'error',
+                            time.monotonic() - start)
+            raise
+        received = resp.headers.get('Content-Length')
+        streamed = received is None and kwargs.get('stream')
+        if received is None and not streamed:
+            received = len(resp.content)
+        metrics.request(parts.netloc, method.upper(), path, resp.status_code,
+                        time.monotonic() - start,
+                        int(resp.request.headers.get('Content-Length') or 0),
+                        int(received or 0))
+        if streamed:
+            _counted(resp.raw, lambda count: metrics.received(
+                parts.netloc, method.upper(), path, count))
+        return resp
+    return wrapper
+
+
+def _counted(raw, count):
+    '''
+    Make the urllib3 response raw call count with the length of every piece
+    of body read from it. Chunked bodies are streamed by read_chunked(),
+    which does not go through read().
+    '''
+    read, read_chunked = raw.read, raw.read_chunked
+
+    def counted_read(*args, **kwargs):
+        data = read(*args, **kwargs)
+        count(len(data))
+        return data
+
+    def counted_read_chunked(*args, **kwargs):
+        for data in read_chunked(*args, **kwargs):
+            count(len(data))
+            yield data
+
+    raw.read = counted_read
+    raw.read_chunked = counted_read_chunked
+
+
+def _reason(resp):
+    return '%s %s' % (resp.status_code, resp.reason)
+
+
+_default = Transport()
+
+
+def default():
+    return _default
+
+
+def set_default(transport):
+    '''
+    Replace the transport used by install() and the clients created after
+    this call.
+    '''
+    global _default
+    _default = transport
+
+
+def install(session, idempotent=IDEMPOTENT_METHODS):
+    return _default.install(session, idempotent)
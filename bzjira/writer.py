@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .batch import bind_output
+
+ATTACHMENT_WORKERS = 4
+
+
+class IssueWriter(object):
+    '''
+    Overlaps the writes to one Jira issue. Attachments have no order, so
+    they are downloaded and uploaded on a small pool. Comments are posted
+    one by one in the order they are given, on a lane of their own, while
+    the caller goes on preparing the next ones.
+
+    Used as a context manager. Leaving it waits for every write and raises
+    the first error.
+    '''
+    def __init__(self, workers=ATTACHMENT_WORKERS):
+        self._attachments = ThreadPoolExecutor(max_workers=workers)
+        self._comments = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+
+    def attach(self, func, *args):
+        self._futures.append(
+            self._attachments.submit(bind_output(func), *args))
+
+    def write(self, func, *args):
+        self._futures.append(self._comments.submit(bind_output(func), *args))
+
+    def wait(self):
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._attachments.shutdown()
+            self._comments.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.wait()
+        else:
+            # the caller already failed, just let the writes finish
+            self._attachments.shutdown()
+            self._comments.shutdown()
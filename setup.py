@@ -8,6 +8,9 @@ setup(
     install_requires = [
         'jira==2.0.0', 'xmltodict', 'suds-jurko'
     ],
+    extras_require = {
+        'async': ['aiohttp'],
+    },
     author = "Harry Chen",
     author_email = "cjhecm@gmail.com",
     description=('Convert Bugzilla issue to Jira issue')
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from bzjira.cache import AttachmentCache
+
+
+class AttachmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = AttachmentCache(self.path, max_bytes=30)
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def open(self, attach_id, content):
+        def chunks():
+            self.fetched.append(attach_id)
+            return [content[:4], content[4:]]
+        with self.cache.open('bz', attach_id, chunks) as f:
+            return f.read()
+
+    def cached(self):
+        return sorted(row[0] for row in self.cache._db.execute(
+            'SELECT attach_id FROM attachment'))
+
+    def files(self):
+        return [os.path.join(root, name)
+                for root, _, files in os.walk(self.path) for name in files
+                if not name.startswith('index.db')]
+
+    def put(self, *ids):
+        for attach_id in ids:
+            self.assertEqual(self.open(attach_id, attach_id.encode() * 10),
+                             attach_id.encode() * 10)
+            # distinct use times for the LRU order
+            time.sleep(0.01)
+
+    def test_hit(self):
+        self.put('a')
+        self.assertEqual(self.open('a', b'other'), b'a' * 10)
+        self.assertEqual(self.fetched, ['a'])
+
+    def test_exactly_at_limit(self):
+        self.put('a', 'b', 'c')
+        self.assertEqual(self.cached(), ['a', 'b', 'c'])
+        self.assertEqual(len(self.files()), 3)
+
+    def test_one_over_limit(self):
+        self.put('a', 'b', 'c')
+        self.open('d', b'd')
+        # the least recently used goes, even for one byte over
+        self.assertEqual(self.cached(), ['b', 'c', 'd'])
+        self.assertEqual(len(self.files()), 3)
+
+    def test_use_counts(self):
+        self.put('a', 'b', 'c')
+        self.put('a')
+        self.put('d')
+        self.assertEqual(self.cached(), ['a', 'c', 'd'])
+
+    def test_bigger_than_limit_kept(self):
+        self.put('a')
+        self.assertEqual(self.open('big', b'x' * 40), b'x' * 40)
+        # the one just stored stays for its upload
+        self.assertEqual(self.cached(), ['big'])
+
+    def test_same_content_stored_once(self):
+        self.open('a', b'same' * 5)
+        self.open('b', b'same' * 5)
+        self.assertEqual(self.cached(), ['a', 'b'])
+        self.assertEqual(len(self.files()), 1)
+
+    def test_removed_file_fetched_again(self):
+        self.put('a')
+        for path in self.files():
+            os.unlink(path)
+        self.assertEqual(self.open('a', b'a' * 10), b'a' * 10)
+        self.assertEqual(self.fetched, ['a', 'a'])
+
+    def test_failed_download_leaves_nothing(self):
+        def chunks():
+            yield b'part'
+            raise IOError('connection reset')
+        with self.assertRaises(IOError):
+            self.cache.open('bz', 'a', chunks)
+        self.assertEqual(self.cached(), [])
+        self.assertEqual(self.files(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import re
+import unittest
+from types import SimpleNamespace
+
+from bzjira import bzsync
+from bzjira.batch import Failed
+from bzjira.mirror import MirrorIndex, find_mirrors, with_mirrors
+
+
+class Page(list):
+    total = 0
+
+
+def issue(key, bz_id=None, links=()):
+    return SimpleNamespace(key=key, links=list(links),
+                           fields=SimpleNamespace(customfield_10216=bz_id))
+
+
+class FakeJira(object):
+    '''
+    Answers the JQL find_mirrors() makes: key in (...), "BugZilla ID" ~
+    "..." clauses, which match substrings like Jira's text search, and
+    linkedIssues(...) clauses
+    '''
+    def __init__(self, issues):
+        self.issues = issues
+        self.queries = []
+
+    def search_issues(self, jql, startAt=0, maxResults=50, fields=None,
+                      validate_query=True):
+        self.queries.append(jql)
+        m = re.match(r'key in \((.*)\)$', jql)
+        if m:
+            keys = m.group(1).split(', ')
+            found = [i for i in self.issues if i.key in keys]
+        else:
+            values = re.findall(r'"BugZilla ID" ~ "([^"]*)"', jql)
+            links = re.findall(r'linkedIssues\(([^)]*)\)', jql)
+            found = [i for i in self.issues
+                     if any(v in (i.fields.customfield_10216 or '')
+                            for v in values) or
+                     any(link in i.links for link in links)]
+        page = Page(found[startAt:startAt + maxResults])
+        page.total = len(found)
+        return page
+
+
+def find(jira, values, **kwargs):
+    return find_mirrors(jira, 'P', 'BugZilla ID', 'customfield_10216',
+                        values, **kwargs)
+
+
+class FindMirrorsTest(unittest.TestCase):
+    def test_field_chunks(self):
+        jira = FakeJira([issue('P-%d' % i, str(i)) for i in range(1, 6)])
+        found = find(jira, ['1', '2', '3', '4', '5', '6'], chunk_size=4)
+        self.assertEqual(sorted((v, i.key) for v, i in found.items()),
+                         [(str(i), 'P-%d' % i) for i in range(1, 6)])
+        self.assertEqual(len(jira.queries), 2)
+
+    def test_substring_matches_dropped(self):
+        # "1" ~ matches 12 and 21 too
+        jira = FakeJira([issue('P-12', '12'), issue('P-21', '21')])
+        self.assertEqual(find(jira, ['1']), {})
+
+    def test_known_keys_first(self):
+        jira = FakeJira([issue('P-1', '1'), issue('P-2', '2'),
+                         issue('P-3', '3')])
+        found = find(jira, ['1', '2', '3'], known_keys={'1': 'P-1',
+                                                        '2': 'P-2',
+                                                        '9': 'P-9'})
+        self.assertEqual(dict((v, i.key) for v, i in found.items()),
+                         {'1': 'P-1', '2': 'P-2', '3': 'P-3'})
+        self.assertEqual(jira.queries[0], 'key in (P-1, P-2)')
+        self.assertNotIn('"1"', ' '.join(jira.queries[1:]))
+
+    def test_links_for_the_rest(self):
+        jira = FakeJira([issue('P-1', '1'), issue('P-7', links=['M-2'])])
+        found = find(jira, ['1', '2'], link_jql='issue in linkedIssues(M-%s)',
+                     linked_values=lambda i: [l[2:] for l in i.links])
+        self.assertEqual(dict((v, i.key) for v, i in found.items()),
+                         {'1': 'P-1', '2': 'P-7'})
+        self.assertIn('linkedIssues(M-2)', jira.queries[-1])
+        self.assertNotIn('linkedIssues(M-1)', jira.queries[-1])
+
+
+class WithMirrorsTest(unittest.TestCase):
+    def setUp(self):
+        self.resolved = []
+
+    def resolve(self, ids):
+        self.resolved.append(ids)
+        return dict((i, 'mirror of %s' % i) for i in ids)
+
+    def test_chunks(self):
+        pairs = list(with_mirrors(range(5), str, self.resolve, chunk_size=2))
+        self.assertEqual(self.resolved, [['0', '1'], ['2', '3'], ['4']])
+        self.assertEqual(pairs[3], (3, {'2': 'mirror of 2',
+                                        '3': 'mirror of 3'}))
+
+    def test_unchanged_left_out(self):
+        pairs = list(with_mirrors(range(4), str, self.resolve, chunk_size=2,
+                                  unchanged=lambda item: item != 3))
+        self.assertEqual(self.resolved, [['3']])
+        self.assertEqual([item for item, _ in pairs], [0, 1, 2, 3])
+
+    def test_failed_passed_on(self):
+        failed = Failed('1', IOError('gone'))
+        items = list(with_mirrors([0, failed, 2], str, self.resolve))
+        self.assertEqual(self.resolved, [['0', '2']])
+        self.assertIs(items[1], failed)
+
+    def test_resolve_fails(self):
+        def resolve(ids):
+            raise IOError('search failed')
+        pairs = list(with_mirrors(range(3), str, resolve))
+        self.assertEqual(pairs, [(0, None), (1, None), (2, None)])
+
+
+def jira_issue(comments=(), filenames=()):
+    return SimpleNamespace(fields=SimpleNamespace(
+        attachment=[SimpleNamespace(filename=name) for name in filenames],
+        comment=SimpleNamespace(comments=[SimpleNamespace(body=body)
+                                          for body in comments])))
+
+
+class MirrorIndexTest(unittest.TestCase):
+    BZ = 'https://bugzilla.example.com'
+
+    def test_posted_comments(self):
+        comment = SimpleNamespace(id=3, author='a', created='t',
+                                  text='see #c9 and attachment.cgi?id=8')
+        big = SimpleNamespace(id=12)
+        index = MirrorIndex(jira_issue([
+            bzsync.comment_body(self.BZ, 1, comment),
+            bzsync.big_attachment_comment(self.BZ, big),
+        ]))
+        self.assertTrue(index.has('comment', 3))
+        self.assertTrue(index.has('attachment', '12'))
+        # only the first line is looked at
+        self.assertFalse(index.has('comment', 9))
+        self.assertFalse(index.has('attachment', 8))
+
+    def test_jira_markers(self):
+        index = MirrorIndex(jira_issue([
+            'https://jira.example.com/browse/X-1?focusedCommentId=5'
+            '#comment-5  \nquoted',
+            'https://jira.example.com/secure/attachment/7/log.txt',
+        ]))
+        self.assertTrue(index.has('comment', 5))
+        self.assertTrue(index.has('attachment', 7))
+
+    def test_other_comments(self):
+        index = MirrorIndex(jira_issue(['Fixed in build 12', '#c4 later',
+                                        'id=5 done', '']))
+        self.assertEqual(index.items, set())
+
+    def test_files_and_additions(self):
+        index = MirrorIndex(jira_issue(filenames=['log-1.txt']),
+                            synced=[('comment', '2')])
+        self.assertTrue(index.has_file('log-1.txt'))
+        self.assertTrue(index.has('comment', 2))
+        index.add_comment('%s/show_bug.cgi?id=1#c6\n' % self.BZ)
+        index.add_file('log-2.txt')
+        self.assertTrue(index.has('comment', '6'))
+        self.assertTrue(index.has_file('log-2.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
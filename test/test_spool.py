@@ -0,0 +1,44 @@
+import base64
+import os
+import unittest
+
+from bzjira import spool
+
+
+class Base64ChunksTest(unittest.TestCase):
+    def setUp(self):
+        # 8 base64 characters a step, so groups straddle the steps
+        self.chunk_bytes = spool.CHUNK_BYTES
+        spool.CHUNK_BYTES = 6
+
+    def tearDown(self):
+        spool.CHUNK_BYTES = self.chunk_bytes
+
+    def decode(self, data):
+        return b''.join(spool.base64_chunks(data))
+
+    def test_split_groups(self):
+        for size in range(0, 40):
+            content = os.urandom(size)
+            encoded = base64.b64encode(content)
+            # line breaks as in XML and SOAP payloads, off the group size
+            wrapped = b'\n'.join(encoded[i:i + 7]
+                                 for i in range(0, len(encoded), 7))
+            self.assertEqual(self.decode(wrapped), content, size)
+            self.assertEqual(self.decode(wrapped.decode('ascii')), content)
+
+    def test_padding_in_last_step(self):
+        content = b'0123456789a'
+        self.assertEqual(self.decode(base64.b64encode(content) + b'\r\n'),
+                         content)
+
+    def test_from_base64(self):
+        content = os.urandom(1000)
+        with spool.from_base64(base64.encodebytes(content), 'a.bin') as f:
+            self.assertEqual(f.read(), content)
+            self.assertEqual(f.len, 1000)
+            self.assertEqual(f.name, 'a.bin')
+
+
+if __name__ == '__main__':
+    unittest.main()
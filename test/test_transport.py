@@ -0,0 +1,117 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+from bzjira.transport import (CircuitBreaker, CircuitOpenError, Retry,
+                              RetryPolicy, Transport, parse_retry_after)
+
+BUSY = SimpleNamespace(status_code=503, reason='Service Unavailable')
+
+
+def http_date(seconds):
+    return format_datetime(datetime.now(timezone.utc) +
+                           timedelta(seconds=seconds), usegmt=True)
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after(' 120 '), 120)
+
+    def test_http_date(self):
+        self.assertAlmostEqual(parse_retry_after(http_date(120)), 120,
+                               delta=2)
+
+    def test_http_date_passed(self):
+        self.assertEqual(parse_retry_after(http_date(-60)), 0)
+
+    def test_unreadable(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_capped(self):
+        policy = RetryPolicy(max_retry_after=300)
+        self.assertEqual(policy.delay(1, parse_retry_after(http_date(3600))),
+                         300)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_cycle(self):
+        breaker = CircuitBreaker(threshold=2, reset=0.1)
+        breaker.failure()
+        self.assertEqual(breaker.remaining(), 0)
+        breaker.failure()
+        self.assertGreater(breaker.remaining(), 0)
+        time.sleep(0.1)
+        # half-open: one call goes through, its failure opens it again
+        self.assertEqual(breaker.remaining(), 0)
+        breaker.failure()
+        self.assertGreater(breaker.remaining(), 0)
+        breaker.success()
+        self.assertEqual(breaker.remaining(), 0)
+        breaker.failure()
+        self.assertEqual(breaker.remaining(), 0)
+
+
+class CallTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def send(self, *results):
+        results = list(results)
+
+        def send():
+            self.sent.append(time.monotonic())
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return send
+
+    def test_retry_after(self):
+        t = Transport(RetryPolicy(tries=3))
+        start = time.monotonic()
+        self.assertEqual(t.call('http://x/', self.send(
+            Retry(result=BUSY, retry_after=0.1), 'ok')), 'ok')
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    def test_retry_after_past_deadline(self):
+        # the server asks for more time than the run has left
+        t = Transport(RetryPolicy(tries=3),
+                      deadline=time.monotonic() + 1)
+        start = time.monotonic()
+        self.assertEqual(t.call('http://x/', self.send(
+            Retry(result=BUSY, retry_after=120), 'ok')), BUSY)
+        self.assertEqual(len(self.sent), 1)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_open_circuit_waits(self):
+        t = Transport(RetryPolicy(tries=1), threshold=1, reset=0.1)
+        with self.assertRaises(IOError):
+            t.call('http://x/', self.send(IOError('down')), (IOError,))
+        self.assertEqual(t.call('http://x/', self.send('ok')), 'ok')
+        self.assertGreaterEqual(self.sent[1] - self.sent[0], 0.1)
+
+    def test_open_circuit_past_deadline(self):
+        t = Transport(RetryPolicy(tries=1), threshold=1, reset=30,
+                      deadline=time.monotonic() + 1)
+        with self.assertRaises(IOError):
+            t.call('http://x/', self.send(IOError('down')), (IOError,))
+        start = time.monotonic()
+        with self.assertRaises(CircuitOpenError):
+            t.call('http://x/', self.send('ok'))
+        self.assertEqual(len(self.sent), 1)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_once(self):
+        t = Transport(RetryPolicy(tries=3), threshold=1, reset=30)
+        self.assertEqual(t.call('http://x/', self.send(
+            Retry(result=BUSY), 'ok'), retry=False), BUSY)
+        self.assertEqual(len(self.sent), 1)
+        # still counted by the breaker
+        self.assertGreater(t.limits('x')[1].remaining(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()